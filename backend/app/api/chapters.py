@@ -0,0 +1,285 @@
+"""
+Early-access chapter reading
+Chapters are readable as soon as their file is saved, while the rest of the
+book is still generating. Responses carry ETags so polling clients only
+download a chapter (or the manifest) when it changed.
+"""
+from fastapi import APIRouter, BackgroundTasks, HTTPException, Request
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response
+import logging
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+from app.config import settings
+from app.models import ChapterManifest, ChapterSummary, ChapterRegeneration
+from app.database import fetchrow_fresh, get_db, mark_written
+from app.logging_config import book_id_var
+from app.api.etag import CACHE_HEADERS, text_etag, not_modified
+from services import storage_io
+from services.storage_manager import storage_manager
+from services.full_book_generator import regenerate_chapter
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+def _chapter_file(book_folder: Path, chapter_num: int) -> Path:
+    return book_folder / f"chapter_{chapter_num:02d}.md"
+
+def _file_etag(path: Path) -> Optional[str]:
+    """ETag from size and mtime (chapter files are only ever replaced whole)"""
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+def _parse_book_id(book_id: str) -> str:
+    try:
+        return str(uuid.UUID(book_id))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Book not found")
+
+async def _load_book(book_id: str, with_chapter_1: bool, purchased: bool = False):
+    """
+    Status and outline. chapter_1 is only read for previews, which have no
+    chapter files yet; purchased books serve chapter 1 from chapter_01.md.
+    With `purchased`, a replica row still showing the preview is re-read
+    from the primary (the purchase may have been written by another worker)
+    """
+    book = await fetchrow_fresh(book_id, """
+        SELECT p.status, p.regenerating_chapter, c.outline,
+               CASE WHEN $2 AND p.status = 'preview' THEN c.chapter_1 END AS chapter_1
+        FROM book_progress p
+        JOIN book_content c ON c.book_id = p.book_id
+        WHERE p.book_id = $1
+    """, book_id, with_chapter_1, fresh=(lambda row: row["status"] != "preview") if purchased else None)
+
+    if not book:
+        raise HTTPException(status_code=404, detail="Book not found")
+    return book
+
+async def _load_chapter_1(book_id: str) -> Optional[str]:
+    """Chapter 1 from the database, for books whose chapter_01.md is not written yet"""
+    row = await fetchrow_fresh(
+        book_id, "SELECT chapter_1 FROM book_content WHERE book_id = $1", book_id,
+        fresh=lambda row: row["chapter_1"] is not None
+    )
+    return row["chapter_1"] if row else None
+
+@router.get("/books/{book_id}/chapters", response_model=ChapterManifest)
+async def get_chapter_manifest(book_id: str, request: Request):
+    """
+    Which chapters can be read right now
+    Chapter 1 is always readable; after purchase, every chapter becomes
+    readable as soon as it is generated
+    """
+    try:
+        book_id = _parse_book_id(book_id)
+        book_id_var.set(book_id)
+
+        book = await _load_book(book_id, with_chapter_1=True)
+        status = book["status"]
+        outline = book["outline"]
+
+        if status == "preview":
+            etags: List[Optional[str]] = [None] * len(outline["chapters"])
+        else:
+            book_folder = await storage_manager.open_book(book_id)
+            etags = await storage_io.run(lambda: [
+                _file_etag(_chapter_file(book_folder, number))
+                for number in range(1, len(outline["chapters"]) + 1)
+            ])
+
+        # Chapter 1 is stored with the preview before any file exists
+        if etags and etags[0] is None:
+            chapter_1 = book["chapter_1"] if status == "preview" else await _load_chapter_1(book_id)
+            if chapter_1:
+                etags[0] = text_etag(chapter_1)
+
+        chapters = [
+            ChapterSummary(
+                number=number,
+                title=chapter["title"],
+                available=etag is not None,
+                etag=etag,
+                url=f"/api/books/{book_id}/chapters/{number}" if etag else None,
+                regenerating=number == book["regenerating_chapter"]
+            )
+            for number, (chapter, etag) in enumerate(zip(outline["chapters"], etags), start=1)
+        ]
+
+        manifest_etag = text_etag(
+            f"{status}\0{book['regenerating_chapter']}\0" + "\0".join(etag or "" for etag in etags)
+        )
+        headers = {"ETag": manifest_etag, **CACHE_HEADERS}
+        if not_modified(request, manifest_etag):
+            return Response(status_code=304, headers=headers)
+
+        manifest = ChapterManifest(
+            book_id=book_id,
+            title=outline["title"],
+            status=status,
+            total_chapters=len(chapters),
+            chapters_available=sum(1 for chapter in chapters if chapter.available),
+            chapters=chapters
+        )
+        return ORJSONResponse(content=manifest.model_dump(), headers=headers)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Chapter manifest failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/books/{book_id}/chapters/{chapter_num}")
+async def get_chapter(book_id: str, chapter_num: int, request: Request):
+    """One chapter as markdown, straight from storage"""
+    try:
+        book_id = _parse_book_id(book_id)
+        book_id_var.set(book_id)
+
+        book = await _load_book(book_id, with_chapter_1=(chapter_num == 1), purchased=(chapter_num != 1))
+        if not 1 <= chapter_num <= len(book["outline"]["chapters"]):
+            raise HTTPException(status_code=404, detail="Chapter not found")
+
+        if book["status"] == "preview" and chapter_num != 1:
+            raise HTTPException(status_code=403, detail="Purchase the book to read this chapter")
+
+        content = None
+        etag = None
+        if book["status"] != "preview":
+            book_folder = await storage_manager.open_book(book_id)
+            chapter_file = _chapter_file(book_folder, chapter_num)
+            etag = await storage_io.run(_file_etag, chapter_file)
+            if etag is not None:
+                if not_modified(request, etag):
+                    return Response(status_code=304, headers={"ETag": etag, **CACHE_HEADERS})
+                try:
+                    content = await storage_io.read_text(chapter_file)
+                except FileNotFoundError:
+                    etag = None
+
+        # Chapter 1 is stored with the preview before any file exists
+        if content is None and chapter_num == 1:
+            if book["status"] != "preview":
+                content = await _load_chapter_1(book_id)
+            else:
+                content = book["chapter_1"]
+            content = content or None
+        if content is not None and etag is None:
+            etag = text_etag(content)
+            if not_modified(request, etag):
+                return Response(status_code=304, headers={"ETag": etag, **CACHE_HEADERS})
+
+        if content is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Chapter {chapter_num} is not ready yet. Status: {book['status']}"
+            )
+
+        return PlainTextResponse(
+            content,
+            media_type="text/markdown; charset=utf-8",
+            headers={"ETag": etag, **CACHE_HEADERS}
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Chapter read failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/books/{book_id}/chapters/{chapter_num}/regenerate", response_model=ChapterRegeneration, status_code=202)
+async def regenerate_book_chapter(book_id: str, chapter_num: int, background_tasks: BackgroundTasks):
+    """
+    Regenerate one chapter of a completed book
+    Only that chapter is generated again; the rest of the book, the outline
+    and its research are reused. One regeneration per book at a time, at
+    most MAX_CHAPTER_REGENERATIONS per book, REGENERATION_COOLDOWN_SECONDS apart.
+    """
+    try:
+        book_id = _parse_book_id(book_id)
+        book_id_var.set(book_id)
+
+        pool = await get_db()
+        async with pool.acquire() as conn:
+            # Conditional transition: a concurrent or repeated request can't
+            # win it twice, and the quota is counted in the same statement
+            started = await conn.fetchval("""
+                UPDATE book_progress p
+                SET regenerating_chapter = $2,
+                    current_step = $3,
+                    regenerations = p.regenerations + 1,
+                    regenerated_at = NOW(),
+                    updated_at = NOW()
+                FROM book_content c
+                WHERE p.book_id = $1
+                  AND c.book_id = p.book_id
+                  AND p.status = 'complete'
+                  AND $2 BETWEEN 1 AND jsonb_array_length(c.outline -> 'chapters')
+                  AND (p.regenerating_chapter IS NULL
+                       OR p.updated_at < NOW() - make_interval(secs => $4))
+                  AND p.regenerations < $5
+                  AND (p.regenerated_at IS NULL
+                       OR p.regenerated_at < NOW() - make_interval(secs => $6))
+                RETURNING p.book_id
+            """, book_id, chapter_num, f"Regenerating chapter {chapter_num}...",
+                float(settings.REGENERATION_TIMEOUT_SECONDS),
+                settings.MAX_CHAPTER_REGENERATIONS,
+                float(settings.REGENERATION_COOLDOWN_SECONDS))
+
+            if not started:
+                book = await conn.fetchrow("""
+                    SELECT p.status, p.regenerating_chapter, p.regenerations,
+                           jsonb_array_length(c.outline -> 'chapters') AS chapter_count,
+                           CEIL(EXTRACT(EPOCH FROM p.regenerated_at + make_interval(secs => $2) - NOW()))
+                               AS cooldown_left
+                    FROM book_progress p
+                    JOIN book_content c ON c.book_id = p.book_id
+                    WHERE p.book_id = $1
+                """, book_id, float(settings.REGENERATION_COOLDOWN_SECONDS))
+
+        if not started:
+            if not book:
+                raise HTTPException(status_code=404, detail="Book not found")
+            if not 1 <= chapter_num <= book["chapter_count"]:
+                raise HTTPException(status_code=404, detail="Chapter not found")
+            if book["status"] != "complete":
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Only completed books can regenerate chapters. Status: {book['status']}"
+                )
+            if book["regenerations"] >= settings.MAX_CHAPTER_REGENERATIONS:
+                raise HTTPException(
+                    status_code=403,
+                    detail=f"This book has used all {settings.MAX_CHAPTER_REGENERATIONS} chapter regenerations"
+                )
+            if book["regenerating_chapter"] is not None:
+                raise HTTPException(
+                    status_code=409,
+                    detail=f"Chapter {book['regenerating_chapter']} is already being regenerated"
+                )
+            retry_after = max(int(book["cooldown_left"] or 1), 1)
+            raise HTTPException(
+                status_code=429,
+                detail="A chapter of this book was regenerated recently. Please try again shortly.",
+                headers={"Retry-After": str(retry_after)}
+            )
+
+        mark_written(book_id)
+        background_tasks.add_task(regenerate_chapter, book_id, chapter_num)
+        logger.info(f"🔁 Chapter {chapter_num} regeneration started")
+
+        return ChapterRegeneration(
+            book_id=book_id,
+            chapter=chapter_num,
+            status_url=f"/api/books/{book_id}/chapters",
+            message=f"Chapter {chapter_num} is being regenerated"
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Chapter regeneration request failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,80 +1,118 @@
 """Download endpoint with PDF/DOCX/EPUB conversion"""
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import FileResponse
+import asyncio
 import logging
+import os
 import subprocess
+import uuid
 from pathlib import Path
+from typing import List
 
-from app.database import get_db
+from app.database import fetchrow_fresh
+from app.logging_config import book_id_var
+from services.illustration_generator import illustration_path
+from services import export_builder, storage_io
+from services.pdf_renderer import render_book_pdf
+from services.storage_manager import storage_manager
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-STORAGE_DIR = Path("/app/storage/books")
+async def run_pandoc(source: Path, output_file: Path, *args: str):
+    """
+    Convert with pandoc without blocking the event loop.
+    Output goes to a temp file renamed into place, so concurrent downloads
+    never serve a half-written file.
+    """
+    tmp_file = output_file.with_name(f".{output_file.stem}.{uuid.uuid4().hex}{output_file.suffix}")
+    command: List[str] = ["pandoc", str(source), "-o", str(tmp_file), *args]
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        try:
+            _, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            process.kill()  # client went away
+            raise
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr)
+        await storage_io.run(os.replace, tmp_file, output_file)
+    finally:
+        await storage_io.run(tmp_file.unlink, missing_ok=True)
 
 @router.get("/download/{book_id}")
 async def download_book(book_id: str, format: str = "pdf"):
     """
     Download completed book in PDF, DOCX, or EPUB format
-    Converts markdown to requested format using pandoc
+    DOCX/EPUB are packaged from per-chapter fragments built during
+    generation; PDF chapters are rendered in parallel and stitched.
+    Books without per-chapter files fall back to one pandoc run
     """
     try:
+        book_id_var.set(book_id)
         logger.info(f"Download request: {book_id} (format: {format})")
 
         # Verify book exists and is complete
-        pool = await get_db()
-        async with pool.acquire() as conn:
-            book = await conn.fetchrow("""
-                SELECT status, outline FROM books WHERE book_id = $1
-            """, book_id)
-
-            if not book:
-                raise HTTPException(status_code=404, detail="Book not found")
-
-            if book["status"] != "complete":
-                raise HTTPException(
-                    status_code=400,
-                    detail=f"Book is not ready yet. Status: {book['status']}"
-                )
+        book = await fetchrow_fresh(book_id, """
+            SELECT status FROM book_progress WHERE book_id = $1
+        """, book_id, fresh=lambda row: row["status"] == "complete")
+
+        if not book:
+            raise HTTPException(status_code=404, detail="Book not found")
 
-        # Check if book folder exists
-        book_folder = STORAGE_DIR / book_id
+        if book["status"] != "complete":
+            raise HTTPException(
+                status_code=400,
+                detail=f"Book is not ready yet. Status: {book['status']}"
+            )
+
+        # Check if book folder exists (restores archived books)
+        book_folder = await storage_manager.open_book(book_id)
         markdown_file = book_folder / "full_book.md"
 
-        if not markdown_file.exists():
+        if not await storage_io.exists(markdown_file):
             raise HTTPException(
                 status_code=404,
                 detail="Book file not found. Please contact support."
             )
 
+        # Illustrations are referenced relative to the book folder
+        resource_args = ["--resource-path", str(book_folder)]
+
         # Convert to requested format
         if format == "pdf":
             output_file = book_folder / "book.pdf"
-            subprocess.run([
-                "pandoc",
-                str(markdown_file),
-                "-o", str(output_file),
-                "--pdf-engine=xelatex",
-                "-V", "geometry:margin=1in"
-            ], check=True)
+            if await storage_io.exists(book_folder / "outline.json"):
+                await render_book_pdf(book_folder)
+            else:
+                await run_pandoc(
+                    markdown_file, output_file,
+                    "--pdf-engine=xelatex",
+                    "-V", "geometry:margin=1in",
+                    *resource_args
+                )
             media_type = "application/pdf"
 
         elif format == "docx":
             output_file = book_folder / "book.docx"
-            subprocess.run([
-                "pandoc",
-                str(markdown_file),
-                "-o", str(output_file)
-            ], check=True)
+            if await storage_io.run(export_builder.fragments_ready, book_folder, "docx"):
+                await storage_io.run(export_builder.assemble_docx, book_folder)
+            else:
+                await run_pandoc(markdown_file, output_file, *resource_args)
             media_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
 
         elif format == "epub":
             output_file = book_folder / "book.epub"
-            subprocess.run([
-                "pandoc",
-                str(markdown_file),
-                "-o", str(output_file)
-            ], check=True)
+            if await storage_io.run(export_builder.fragments_ready, book_folder, "epub"):
+                await storage_io.run(export_builder.assemble_epub, book_folder)
+            else:
+                cover_file = illustration_path(book_folder, "cover")
+                cover_args = ["--epub-cover-image", str(cover_file)] if await storage_io.exists(cover_file) else []
+                await run_pandoc(markdown_file, output_file, *resource_args, *cover_args)
             media_type = "application/epub+zip"
 
         else:
@@ -0,0 +1,18 @@
+"""ETag helpers for conditional GET/POST responses"""
+from fastapi import Request
+import hashlib
+
+# Clients must revalidate, but a matching ETag costs no body
+CACHE_HEADERS = {"Cache-Control": "no-cache"}
+
+def text_etag(text: str) -> str:
+    """Strong ETag from the content (or a digest of its version fields)"""
+    return '"' + hashlib.sha256(text.encode("utf-8")).hexdigest()[:32] + '"'
+
+def not_modified(request: Request, etag: str) -> bool:
+    """True if the client's If-None-Match already covers `etag`"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return "*" in tags or etag in tags
@@ -0,0 +1,107 @@
+"""Liveness and readiness probes"""
+from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
+import asyncio
+import logging
+import os
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Any
+
+from app import database
+from app.config import settings
+from services import storage_io
+from services.ai_generator import ai_generator
+from services.model_router import model_router
+from services.work_budget import work_budget
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# A dependency slower than this is reported as not ready
+CHECK_TIMEOUT = 2.0  # seconds
+
+PROBE_BYTES = b"ready"
+
+async def check_database() -> Dict[str, Any]:
+    """Round trip through the pool (never triggers init_db)"""
+    if database.pool is None:
+        return {"ok": False, "error": "pool not initialized"}
+
+    started = time.perf_counter()
+    try:
+        async with database.pool.acquire(timeout=CHECK_TIMEOUT) as conn:
+            await conn.fetchval("SELECT 1", timeout=CHECK_TIMEOUT)
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+    return {
+        "ok": True,
+        "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+        "pool_size": database.pool.get_size(),
+        "pool_idle": database.pool.get_idle_size()
+    }
+
+def _storage_stats() -> Dict[str, Any]:
+    """Write, read back and delete a small probe file (blocking)"""
+    storage_dir = Path(settings.STORAGE_DIR)
+    storage_dir.mkdir(parents=True, exist_ok=True)
+
+    probe = storage_dir / f".ready-{uuid.uuid4().hex}"
+    try:
+        probe.write_bytes(PROBE_BYTES)
+        if probe.read_bytes() != PROBE_BYTES:
+            return {"ok": False, "error": f"{storage_dir} returned different bytes than written"}
+    finally:
+        probe.unlink(missing_ok=True)
+
+    usage = os.statvfs(storage_dir)
+    return {"ok": True, "free_bytes": usage.f_bavail * usage.f_frsize}
+
+async def check_storage() -> Dict[str, Any]:
+    """Storage volume is present and accepts a real write"""
+    started = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(storage_io.run(_storage_stats), CHECK_TIMEOUT)
+    except Exception as e:
+        return {"ok": False, "error": str(e) or type(e).__name__}
+
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+    return result
+
+@router.get("/live")
+async def live():
+    """Liveness: the process is up and serving the event loop"""
+    return {"status": "alive"}
+
+async def _readiness() -> Dict[str, Any]:
+    db_check, storage_check = await asyncio.gather(check_database(), check_storage())
+    is_ready = db_check["ok"] and storage_check["ok"]
+    return {
+        "status": "ready" if is_ready else "not_ready",
+        "checks": {
+            "database": db_check,
+            "storage": storage_check
+        }
+    }
+
+@router.get("/ready")
+async def ready():
+    """Readiness: database pool and storage respond, with measured latencies"""
+    content = await _readiness()
+    return ORJSONResponse(status_code=200 if content["status"] == "ready" else 503, content=content)
+
+@router.get("/health")
+async def health_check():
+    """Detailed health check: /ready plus OpenAI connection reuse, per-route model stats and worker memory"""
+    content = await _readiness()
+    content["openai_transport"] = ai_generator.transport_stats.snapshot()
+    content["model_routes"] = model_router.stats()
+    content["replica"] = {
+        "configured": database.replica_pool is not None,
+        "lag_seconds": database.replica_lag,
+        "serving_reads": database.replica_usable()
+    }
+    content["work_budget"] = work_budget.snapshot()
+    return ORJSONResponse(status_code=200 if content["status"] == "ready" else 503, content=content)
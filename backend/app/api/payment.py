@@ -3,7 +3,7 @@ from fastapi import APIRouter, HTTPException
 import logging
 
 from app.models import PaymentIntentRequest, PaymentIntentResponse
-from app.database import get_db
+from app.database import fetchrow_fresh
 from services.stripe_service import stripe_service
 
 router = APIRouter()
@@ -18,16 +18,14 @@ async def create_payment_intent(request: PaymentIntentRequest):
         logger.info(f"Payment intent request for book: {request.book_id}")
 
         # Get book from database to get base price
-        pool = await get_db()
-        async with pool.acquire() as conn:
-            book = await conn.fetchrow("""
-                SELECT price FROM books WHERE book_id = $1
-            """, request.book_id)
+        book = await fetchrow_fresh(request.book_id, """
+            SELECT price FROM books WHERE book_id = $1
+        """, request.book_id)
 
-            if not book:
-                raise HTTPException(status_code=404, detail="Book not found")
+        if not book:
+            raise HTTPException(status_code=404, detail="Book not found")
 
-            base_price = int(book["price"])
+        base_price = int(book["price"])
 
         # Create Stripe payment intent
         payment_data = await stripe_service.create_payment_intent(
@@ -1,17 +1,36 @@
 """Preview generation endpoint"""
 from fastapi import APIRouter, HTTPException
+import hashlib
 import uuid
-import json
 import logging
 from datetime import datetime
 
 from app.models import BookRequest, BookPreview
-from app.database import get_db
+from app.database import get_db, mark_written
+from app.logging_config import book_id_var
 from services.book_generator import book_generator
+from services.preview_pool import preview_pool
+from services.single_flight import SingleFlight
+from services.admission import admission_controller, CapacityExceeded
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Identical submissions in flight share one generation (and one book_id)
+preview_flight = SingleFlight()
+
+def _preview_key(request: BookRequest) -> str:
+    """Identity of a preview submission (same user, same options)"""
+    fields = [
+        request.user_email.lower(),
+        " ".join(request.topic.lower().split()),
+        request.audience,
+        request.length,
+        request.style,
+        " ".join((request.additional_instructions or "").split()),
+    ]
+    return hashlib.sha256("\0".join(fields).encode("utf-8")).hexdigest()
+
 @router.post("/preview", response_model=BookPreview)
 async def generate_preview(request: BookRequest):
     """
@@ -21,27 +40,58 @@ async def generate_preview(request: BookRequest):
     try:
         logger.info(f"Preview request: {request.topic} for {request.audience}")
 
-        # Generate book_id
-        book_id = str(uuid.uuid4())
+        key = _preview_key(request)
+        if preview_flight.in_flight(key):
+            logger.info("↩️ Duplicate preview request joined in-flight generation")
+
+        return await preview_flight.do(key, lambda: _create_preview(request))
 
-        # Generate preview using MCP
-        preview_data = await book_generator.generate_preview(
-            topic=request.topic,
-            audience=request.audience,
-            length=request.length,
-            style=request.style,
-            additional_instructions=request.additional_instructions or ""
+    except CapacityExceeded as e:
+        logger.warning(f"⚠️ Preview rejected, at capacity (retry after {e.retry_after}s)")
+        raise HTTPException(
+            status_code=503,
+            detail="We're generating a lot of previews right now. Please try again shortly.",
+            headers={"Retry-After": str(e.retry_after)}
         )
+    except Exception as e:
+        logger.error(f"❌ Preview generation failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def _create_preview(request: BookRequest) -> BookPreview:
+    """Generate and store one preview"""
+    # Generate book_id
+    book_id = str(uuid.uuid4())
+    book_id_var.set(book_id)
+
+    # Popular combinations may have a pre-generated preview ready
+    preview_data = None
+    if not (request.additional_instructions or "").strip():
+        preview_data = await preview_pool.claim(
+            request.topic, request.audience, request.length, request.style
+        )
+        if preview_data is not None:
+            logger.info("🧺 Served pre-generated preview")
+
+    # Generate preview using MCP (sheds load when at capacity)
+    if preview_data is None:
+        async with admission_controller.preview_slot():
+            preview_data = await book_generator.generate_preview(
+                topic=request.topic,
+                audience=request.audience,
+                length=request.length,
+                style=request.style,
+                additional_instructions=request.additional_instructions or ""
+            )
 
-        # Store in database
-        pool = await get_db()
-        async with pool.acquire() as conn:
+    # Store in database
+    pool = await get_db()
+    async with pool.acquire() as conn:
+        async with conn.transaction():
             await conn.execute("""
                 INSERT INTO books (
                     book_id, user_email, topic, audience, length, style,
-                    additional_instructions, status, outline, chapter_1,
-                    estimated_pages, price, created_at
-                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
+                    additional_instructions, estimated_pages, price, created_at
+                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
             """,
                 book_id,
                 request.user_email,
@@ -50,25 +100,31 @@ async def generate_preview(request: BookRequest):
                 request.length,
                 request.style,
                 request.additional_instructions,
-                "preview",
-                json.dumps(preview_data["outline"]),
-                preview_data["chapter_1"],
                 preview_data["estimated_pages"],
                 preview_data["price"],
                 datetime.utcnow()
             )
+            await conn.execute("""
+                INSERT INTO book_content (book_id, outline, chapter_1)
+                VALUES ($1, $2, $3)
+            """,
+                book_id,
+                preview_data["outline"],
+                preview_data["chapter_1"]
+            )
+            await conn.execute("""
+                INSERT INTO book_progress (book_id, status)
+                VALUES ($1, $2)
+            """, book_id, "preview")
+    mark_written(book_id)
 
-        logger.info(f"✅ Preview generated: {book_id}")
-
-        return BookPreview(
-            book_id=book_id,
-            outline=preview_data["outline"],
-            chapter_1=preview_data["chapter_1"],
-            estimated_pages=preview_data["estimated_pages"],
-            price=preview_data["price"],
-            estimated_time=preview_data["estimated_time"]
-        )
+    logger.info(f"✅ Preview generated: {book_id}")
 
-    except Exception as e:
-        logger.error(f"❌ Preview generation failed: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    return BookPreview(
+        book_id=book_id,
+        outline=preview_data["outline"],
+        chapter_1=preview_data["chapter_1"],
+        estimated_pages=preview_data["estimated_pages"],
+        price=preview_data["price"],
+        estimated_time=preview_data["estimated_time"]
+    )
@@ -1,25 +1,60 @@
 """Purchase confirmation endpoint"""
 from fastapi import APIRouter, HTTPException, BackgroundTasks
+import asyncpg
 import logging
 from datetime import datetime
 import asyncio
 
 from app.models import PurchaseRequest, PurchaseResponse
-from app.database import get_db
+from app.database import get_db, mark_written
+from app.logging_config import book_id_var
 from services.stripe_service import stripe_service
 from services.full_book_generator import generate_full_book
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Generation may only be started from these states
+STARTABLE_STATUSES = ("preview", "failed")
+
+def _purchase_response(book_id: str, message: str) -> PurchaseResponse:
+    return PurchaseResponse(
+        success=True,
+        book_id=book_id,
+        status_url=f"https://api.k9appbuilder.com/api/status/{book_id}",
+        message=message
+    )
+
 @router.post("/purchase", response_model=PurchaseResponse)
 async def confirm_purchase(request: PurchaseRequest, background_tasks: BackgroundTasks):
     """
     Confirm payment and start full book generation
+
+    Idempotent per book_id/payment_intent_id: the preview -> generating
+    transition is a conditional UPDATE, so retries and double taps never
+    start a second generation of the same book.
     """
     try:
+        book_id_var.set(request.book_id)
         logger.info(f"Purchase request for book: {request.book_id}")
 
+        pool = await get_db()
+
+        # Cheap retry path: already started with this payment, skip Stripe
+        async with pool.acquire() as conn:
+            book = await conn.fetchrow("""
+                SELECT b.payment_intent_id, p.status
+                FROM books b
+                JOIN book_progress p ON p.book_id = b.book_id
+                WHERE b.book_id = $1
+            """, request.book_id)
+
+        if not book:
+            raise HTTPException(status_code=404, detail="Book not found")
+
+        if book["status"] not in STARTABLE_STATUSES:
+            return _already_started(request, book)
+
         # Verify payment with Stripe
         payment_verified = await stripe_service.verify_payment(request.payment_intent_id)
 
@@ -29,39 +64,73 @@ async def confirm_purchase(request: PurchaseRequest, background_tasks: Backgroun
                 detail="Payment not verified. Please complete payment first."
             )
 
-        # Update database
-        pool = await get_db()
+        # Conditional state transition: only one caller can win it
         async with pool.acquire() as conn:
-            await conn.execute("""
-                UPDATE books
-                SET paid = TRUE,
-                    paid_at = $1,
-                    status = 'generating',
-                    progress = 0,
-                    current_step = 'Starting book generation...',
-                    payment_intent_id = $2,
-                    add_ons = $3
-                WHERE book_id = $4
-            """,
-                datetime.utcnow(),
-                request.payment_intent_id,
-                request.add_ons,
-                request.book_id
-            )
+            async with conn.transaction():
+                started = await conn.fetchval("""
+                    UPDATE book_progress
+                    SET status = 'generating',
+                        progress = 0,
+                        current_step = 'Starting book generation...',
+                        started_at = NOW(),
+                        updated_at = NOW()
+                    WHERE book_id = $1 AND status = ANY($2::text[])
+                    RETURNING book_id
+                """, request.book_id, list(STARTABLE_STATUSES))
+
+                if started:
+                    await conn.execute("""
+                        UPDATE books
+                        SET paid = TRUE,
+                            paid_at = $1,
+                            payment_intent_id = $2,
+                            add_ons = $3
+                        WHERE book_id = $4
+                    """,
+                        datetime.utcnow(),
+                        request.payment_intent_id,
+                        request.add_ons,
+                        request.book_id
+                    )
+                else:
+                    book = await conn.fetchrow("""
+                        SELECT b.payment_intent_id, p.status
+                        FROM books b
+                        JOIN book_progress p ON p.book_id = b.book_id
+                        WHERE b.book_id = $1
+                    """, request.book_id)
+
+        mark_written(request.book_id)
+        if not started:
+            # Lost the race to a concurrent duplicate request
+            return _already_started(request, book)
 
         # Trigger background job to generate full book
         background_tasks.add_task(generate_full_book, request.book_id)
         logger.info(f"✅ Purchase confirmed, book generation started: {request.book_id}")
 
-        return PurchaseResponse(
-            success=True,
-            book_id=request.book_id,
-            status_url=f"https://api.k9appbuilder.com/api/status/{request.book_id}",
-            message="Your book is being generated!"
-        )
+        return _purchase_response(request.book_id, "Your book is being generated!")
 
+    except asyncpg.UniqueViolationError:
+        raise HTTPException(
+            status_code=409,
+            detail="This payment has already been used for another book."
+        )
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"❌ Purchase confirmation failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+def _already_started(request: PurchaseRequest, book) -> PurchaseResponse:
+    """Answer a duplicate purchase without starting another generation"""
+    if book["payment_intent_id"] != request.payment_intent_id:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Book was already purchased. Status: {book['status']}"
+        )
+
+    logger.info(f"↩️ Duplicate purchase request, already {book['status']}: {request.book_id}")
+    if book["status"] == "complete":
+        return _purchase_response(request.book_id, "Your book is ready!")
+    return _purchase_response(request.book_id, "Your book is being generated!")
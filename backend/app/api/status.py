@@ -1,13 +1,48 @@
-"""Book status endpoint"""
-from fastapi import APIRouter, HTTPException
+"""Book status endpoints"""
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import ORJSONResponse, Response
 import logging
+import uuid
+from typing import Optional
 
-from app.models import BookStatus
-from app.database import get_db
+from app.models import BookStatus, BatchStatusRequest, BatchStatusResponse
+from app.database import fetch_fresh, fetchrow_fresh
+from app.api.etag import CACHE_HEADERS, text_etag, not_modified
+from services.admission import admission_controller
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Progress intervals are taken on the database clock, which wrote the timestamps
+STATUS_COLUMNS = """
+    book_id, status, progress, current_step,
+    download_url, completed_at, updated_at,
+    EXTRACT(EPOCH FROM updated_at - started_at) AS elapsed_seconds,
+    EXTRACT(EPOCH FROM NOW() - updated_at) AS since_update_seconds
+"""
+
+def _seconds(value) -> Optional[float]:
+    return float(value) if value is not None else None
+
+def _to_status(book) -> BookStatus:
+    estimated_completion = None
+    if book["status"] == "generating":
+        estimated_completion = admission_controller.estimate_completion(
+            book["progress"] or 0,
+            _seconds(book["elapsed_seconds"]),
+            _seconds(book["since_update_seconds"])
+        ).isoformat()
+
+    return BookStatus(
+        book_id=str(book["book_id"]),
+        status=book["status"],
+        progress=book["progress"] or 0,
+        current_step=book["current_step"] or "Processing...",
+        estimated_completion=estimated_completion,
+        completed_at=book["completed_at"].isoformat() if book["completed_at"] else None,
+        download_url=book["download_url"]
+    )
+
 @router.get("/status/{book_id}", response_model=BookStatus)
 async def get_book_status(book_id: str):
     """
@@ -15,29 +50,66 @@ async def get_book_status(book_id: str):
     Frontend polls this every 5 seconds
     """
     try:
-        pool = await get_db()
-        async with pool.acquire() as conn:
-            book = await conn.fetchrow("""
-                SELECT book_id, status, progress, current_step,
-                       download_url, completed_at
-                FROM books
-                WHERE book_id = $1
-            """, book_id)
-
-            if not book:
-                raise HTTPException(status_code=404, detail="Book not found")
-
-            return BookStatus(
-                book_id=str(book["book_id"]),
-                status=book["status"],
-                progress=book["progress"] or 0,
-                current_step=book["current_step"] or "Processing...",
-                completed_at=book["completed_at"].isoformat() if book["completed_at"] else None,
-                download_url=book["download_url"]
-            )
+        book = await fetchrow_fresh(book_id, f"""
+            SELECT {STATUS_COLUMNS}
+            FROM book_progress
+            WHERE book_id = $1
+        """, book_id)
+
+        if not book:
+            raise HTTPException(status_code=404, detail="Book not found")
+
+        return _to_status(book)
 
     except HTTPException:
         raise
     except Exception as e:
         logger.error(f"❌ Status check failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/status/batch", response_model=BatchStatusResponse)
+async def get_book_statuses(request: BatchStatusRequest, http_request: Request):
+    """
+    Status of many books in one query (dashboard)
+    The ETag covers every returned row's state, so an unchanged set answers
+    304 without serializing anything
+    """
+    try:
+        requested = list(dict.fromkeys(request.book_ids))  # dedupe, keep order
+        book_ids = []
+        missing = []
+        for book_id in requested:
+            try:
+                book_ids.append(uuid.UUID(book_id))
+            except ValueError:
+                missing.append(book_id)
+
+        books = []
+        if book_ids:
+            books = await fetch_fresh(book_ids, f"""
+                SELECT {STATUS_COLUMNS}
+                FROM book_progress
+                WHERE book_id = ANY($1::uuid[])
+            """)
+
+        rows = {str(book["book_id"]): book for book in books}
+        missing += [str(book_id) for book_id in book_ids if str(book_id) not in rows]
+        ordered = [rows[str(book_id)] for book_id in book_ids if str(book_id) in rows]
+
+        etag = text_etag("\n".join(
+            f"{book['book_id']}|{book['status']}|{book['progress']}|{book['updated_at'].isoformat()}"
+            f"|{book['completed_at']}|{book['download_url']}"
+            for book in ordered
+        ) + "\n" + "\n".join(missing))
+        headers = {"ETag": etag, **CACHE_HEADERS}
+        if not_modified(http_request, etag):
+            return Response(status_code=304, headers=headers)
+
+        response = BatchStatusResponse(books=[_to_status(book) for book in ordered], missing=missing)
+        return ORJSONResponse(content=response.model_dump(), headers=headers)
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Batch status check failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
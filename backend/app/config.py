@@ -1,14 +1,27 @@
 """Configuration management"""
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Any, Dict, List, Optional
 
 class Settings(BaseSettings):
     # Database
     DATABASE_URL: str
+    DATABASE_REPLICA_URL: Optional[str] = None  # read-only endpoints, when set
+    DATABASE_REPLICA_POOL_SIZE: int = 10
+    REPLICA_MAX_LAG_SECONDS: float = 5.0  # above this, reads go to the primary
+    REPLICA_LAG_CHECK_INTERVAL: float = 5.0
+    REPLICA_READ_AFTER_WRITE_SECONDS: float = 10.0
 
     # MCP URLs
     MVAE_MCP_URL: str = "http://localhost:8765"
     GEMINI_MCP_URL: str = "http://localhost:8766"
+    MCP_MAX_CONNECTIONS: int = 100
+    MCP_MAX_CONNECTIONS_PER_HOST: int = 32
+    MCP_KEEPALIVE_TIMEOUT: float = 30.0  # seconds
+    MCP_REQUEST_TIMEOUT: float = 30.0
+    MCP_LONG_POLL_SECONDS: float = 20.0
+    MCP_POLL_INITIAL_DELAY: float = 0.5
+    MCP_POLL_MAX_DELAY: float = 15.0
+    MCP_AGENT_TIMEOUT: float = 600.0
 
     # API Keys
     ANTHROPIC_API_KEY: str
@@ -20,15 +33,118 @@ class Settings(BaseSettings):
     STRIPE_SECRET_KEY: str
     STRIPE_PUBLISHABLE_KEY: str
 
+    # OpenAI transport (one shared connection pool per worker)
+    OPENAI_BASE_URL: Optional[str] = None  # default API; point at a local fake for testing
+    OPENAI_HTTP2: bool = True
+    OPENAI_MAX_CONNECTIONS: int = 64
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS: int = 32
+    OPENAI_KEEPALIVE_EXPIRY: float = 60.0  # seconds
+    OPENAI_CONNECT_TIMEOUT: float = 5.0
+    OPENAI_WRITE_TIMEOUT: float = 30.0
+    OPENAI_POOL_TIMEOUT: float = 30.0  # waiting for a free connection
+    OPENAI_OUTLINE_READ_TIMEOUT: float = 120.0
+    OPENAI_CHAPTER_READ_TIMEOUT: float = 600.0
+    OPENAI_MAX_RETRIES: int = 2
+
+    # Model routing: "phase:length:add_on" -> models (fallback chain),
+    # max_tokens, temperature. Phases: outline, preview_chapter, chapter.
+    # Most specific match wins; fields not given come from "phase:*:*".
+    OPENAI_DEFAULT_MODEL: str = "gpt-4o"
+    MODEL_ROUTES: Dict[str, Dict[str, Any]] = {
+        "outline:*:*": {"models": ["gpt-4o"], "max_tokens": 4000, "temperature": 0.7},
+        "preview_chapter:*:*": {"models": ["gpt-4o"], "max_tokens": 8000, "temperature": 0.7},
+        "chapter:*:*": {"models": ["gpt-4o"], "max_tokens": 8000, "temperature": 0.7},
+    }
+    # USD per million [input, output] tokens, for per-route cost stats
+    MODEL_PRICES: Dict[str, List[float]] = {
+        "gpt-4o": [2.50, 10.00],
+        "gpt-4o-mini": [0.15, 0.60],
+    }
+
+    # Batch API for non-rush paid books (cheaper, off the live rate limits)
+    BATCH_ENABLED: bool = False
+    BATCH_COLLECT_SECONDS: float = 60.0  # gather chapters from many books per batch
+    BATCH_MAX_REQUESTS: int = 5000
+    BATCH_POLL_INTERVAL: float = 60.0
+    BATCH_COMPLETION_WINDOW: str = "24h"
+    BATCH_SLA_SECONDS: float = 6 * 3600  # switch a chapter to a live call after this
+    BATCH_PRICE_DISCOUNT: float = 0.5
+    BATCH_ORPHAN_SECONDS: float = 600.0  # resume a batch book nobody has polled for this long
+
+    # Idle-time preview pre-generation for popular topic/option combinations
+    PREGEN_ENABLED: bool = False
+    PREGEN_INTERVAL: float = 300.0  # seconds between scheduler runs
+    PREGEN_LOOKBACK_DAYS: int = 7
+    PREGEN_MIN_REQUESTS: int = 3  # requests for a combination to count as hot
+    PREGEN_MAX_COMBINATIONS: int = 20
+    PREGEN_POOL_TARGET: int = 2  # ready previews kept per combination
+    PREGEN_MAX_AGE_HOURS: int = 72
+    PREGEN_DAILY_TOKEN_BUDGET: int = 500_000
+    PREGEN_IDLE_MAX_RECENT_PREVIEWS: int = 2  # previews in the last 5 minutes
+
+    # A chapter regeneration not finished after this is considered abandoned
+    REGENERATION_TIMEOUT_SECONDS: int = 1800
+    # Regenerations allowed per book, and the minimum gap between two of them
+    MAX_CHAPTER_REGENERATIONS: int = 5
+    REGENERATION_COOLDOWN_SECONDS: int = 300
+
     # Storage
     AWS_ACCESS_KEY_ID: Optional[str] = None
     AWS_SECRET_ACCESS_KEY: Optional[str] = None
     S3_BUCKET: str = "aiphdwriter-books"
+    STORAGE_DIR: str = "/app/storage/books"
+    STORAGE_BUDGET_BYTES: int = 20 * 1024**3
+    STORAGE_LOW_WATERMARK: float = 0.9  # evict down to this fraction of the budget
+    STORAGE_ARCHIVE_AFTER_DAYS: int = 30
+    STORAGE_SWEEP_INTERVAL: int = 600  # seconds
+    STORAGE_IO_WORKERS: int = 8  # threads for blocking file I/O
+
+    # Admission control (per worker process)
+    MAX_CONCURRENT_PREVIEWS: int = 8
+    MAX_QUEUED_PREVIEWS: int = 16
+    PREVIEW_QUEUE_TIMEOUT: float = 30.0  # seconds
+    THROUGHPUT_WINDOW_SECONDS: float = 900.0
+    DEFAULT_PREVIEW_SECONDS: float = 60.0  # ETA seeds until measured
+    DEFAULT_CHAPTER_SECONDS: float = 120.0
+
+    # Work budget for full-book generation (per worker process)
+    WORKER_MAX_INFLIGHT_CHAPTERS: int = 24
+    WORKER_MAX_INFLIGHT_BYTES: int = 256 * 1024**2
+    WORKER_CHAPTER_BYTES_ESTIMATE: int = 4 * 1024**2  # prompt, response and export buffers
+
+    # Export: concurrent pandoc/xelatex processes per worker process
+    # (0 = CPU cores divided among the WEB_CONCURRENCY API workers)
+    PDF_RENDER_WORKERS: int = 0
+    WEB_CONCURRENCY: int = 1  # API worker processes on this host (also read by uvicorn)
+
+    # Research (Perplexity agent via MVAE MCP)
+    RESEARCH_ENABLED: bool = False
+    RESEARCH_CACHE_TTL: int = 86400  # seconds
+    RESEARCH_CACHE_MAX_ENTRIES: int = 1000
+    RESEARCH_MAX_CONTEXT_CHARS: int = 2000
+    RESEARCH_WAIT_TIMEOUT: float = 5.0  # extra wait after the outline is ready
+
+    # Illustrations
+    IMAGE_CACHE_DIR: str = "/app/storage/image_cache"
+    ILLUSTRATION_CONCURRENCY: int = 4
+    IMAGE_GENERATION_TIMEOUT: int = 180  # seconds
 
     # App
     ENVIRONMENT: str = "production"
     API_BASE_URL: str = "https://api.k9appbuilder.com"
 
+    # Logging
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "json"  # or "text"
+    LOG_RATE_PER_SECOND: float = 5.0  # per call site in chapter/progress loggers, INFO and below; 0 disables
+    LOG_BURST: int = 20
+    LOG_QUEUE_SIZE: int = 10000
+
+    # Responses smaller than this (bytes) are sent uncompressed
+    COMPRESSION_MINIMUM_SIZE: int = 1024
+    GZIP_COMPRESSION_LEVEL: int = 6
+    BROTLI_QUALITY: int = 4
+
     class Config:
         env_file = ".env"
         case_sensitive = True
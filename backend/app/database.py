@@ -1,90 +1,218 @@
 """Database models and initialization"""
+import asyncio
 import asyncpg
 import logging
-from typing import Optional
+import orjson
+import time
+from typing import Callable, Dict, List, Optional, Sequence
 from app.config import settings
+from app.migrations import run_migrations
 
 logger = logging.getLogger(__name__)
 
 # Database connection pool
 pool: Optional[asyncpg.Pool] = None
 
-async def init_db():
-    """Initialize database connection and create tables"""
-    global pool
+# Optional read replica for read-only endpoints (None = reads use the primary)
+replica_pool: Optional[asyncpg.Pool] = None
+replica_lag: Optional[float] = None  # seconds, None until measured or on error
+_lag_task: Optional[asyncio.Task] = None
+
+# book_id -> monotonic time of this worker's last write for it
+_recent_writes: Dict[str, float] = {}
+
+# NULL when the replica is not streaming from the primary: an idle replica
+# that lost its connection also has receive = replay and must not look caught
+# up. The receiver row exists only while its process runs; status is visible
+# to roles with pg_read_all_stats (NULL otherwise).
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN NOT EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver
+            WHERE status IS NULL OR status = 'streaming'
+        ) THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+async def init_connection(conn: asyncpg.Connection):
+    """
+    Register orjson-backed JSON/JSONB codecs on every pool connection, so
+    callers pass and receive plain dicts instead of json.dumps/json.loads.
+    JSONB binary format is a version byte (1) followed by the JSON text.
+    """
+    await conn.set_type_codec(
+        "jsonb",
+        schema="pg_catalog",
+        encoder=lambda value: b"\x01" + orjson.dumps(value),
+        decoder=lambda data: orjson.loads(data[1:]),
+        format="binary",
+    )
+    await conn.set_type_codec(
+        "json",
+        schema="pg_catalog",
+        encoder=lambda value: orjson.dumps(value).decode("utf-8"),
+        decoder=orjson.loads,
+        format="text",
+    )
+
+async def _create_database():
+    """Create the aiphdwriter database (first boot only)"""
+    conn = await asyncpg.connect(settings.DATABASE_URL.replace('/aiphdwriter', '/postgres'))
+    try:
+        await conn.execute("CREATE DATABASE aiphdwriter")
+        logger.info("✅ Created aiphdwriter database")
+    finally:
+        await conn.close()
 
+async def _create_pool(dsn: Optional[str] = None, max_size: int = 10) -> asyncpg.Pool:
+    return await asyncpg.create_pool(
+        dsn or settings.DATABASE_URL,
+        min_size=2,
+        max_size=max_size,
+        init=init_connection
+    )
+
+async def _init_replica():
+    """Connect the replica pool; reads stay on the primary if it is unavailable"""
+    global replica_pool, _lag_task
     try:
-        # Create connection pool
-        pool = await asyncpg.create_pool(
-            settings.DATABASE_URL,
-            min_size=2,
-            max_size=10
-        )
-        logger.info("✅ Database connection pool created")
+        replica_pool = await _create_pool(settings.DATABASE_REPLICA_URL, settings.DATABASE_REPLICA_POOL_SIZE)
+    except Exception as e:
+        logger.warning(f"⚠️ Read replica unavailable, reads use the primary: {e}")
+        return
 
-        # Create aiphdwriter database if it doesn't exist
-        # First connect to default postgres database
-        conn = await asyncpg.connect(settings.DATABASE_URL.replace('/aiphdwriter', '/postgres'))
+    await _measure_replica_lag()
+    _lag_task = asyncio.create_task(_watch_replica_lag())
+    logger.info("✅ Read replica pool created")
 
-        # Check if database exists
-        db_exists = await conn.fetchval(
-            "SELECT 1 FROM pg_database WHERE datname = 'aiphdwriter'"
-        )
+async def _measure_replica_lag():
+    global replica_lag
+    try:
+        async with replica_pool.acquire(timeout=settings.REPLICA_LAG_CHECK_INTERVAL) as conn:
+            lag = await conn.fetchval(REPLICA_LAG_SQL)
+        if lag is None and replica_lag is not None:
+            logger.warning("⚠️ Replica is not streaming from the primary, reads use the primary")
+        replica_lag = float(lag) if lag is not None else None
+    except Exception as e:
+        replica_lag = None
+        logger.warning(f"⚠️ Replica lag check failed, reads use the primary: {e}")
+
+async def _watch_replica_lag():
+    while True:
+        await asyncio.sleep(settings.REPLICA_LAG_CHECK_INTERVAL)
+        await _measure_replica_lag()
+
+def mark_written(book_id: str):
+    """
+    Record a write for this book: its reads go to the primary for
+    REPLICA_READ_AFTER_WRITE_SECONDS so the writer reads its own writes
+    """
+    if replica_pool is None:
+        return
+    now = time.monotonic()
+    _recent_writes[str(book_id)] = now
+
+    # Keep the map bounded to books written within the window
+    if len(_recent_writes) > 10000:
+        horizon = now - settings.REPLICA_READ_AFTER_WRITE_SECONDS
+        for key in [key for key, at in _recent_writes.items() if at < horizon]:
+            del _recent_writes[key]
+
+def replica_usable(*book_ids: str) -> bool:
+    """Replica is connected, caught up enough, and none of the books was just written here"""
+    if replica_pool is None or replica_lag is None or replica_lag > settings.REPLICA_MAX_LAG_SECONDS:
+        return False
+
+    horizon = time.monotonic() - settings.REPLICA_READ_AFTER_WRITE_SECONDS
+    return all(_recent_writes.get(str(book_id), horizon) <= horizon for book_id in book_ids)
+
+async def get_read_db(*book_ids: str) -> asyncpg.Pool:
+    """Pool for read-only queries about these books: the replica when safe, otherwise the primary"""
+    if replica_usable(*book_ids):
+        return replica_pool
+    return await get_db()
+
+async def fetchrow_fresh(
+    book_id: str,
+    query: str,
+    *args,
+    fresh: Optional[Callable[[asyncpg.Record], bool]] = None
+) -> Optional[asyncpg.Record]:
+    """
+    One row about a book, from the replica when safe. Stickiness only covers
+    this worker's writes, so a missing row (or one `fresh` rejects, e.g. a
+    status behind the one required) is read again from the primary before
+    the caller turns it into a 404/400.
+    """
+    read_pool = await get_read_db(book_id)
+    async with read_pool.acquire() as conn:
+        row = await conn.fetchrow(query, *args)
+
+    if read_pool is replica_pool and (row is None or (fresh is not None and not fresh(row))):
+        async with (await get_db()).acquire() as conn:
+            row = await conn.fetchrow(query, *args)
+    return row
+
+async def fetch_fresh(
+    book_ids: Sequence,
+    query: str,
+    key: str = "book_id"
+) -> List[asyncpg.Record]:
+    """
+    Rows for many books (`query` takes the ids as $1), from the replica when
+    safe; ids the replica has no row for are read again from the primary
+    """
+    read_pool = await get_read_db(*book_ids)
+    async with read_pool.acquire() as conn:
+        rows = await conn.fetch(query, list(book_ids))
+
+    if read_pool is replica_pool:
+        found = {str(row[key]) for row in rows}
+        missing = [book_id for book_id in book_ids if str(book_id) not in found]
+        if missing:
+            async with (await get_db()).acquire() as conn:
+                rows = list(rows) + await conn.fetch(query, missing)
+    return rows
+
+async def close_db():
+    """Stop the lag watcher and close both pools"""
+    global pool, replica_pool, _lag_task
+    if _lag_task is not None:
+        _lag_task.cancel()
+        _lag_task = None
+    for db_pool in (replica_pool, pool):
+        if db_pool is not None:
+            await db_pool.close()
+    pool = None
+    replica_pool = None
 
-        if not db_exists:
-            await conn.execute("CREATE DATABASE aiphdwriter")
-            logger.info("✅ Created aiphdwriter database")
+async def init_db():
+    """Initialize database connection and apply pending migrations"""
+    global pool
 
-        await conn.close()
+    try:
+        # Create connection pool; only touch the postgres database when
+        # the aiphdwriter database does not exist yet
+        try:
+            pool = await _create_pool()
+        except asyncpg.InvalidCatalogNameError:
+            await _create_database()
+            pool = await _create_pool()
+        logger.info("✅ Database connection pool created")
 
-        # Now connect to aiphdwriter database and create tables
+        # Skips all DDL when the schema is already current
         async with pool.acquire() as conn:
-            await conn.execute("""
-                CREATE TABLE IF NOT EXISTS books (
-                    book_id UUID PRIMARY KEY,
-                    user_email VARCHAR(255) NOT NULL,
-
-                    -- Request details
-                    topic TEXT NOT NULL,
-                    audience VARCHAR(50),
-                    length VARCHAR(50),
-                    style VARCHAR(50),
-                    additional_instructions TEXT,
-
-                    -- Status
-                    status VARCHAR(20) DEFAULT 'preview',
-                    paid BOOLEAN DEFAULT FALSE,
-                    progress INTEGER DEFAULT 0,
-                    current_step TEXT,
-
-                    -- Pricing
-                    price DECIMAL(10,2),
-                    total_paid DECIMAL(10,2),
-                    add_ons TEXT[],
-
-                    -- Content
-                    outline JSONB,
-                    chapter_1 TEXT,
-                    estimated_pages INTEGER,
-
-                    -- Files
-                    download_url TEXT,
-
-                    -- Payment
-                    payment_intent_id VARCHAR(255),
-                    stripe_customer_id VARCHAR(255),
-
-                    -- Timestamps
-                    created_at TIMESTAMP DEFAULT NOW(),
-                    paid_at TIMESTAMP,
-                    completed_at TIMESTAMP
-                );
-
-                CREATE INDEX IF NOT EXISTS idx_books_email ON books(user_email);
-                CREATE INDEX IF NOT EXISTS idx_books_status ON books(status);
-                CREATE INDEX IF NOT EXISTS idx_books_created ON books(created_at DESC);
-            """)
-            logger.info("✅ Database tables created/verified")
+            applied = await run_migrations(conn)
+            if applied:
+                logger.info(f"✅ Applied {applied} database migration(s)")
+            else:
+                logger.info("✅ Database schema up to date")
+
+        if settings.DATABASE_REPLICA_URL and replica_pool is None:
+            await _init_replica()
 
     except Exception as e:
         logger.error(f"❌ Database initialization failed: {e}")
@@ -0,0 +1,177 @@
+"""
+Non-blocking logging
+The event loop thread only enqueues records; a background listener thread
+formats them (JSON by default) and writes to stdout
+"""
+import contextvars
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import orjson
+
+from app.config import settings
+
+# Attached to every record logged while set (per asyncio task)
+book_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("book_id", default=None)
+chapter_var: contextvars.ContextVar[Optional[int]] = contextvars.ContextVar("chapter", default=None)
+
+# Loggers uvicorn configures with its own (blocking) handlers
+UVICORN_LOGGERS = ("uvicorn", "uvicorn.error", "uvicorn.access")
+
+# Per-chapter and progress logging; only these are rate limited, so access
+# logs and request-level messages are never dropped under load
+RATE_LIMITED_LOGGERS = (
+    "services.full_book_generator",
+    "services.batch_generator",
+    "services.ai_generator",
+    "services.illustration_generator",
+    "services.export_builder",
+    "services.pdf_renderer",
+)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_rate_limit: Optional["RateLimitFilter"] = None
+
+
+class ContextFilter(logging.Filter):
+    """Copy book_id/chapter context into the record on the calling thread"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "book_id", None) is None:
+            record.book_id = book_id_var.get()
+        if getattr(record, "chapter", None) is None:
+            record.chapter = chapter_var.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per call site for INFO and below, so chatty per-chapter and
+    per-progress messages cost the same at any concurrency. Warnings and
+    errors always pass. The next record let through from a throttled call
+    site carries the number of suppressed records.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        # (pathname, lineno) -> [tokens, last refill, suppressed count]
+        self._buckets: Dict[Tuple[str, int], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING or self.rate <= 0:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [float(self.burst), now, 0]
+
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if tokens < 1:
+                bucket[0] = tokens
+                bucket[2] += 1
+                return False
+
+            bucket[0] = tokens - 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+class EnqueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never formats or blocks on the calling thread"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Records stay in-process, so formatting is left to the listener
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with book_id/chapter fields when present"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("book_id", "chapter", "suppressed"):
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        if record.exc_info:
+            payload["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(payload).decode("utf-8")
+
+
+def setup_logging():
+    """Route all logging (including uvicorn's) through the queue"""
+    global _listener, _rate_limit
+    if _listener is not None:
+        return
+
+    log_queue: queue.Queue = queue.Queue(maxsize=settings.LOG_QUEUE_SIZE)
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if settings.LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        ))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+    queue_handler = EnqueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(settings.LOG_LEVEL)
+
+    for name in UVICORN_LOGGERS:
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers = []
+        uvicorn_logger.propagate = True
+
+    # Logger filters see only records logged on that logger, so one shared
+    # limiter is attached to each chatty module
+    _rate_limit = RateLimitFilter(settings.LOG_RATE_PER_SECOND, settings.LOG_BURST)
+    for name in RATE_LIMITED_LOGGERS:
+        logging.getLogger(name).addFilter(_rate_limit)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener, _rate_limit
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+    if _rate_limit is not None:
+        for name in RATE_LIMITED_LOGGERS:
+            logging.getLogger(name).removeFilter(_rate_limit)
+        _rate_limit = None
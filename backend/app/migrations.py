@@ -0,0 +1,270 @@
+"""Versioned schema migrations"""
+import asyncpg
+import logging
+from typing import Awaitable, Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Arbitrary constant used to serialize migrations across workers
+MIGRATIONS_LOCK_ID = 727001
+
+# Narrow `books` row for request/pricing/payment details. Large immutable
+# content lives in `book_content` and the hot, frequently rewritten progress
+# fields live in `book_progress`, so status polls and progress updates only
+# ever touch small rows (and progress-only updates can stay HOT).
+BOOKS_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS books (
+        book_id UUID PRIMARY KEY,
+        user_email VARCHAR(255) NOT NULL,
+
+        -- Request details
+        topic TEXT NOT NULL,
+        audience VARCHAR(50),
+        length VARCHAR(50),
+        style VARCHAR(50),
+        additional_instructions TEXT,
+
+        -- Status
+        paid BOOLEAN DEFAULT FALSE,
+
+        -- Pricing
+        price DECIMAL(10,2),
+        total_paid DECIMAL(10,2),
+        add_ons TEXT[],
+
+        -- Content
+        estimated_pages INTEGER,
+
+        -- Payment
+        payment_intent_id VARCHAR(255),
+        stripe_customer_id VARCHAR(255),
+
+        -- Timestamps
+        created_at TIMESTAMP DEFAULT NOW(),
+        paid_at TIMESTAMP
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_books_email ON books(user_email);
+    CREATE INDEX IF NOT EXISTS idx_books_created ON books(created_at DESC);
+
+    -- Written once at preview time, read by the full book generator
+    CREATE TABLE IF NOT EXISTS book_content (
+        book_id UUID PRIMARY KEY REFERENCES books(book_id) ON DELETE CASCADE,
+        outline JSONB,
+        chapter_1 TEXT
+    );
+
+    -- Rewritten on every progress update; fillfactor leaves room for HOT
+    CREATE TABLE IF NOT EXISTS book_progress (
+        book_id UUID PRIMARY KEY REFERENCES books(book_id) ON DELETE CASCADE,
+        status VARCHAR(20) NOT NULL DEFAULT 'preview',
+        progress INTEGER NOT NULL DEFAULT 0,
+        current_step TEXT,
+        download_url TEXT,
+        completed_at TIMESTAMP,
+        updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+    ) WITH (fillfactor = 70);
+
+    CREATE INDEX IF NOT EXISTS idx_book_progress_status ON book_progress(status);
+"""
+
+# Columns that lived on the original wide `books` row
+LEGACY_BOOKS_COLUMNS = (
+    "status", "progress", "current_step", "download_url",
+    "completed_at", "outline", "chapter_1",
+)
+
+
+async def migrate_split_books(conn: asyncpg.Connection):
+    """
+    Move content and progress out of a legacy wide `books` table.
+
+    Databases created by earlier versions of init_db keep status, progress,
+    outline and chapter_1 on `books`. Copy them into `book_content` and
+    `book_progress`, then drop the old columns. No-op on fresh databases.
+    """
+    has_legacy_columns = await conn.fetchval("""
+        SELECT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_schema = current_schema()
+              AND table_name = 'books'
+              AND column_name = 'chapter_1'
+        )
+    """)
+    if not has_legacy_columns:
+        return
+
+    logger.info("🔧 Migrating legacy books table to books/book_content/book_progress...")
+
+    await conn.execute("""
+        INSERT INTO book_content (book_id, outline, chapter_1)
+        SELECT book_id, outline, chapter_1 FROM books
+        ON CONFLICT (book_id) DO NOTHING
+    """)
+    await conn.execute("""
+        INSERT INTO book_progress (
+            book_id, status, progress, current_step,
+            download_url, completed_at, updated_at
+        )
+        SELECT book_id, COALESCE(status, 'preview'), COALESCE(progress, 0),
+               current_step, download_url, completed_at,
+               COALESCE(completed_at, paid_at, created_at, NOW())
+        FROM books
+        ON CONFLICT (book_id) DO NOTHING
+    """)
+
+    await conn.execute("DROP INDEX IF EXISTS idx_books_status")
+    await conn.execute(
+        "ALTER TABLE books "
+        + ", ".join(f"DROP COLUMN IF EXISTS {column}" for column in LEGACY_BOOKS_COLUMNS)
+    )
+
+    logger.info("✅ Legacy books table migrated")
+
+
+async def create_books_tables(conn: asyncpg.Connection):
+    await conn.execute(BOOKS_TABLE_SQL)
+
+
+async def add_payment_intent_unique_index(conn: asyncpg.Connection):
+    """One payment buys exactly one book"""
+    await conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_books_payment_intent
+            ON books(payment_intent_id) WHERE payment_intent_id IS NOT NULL
+    """)
+
+
+async def create_preview_pool(conn: asyncpg.Connection):
+    """Ready-made previews for popular topic/option combinations"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS preview_pool (
+            pool_id BIGSERIAL PRIMARY KEY,
+            pool_key CHAR(64) NOT NULL,
+            topic TEXT NOT NULL,
+            audience VARCHAR(50),
+            length VARCHAR(50),
+            style VARCHAR(50),
+            outline JSONB NOT NULL,
+            chapter_1 TEXT NOT NULL,
+            estimated_pages INTEGER,
+            price DECIMAL(10,2),
+            tokens_used INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_preview_pool_key ON preview_pool(pool_key, created_at);
+    """)
+
+
+async def add_regenerating_chapter(conn: asyncpg.Connection):
+    """Chapter being regenerated on a complete book (NULL when none)"""
+    await conn.execute("""
+        ALTER TABLE book_progress ADD COLUMN IF NOT EXISTS regenerating_chapter INTEGER
+    """)
+
+
+async def add_generation_started_at(conn: asyncpg.Connection):
+    """When full generation started, so any worker can estimate its ETA"""
+    await conn.execute("""
+        ALTER TABLE book_progress ADD COLUMN IF NOT EXISTS started_at TIMESTAMP
+    """)
+
+
+async def create_batch_requests(conn: asyncpg.Connection):
+    """Batch API chapter requests in flight, so another worker can resume them"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS batch_requests (
+            custom_id VARCHAR(100) PRIMARY KEY,
+            book_id UUID NOT NULL REFERENCES books(book_id) ON DELETE CASCADE,
+            chapter_num INTEGER NOT NULL,
+            batch_id VARCHAR(100),
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            polled_at TIMESTAMP NOT NULL DEFAULT NOW()
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_batch_requests_book ON batch_requests(book_id, chapter_num);
+        CREATE INDEX IF NOT EXISTS idx_batch_requests_batch ON batch_requests(batch_id);
+    """)
+
+
+async def add_regeneration_quota(conn: asyncpg.Connection):
+    """Per-book chapter regeneration count and time of the last one"""
+    await conn.execute("""
+        ALTER TABLE book_progress ADD COLUMN IF NOT EXISTS regenerations INTEGER NOT NULL DEFAULT 0;
+        ALTER TABLE book_progress ADD COLUMN IF NOT EXISTS regenerated_at TIMESTAMP;
+    """)
+
+
+async def create_pregen_spend(conn: asyncpg.Connection):
+    """Tokens spent on pre-generated previews; kept when pool entries are claimed"""
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS pregen_spend (
+            id BIGSERIAL PRIMARY KEY,
+            tokens INTEGER NOT NULL,
+            spent_at TIMESTAMP NOT NULL
+        );
+
+        CREATE INDEX IF NOT EXISTS idx_pregen_spend_spent_at ON pregen_spend(spent_at);
+    """)
+
+
+# (version, name, migration) - append only, never renumber. Versions 1-3
+# are idempotent because they predate version tracking.
+MIGRATIONS: List[Tuple[int, str, Callable[[asyncpg.Connection], Awaitable[None]]]] = [
+    (1, "create books, book_content and book_progress", create_books_tables),
+    (2, "split legacy wide books table", migrate_split_books),
+    (3, "unique payment intent per book", add_payment_intent_unique_index),
+    (4, "preview pool for pre-generated previews", create_preview_pool),
+    (5, "single-chapter regeneration marker", add_regenerating_chapter),
+    (6, "generation start time for ETAs", add_generation_started_at),
+    (7, "resumable batch requests", create_batch_requests),
+    (8, "chapter regeneration quota", add_regeneration_quota),
+    (9, "persistent pre-generation token spend", create_pregen_spend),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def schema_version(conn: asyncpg.Connection) -> int:
+    """Highest applied migration (0 if version tracking does not exist yet)"""
+    try:
+        return await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    except asyncpg.UndefinedTableError:
+        return 0
+
+
+async def run_migrations(conn: asyncpg.Connection) -> int:
+    """
+    Apply pending migrations; returns how many were applied.
+    When the schema is current this is a single cheap query, so worker
+    boots skip DDL entirely.
+    """
+    if await schema_version(conn) >= LATEST_VERSION:
+        return 0
+
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATIONS_LOCK_ID)
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+            )
+        """)
+
+        # Re-read under the lock: another worker may have just migrated
+        applied = {row["version"] for row in await conn.fetch("SELECT version FROM schema_migrations")}
+
+        count = 0
+        for version, name, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            logger.info(f"🔧 Applying migration {version}: {name}")
+            await migrate(conn)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                version, name
+            )
+            count += 1
+
+    return count
@@ -1,5 +1,5 @@
 """Pydantic models for API requests and responses"""
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, Field
 from typing import List, Optional, Literal
 from datetime import datetime
 
@@ -24,6 +24,9 @@ class PurchaseRequest(BaseModel):
     platform: Literal["ios", "android", "web"] = "web"
     device_token: Optional[str] = None
 
+class BatchStatusRequest(BaseModel):
+    book_ids: List[str] = Field(..., min_length=1, max_length=500)
+
 # Response Models
 class Chapter(BaseModel):
     number: int
@@ -63,3 +66,29 @@ class BookStatus(BaseModel):
     estimated_completion: Optional[str] = None
     completed_at: Optional[str] = None
     download_url: Optional[str] = None
+
+class ChapterSummary(BaseModel):
+    number: int
+    title: str
+    available: bool
+    etag: Optional[str] = None
+    url: Optional[str] = None
+    regenerating: bool = False
+
+class ChapterManifest(BaseModel):
+    book_id: str
+    title: str
+    status: Literal["preview", "generating", "complete", "failed"]
+    total_chapters: int
+    chapters_available: int
+    chapters: List[ChapterSummary]
+
+class BatchStatusResponse(BaseModel):
+    books: List[BookStatus]
+    missing: List[str] = []
+
+class ChapterRegeneration(BaseModel):
+    book_id: str
+    chapter: int
+    status_url: str
+    message: str
@@ -4,35 +4,62 @@ Powered by MVAE MCP and Gemini MCP
 """
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse
 from contextlib import asynccontextmanager
+import asyncio
 import logging
 
-from app.api import preview, payment, purchase, status, download
-from app.database import init_db
+from app.api import preview, payment, purchase, status, download, chapters, health
+from app.config import settings
+from app.logging_config import setup_logging, shutdown_logging
+from app.database import init_db, close_db
+from services.mcp_client import mcp_client
+from services.ai_generator import ai_generator
+from services.batch_generator import batch_generator
+from services.full_book_generator import generate_full_book
+from services.preview_pool import preview_pool
+from services.storage_manager import storage_manager
+from services import storage_io
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # brotli is optional, gzip is always available
+    BrotliMiddleware = None
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize database on startup"""
+    # Queue-based logging, formatted off the event loop; set up here rather
+    # than at import so importing the app has no side effects
+    setup_logging()
     logger.info("🚀 Starting AIPhDWriter API...")
     await init_db()
     logger.info("✅ Database initialized")
+    storage_manager.start()
+    preview_pool.start()
+    batch_generator.start(resume=generate_full_book)
     yield
     logger.info("👋 Shutting down AIPhDWriter API")
+    await preview_pool.stop()
+    await batch_generator.stop()
+    await storage_manager.stop()
+    await asyncio.to_thread(storage_io.shutdown)  # waits for pending writes
+    await close_db()
+    await mcp_client.close()
+    await ai_generator.close()
+    # Last, so every shutdown message above is flushed
+    shutdown_logging()
 
 # Create FastAPI app
 app = FastAPI(
     title="AIPhDWriter API",
     description="AI-powered book generation platform",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # CORS configuration
@@ -42,14 +69,33 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After", "ETag"],
 )
 
+# Response compression (previews carry a full chapter plus the outline)
+if BrotliMiddleware is not None:
+    app.add_middleware(
+        BrotliMiddleware,
+        quality=settings.BROTLI_QUALITY,
+        minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+        gzip_fallback=True,
+        excluded_handlers=[r"^/api/download/"]  # PDF/DOCX/EPUB are already compressed
+    )
+else:
+    app.add_middleware(
+        GZipMiddleware,
+        minimum_size=settings.COMPRESSION_MINIMUM_SIZE,
+        compresslevel=settings.GZIP_COMPRESSION_LEVEL
+    )
+
 # Include routers
 app.include_router(preview.router, prefix="/api", tags=["Preview"])
 app.include_router(payment.router, prefix="/api", tags=["Payment"])
 app.include_router(purchase.router, prefix="/api", tags=["Purchase"])
 app.include_router(status.router, prefix="/api", tags=["Status"])
 app.include_router(download.router, prefix="/api", tags=["Download"])
+app.include_router(chapters.router, prefix="/api", tags=["Chapters"])
+app.include_router(health.router, tags=["Health"])
 
 @app.get("/")
 async def root():
@@ -61,18 +107,6 @@ async def root():
         "mcp_enabled": True
     }
 
-@app.get("/health")
-async def health_check():
-    """Detailed health check"""
-    return {
-        "status": "healthy",
-        "database": "connected",
-        "mcp": {
-            "mvae": "available",
-            "gemini": "available"
-        }
-    }
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
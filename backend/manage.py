@@ -0,0 +1,237 @@
+"""
+AIPhDWriter maintenance CLI
+Runs outside the API workers, e.g.:
+
+    python manage.py reexport --status complete --since 2026-01-01 --formats pdf,epub --workers 8
+"""
+import argparse
+import asyncio
+import json
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+import asyncpg
+
+from app.config import settings
+
+FORMATS = ("pdf", "docx", "epub")
+
+
+async def select_books(
+    status: Optional[str],
+    since: Optional[datetime],
+    until: Optional[datetime],
+    email: Optional[str],
+    limit: Optional[int]
+) -> List[str]:
+    """Book ids matching the filters, oldest first"""
+    conn = await asyncpg.connect(settings.DATABASE_URL)
+    try:
+        rows = await conn.fetch("""
+            SELECT b.book_id
+            FROM books b
+            JOIN book_progress p ON p.book_id = b.book_id
+            WHERE ($1::text IS NULL OR p.status = $1)
+              AND ($2::timestamp IS NULL OR b.created_at >= $2)
+              AND ($3::timestamp IS NULL OR b.created_at < $3)
+              AND ($4::text IS NULL OR lower(b.user_email) = lower($4))
+            ORDER BY b.created_at
+            LIMIT $5
+        """, status, since, until, email, limit)
+    finally:
+        await conn.close()
+    return [str(row["book_id"]) for row in rows]
+
+
+def reexport_book(
+    book_id: str,
+    formats: List[str],
+    rebuild_markdown: bool,
+    force: bool,
+    workers: int = 1
+) -> Tuple[str, Optional[str], Optional[str]]:
+    """
+    Rebuild one book's exports from its chapter files (runs in a worker process).
+    Only formats the book already has are rebuilt. Archived (cold) books are
+    skipped and access times are left alone, so a fleet-wide run does not
+    undo storage eviction. Returns (book_id, error or None, skip reason or None).
+    """
+    # Imported here so each worker process initializes its own modules
+    from services import export_builder
+    from services.full_book_generator import assemble_full_book
+    from services.pdf_renderer import PDF_CACHE_DIR, render_book_pdf, render_slot_count
+    from services.storage_manager import storage_manager, ARCHIVE_NAME
+
+    try:
+        book_folder = storage_manager.book_folder(book_id)
+        if (book_folder / ARCHIVE_NAME).exists():
+            return book_id, None, "archived"
+        if not (book_folder / "outline.json").exists():
+            return book_id, "no outline.json (book predates per-chapter storage)", None
+
+        # Evicted exports are rebuilt on the next download instead
+        formats = [fmt for fmt in formats if (book_folder / f"book.{fmt}").exists()]
+        if not formats and not rebuild_markdown:
+            return book_id, None, "no exports"
+
+        outline = export_builder.load_outline(book_folder)
+        chapter_count = len(outline["chapters"])
+
+        if rebuild_markdown:
+            assemble_full_book(book_folder, outline)
+
+        if force and "pdf" in formats:
+            shutil.rmtree(book_folder / PDF_CACHE_DIR, ignore_errors=True)
+
+        if "docx" in formats or "epub" in formats:
+            # Fragments carry the formatting, so rebuild them from the chapters
+            for chapter_num in range(1, chapter_count + 1):
+                chapter_file = book_folder / f"chapter_{chapter_num:02d}.md"
+                export_builder.build_chapter_fragments(
+                    book_folder, chapter_num, chapter_file.read_text(encoding="utf-8")
+                )
+
+        if "docx" in formats:
+            export_builder.assemble_docx(book_folder)
+        if "epub" in formats:
+            export_builder.assemble_epub(book_folder)
+        if "pdf" in formats:
+            # Share the cores with the other worker processes
+            asyncio.run(render_book_pdf(book_folder, render_slot_count(workers)))
+
+        return book_id, None, None
+
+    except Exception as e:
+        return book_id, f"{type(e).__name__}: {e}", None
+
+
+def load_done(state_file: Path) -> Set[str]:
+    """Book ids already re-exported successfully by a previous run"""
+    done = set()
+    if state_file.exists():
+        for line in state_file.read_text(encoding="utf-8").splitlines():
+            if line.strip():
+                entry = json.loads(line)
+                if entry.get("ok"):
+                    done.add(entry["book_id"])
+    return done
+
+
+def format_eta(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def command_reexport(args: argparse.Namespace) -> int:
+    formats = [fmt.strip() for fmt in args.formats.split(",") if fmt.strip()]
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        print(f"Unknown format(s): {', '.join(sorted(unknown))}", file=sys.stderr)
+        return 2
+    if not formats and not args.rebuild_markdown:
+        print("Nothing to do: pass --formats and/or --rebuild-markdown", file=sys.stderr)
+        return 2
+
+    status = None if args.status == "any" else args.status
+    book_ids = asyncio.run(select_books(status, args.since, args.until, args.email, args.limit))
+    state_file = Path(args.state_file)
+    done = load_done(state_file) if not args.restart else set()
+    pending = [book_id for book_id in book_ids if book_id not in done]
+
+    print(f"{len(book_ids)} books selected, {len(book_ids) - len(pending)} already done, "
+          f"{len(pending)} to process with {args.workers} workers")
+    if not pending:
+        return 0
+
+    interval = 1.0 / args.rate if args.rate > 0 else 0.0
+    max_in_flight = args.workers * 2
+    started = time.monotonic()
+    next_submit = started
+    completed = failed = skipped = 0
+
+    with ProcessPoolExecutor(max_workers=args.workers) as executor, \
+            open(state_file, "a", encoding="utf-8") as state:
+        queue = iter(pending)
+        in_flight = set()
+        exhausted = False
+
+        while in_flight or not exhausted:
+            # Submit at most `rate` books per second, bounded in-flight
+            while not exhausted and len(in_flight) < max_in_flight:
+                now = time.monotonic()
+                if now < next_submit:
+                    break
+                book_id = next(queue, None)
+                if book_id is None:
+                    exhausted = True
+                    break
+                in_flight.add(executor.submit(
+                    reexport_book, book_id, formats, args.rebuild_markdown, args.force, args.workers
+                ))
+                next_submit = max(next_submit + interval, now) if interval else now
+
+            timeout = max(next_submit - time.monotonic(), 0.05) if not exhausted else None
+            finished, in_flight = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+
+            for future in finished:
+                book_id, error, skip = future.result()
+                completed += 1
+                if error:
+                    failed += 1
+                if skip:
+                    skipped += 1
+                state.write(json.dumps({
+                    "book_id": book_id, "ok": error is None, "error": error, "skipped": skip
+                }) + "\n")
+                state.flush()
+
+                elapsed = time.monotonic() - started
+                rate = completed / elapsed if elapsed else 0.0
+                eta = (len(pending) - completed) / rate if rate else 0.0
+                status = f"FAILED {error}" if error else f"skipped ({skip})" if skip else "ok"
+                print(f"[{completed}/{len(pending)}] {book_id} {status} "
+                      f"({rate:.1f}/s, ETA {format_eta(eta)})", flush=True)
+
+    print(f"Done: {completed - failed - skipped} re-exported, {skipped} skipped, {failed} failed. "
+          f"State: {state_file}")
+    return 1 if failed else 0
+
+
+def parse_date(value: str) -> datetime:
+    return datetime.fromisoformat(value)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="AIPhDWriter maintenance commands")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+
+    reexport = subcommands.add_parser(
+        "reexport",
+        help="Rebuild full_book.md and/or converted formats for many books"
+    )
+    reexport.add_argument("--status", default="complete", help="book status filter, or 'any' (default: complete)")
+    reexport.add_argument("--since", type=parse_date, help="created at or after (ISO date)")
+    reexport.add_argument("--until", type=parse_date, help="created before (ISO date)")
+    reexport.add_argument("--email", help="only books of this user")
+    reexport.add_argument("--limit", type=int, help="maximum number of books")
+    reexport.add_argument("--formats", default="", help="comma separated: pdf,docx,epub (rebuilt only where the book has them)")
+    reexport.add_argument("--rebuild-markdown", action="store_true", help="regenerate full_book.md from chapter files")
+    reexport.add_argument("--force", action="store_true", help="ignore cached chapter PDFs")
+    reexport.add_argument("--workers", type=int, default=4, help="worker processes (default: 4)")
+    reexport.add_argument("--rate", type=float, default=0, help="max books started per second (0 = unlimited)")
+    reexport.add_argument("--state-file", default="reexport_state.jsonl", help="progress log used to resume")
+    reexport.add_argument("--restart", action="store_true", help="ignore the state file and process every book")
+    reexport.set_defaults(handler=command_reexport)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,184 @@
+"""
+Admission control and live ETA estimation
+Tracks preview concurrency, queued chapters and measured throughput in this
+worker; sheds preview load when capacity is exhausted
+"""
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Deque, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Weight of the newest sample in the moving averages
+EWMA_ALPHA = 0.2
+
+# Progress a book reports before its first chapter is done
+GENERATION_START_PROGRESS = 5
+
+
+class CapacityExceeded(Exception):
+    """Raised when a preview cannot be admitted; carries a Retry-After hint"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Preview capacity exhausted, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Per-process load shedding and ETA estimates from live measurements"""
+
+    def __init__(self):
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.previews_running = 0
+        self.previews_waiting = 0
+
+        # Chapters queued or generating across all books in this worker.
+        # Batch chapters wait hours on the Batch API, so they are counted
+        # apart and never inflate live ETAs or make the worker look busy.
+        self.chapters_pending = 0
+        self.batch_chapters_pending = 0
+        self._chapter_completions: Deque[float] = deque()
+
+        # Moving averages, seeded with conservative defaults
+        self.preview_seconds = settings.DEFAULT_PREVIEW_SECONDS
+        self.chapter_seconds = settings.DEFAULT_CHAPTER_SECONDS
+
+    # -- Previews ------------------------------------------------------------
+
+    @asynccontextmanager
+    async def preview_slot(self):
+        """
+        Admit one preview. Up to MAX_CONCURRENT_PREVIEWS run at once and up
+        to MAX_QUEUED_PREVIEWS wait; anything beyond is rejected immediately.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.MAX_CONCURRENT_PREVIEWS)
+
+        if self._semaphore.locked() and self.previews_waiting >= settings.MAX_QUEUED_PREVIEWS:
+            raise CapacityExceeded(self.preview_retry_after())
+
+        self.previews_waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), settings.PREVIEW_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise CapacityExceeded(self.preview_retry_after())
+        finally:
+            self.previews_waiting -= 1
+
+        self.previews_running += 1
+        started = time.monotonic()
+        try:
+            yield
+            self.preview_seconds = self._ewma(self.preview_seconds, time.monotonic() - started)
+        finally:
+            self.previews_running -= 1
+            self._semaphore.release()
+
+    def preview_retry_after(self) -> int:
+        """Seconds until a preview slot is likely to free up"""
+        slots = max(settings.MAX_CONCURRENT_PREVIEWS, 1)
+        return max(1, math.ceil(self.preview_seconds * (self.previews_waiting + 1) / slots))
+
+    # -- Chapters ------------------------------------------------------------
+
+    def chapters_queued(self, count: int, batch: bool = False):
+        """A book queued `count` chapters for generation"""
+        if batch:
+            self.batch_chapters_pending += count
+        else:
+            self.chapters_pending += count
+
+    def chapter_finished(self, duration: Optional[float] = None, batch: bool = False):
+        """One chapter left the queue (duration given when a live one succeeded)"""
+        if batch:
+            self.batch_chapters_pending = max(self.batch_chapters_pending - 1, 0)
+            return
+
+        self.chapters_pending = max(self.chapters_pending - 1, 0)
+        if duration is None:
+            return
+
+        now = time.monotonic()
+        self._chapter_completions.append(now)
+        self.chapter_seconds = self._ewma(self.chapter_seconds, duration)
+        self._trim_completions(now)
+
+    def chapter_throughput(self) -> Optional[float]:
+        """Chapters per second completed over the measurement window"""
+        now = time.monotonic()
+        self._trim_completions(now)
+        if len(self._chapter_completions) < 2:
+            return None
+
+        elapsed = max(now - self._chapter_completions[0], 1.0)
+        return len(self._chapter_completions) / elapsed
+
+    def _trim_completions(self, now: float):
+        horizon = now - settings.THROUGHPUT_WINDOW_SECONDS
+        while self._chapter_completions and self._chapter_completions[0] < horizon:
+            self._chapter_completions.popleft()
+
+    # -- ETAs ----------------------------------------------------------------
+
+    def estimate_book_seconds(self, chapters: int) -> float:
+        """
+        Time to generate `chapters` more chapters behind the current queue.
+        Chapters run in parallel, so a book takes at least one chapter's
+        latency; with a backlog, the queue drains at measured throughput.
+        """
+        throughput = self.chapter_throughput()
+        if throughput is None:
+            return self.chapter_seconds
+        return max(self.chapter_seconds, (self.chapters_pending + chapters) / throughput)
+
+    def estimate_preview_seconds(self) -> float:
+        """Time for a new preview given the current preview queue"""
+        slots = max(settings.MAX_CONCURRENT_PREVIEWS, 1)
+        return self.preview_seconds * (1 + self.previews_waiting / slots)
+
+    def estimate_completion(
+        self,
+        progress: int,
+        elapsed: Optional[float] = None,
+        since_update: Optional[float] = None
+    ) -> datetime:
+        """
+        Completion time of a generating book. Extrapolates the book's own
+        persisted progress rate, so any worker gives the same answer; falls
+        back to this worker's throughput until the first chapter has been
+        reported. `elapsed` (started_at -> updated_at) and `since_update`
+        (updated_at -> now) are seconds measured on the database clock,
+        which wrote both timestamps.
+        """
+        now = datetime.utcnow()
+        done = progress - GENERATION_START_PROGRESS
+        if elapsed is not None and since_update is not None and done > 0 and elapsed > 0:
+            remaining = elapsed * max(100 - progress, 0) / done - since_update
+            return now + timedelta(seconds=max(remaining, 0))
+
+        remaining_fraction = max(100 - progress, 0) / 100
+        return now + timedelta(seconds=self.estimate_book_seconds(0) * remaining_fraction)
+
+    @staticmethod
+    def format_duration(seconds: float) -> str:
+        """Human readable ETA ("about 12 minutes")"""
+        minutes = max(1, round(seconds / 60))
+        if minutes < 90:
+            return f"about {minutes} minute{'s' if minutes != 1 else ''}"
+        hours = round(minutes / 60, 1)
+        return f"about {hours:g} hours"
+
+    @staticmethod
+    def _ewma(current: float, sample: float) -> float:
+        return (1 - EWMA_ALPHA) * current + EWMA_ALPHA * sample
+
+
+# Singleton instance
+admission_controller = AdmissionController()
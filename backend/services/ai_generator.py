@@ -1,19 +1,151 @@
 """\nAI Generation Service using OpenAI API\nReplaces placeholder MCP calls with real AI generation\n"""
-import json
 import logging
 import asyncio
-from typing import Dict, Any
+import time
+import openai
+from typing import Dict, Any, List, Optional, Tuple
 from openai import AsyncOpenAI
+from pydantic import BaseModel, ValidationError
 from app.config import settings
+from app.models import BookOutline, Chapter
+from services.json_repair import repair_json_depth, JSONRepairError
+from services.model_router import (
+    model_router, Route, PHASE_OUTLINE, PHASE_PREVIEW_CHAPTER, PHASE_CHAPTER
+)
+from services.openai_transport import TransportStats, build_http_client, phase_timeout
 
 logger = logging.getLogger(__name__)
 
+
+class OutlineChapters(BaseModel):
+    """Continuation of a truncated outline"""
+    chapters: List[Chapter]
+
+
+def _strict_schema(model: type) -> Dict[str, Any]:
+    """JSON schema for strict structured outputs (closed objects, all fields required)"""
+    schema = model.model_json_schema()
+
+    def close(node: Any):
+        if isinstance(node, dict):
+            if node.get("type") == "object":
+                node["additionalProperties"] = False
+                node["required"] = list(node.get("properties", {}))
+            for value in node.values():
+                close(value)
+        elif isinstance(node, list):
+            for value in node:
+                close(value)
+
+    close(schema)
+    return schema
+
+
+OUTLINE_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "book_outline", "strict": True, "schema": _strict_schema(BookOutline)},
+}
+CHAPTERS_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {"name": "outline_chapters", "strict": True, "schema": _strict_schema(OutlineChapters)},
+}
+
+# Containers open inside a chapter object: {"chapters": [{ ... (outline and
+# missing-chapters responses alike)
+CHAPTER_DEPTH = 3
+
+
+def _valid_chapters(items: Any, closed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Chapters that match the Chapter schema, up to the first invalid one.
+    `closed` is how many containers JSON repair closed: from
+    CHAPTER_DEPTH on, the last chapter was cut short and is dropped even
+    if it happens to validate.
+    """
+    chapters = []
+    for item in items if isinstance(items, list) else []:
+        try:
+            chapters.append(Chapter.model_validate(item).model_dump())
+        except ValidationError:
+            return chapters  # the first invalid one is the cut-short one, if any
+    if closed >= CHAPTER_DEPTH and chapters:
+        chapters.pop()
+    return chapters
+
+def _is_retryable(error: openai.APIError) -> bool:
+    """Errors another model (or a later attempt) may not hit"""
+    if isinstance(error, openai.APIConnectionError):  # includes timeouts
+        return True
+    status = getattr(error, "status_code", None)
+    return status is not None and (status == 429 or status >= 500)
+
+def _repair_response(content: Optional[str]) -> Tuple[Any, int]:
+    """Repaired response JSON and how many containers the repair closed"""
+    try:
+        return repair_json_depth(content or "")
+    except JSONRepairError:
+        return None, 0
+
 class AIGenerator:
     """Generate book content using GPT-4"""
 
     def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-        self.model = "gpt-4o"  # Using GPT-4o
+        self._client: Optional[AsyncOpenAI] = None
+        self.transport_stats = TransportStats()
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """Built on first use, not at import, to keep worker startup fast"""
+        if self._client is None:
+            self._client = AsyncOpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                base_url=settings.OPENAI_BASE_URL,
+                max_retries=settings.OPENAI_MAX_RETRIES,
+                http_client=build_http_client(self.transport_stats)
+            )
+        return self._client
+
+    async def close(self):
+        """Close pooled connections on shutdown"""
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def _complete(self, route: Route, prompt: str, timeout: float, **kwargs):
+        """
+        One chat completion on the route's model chain. Each model is tried
+        in order; the next one is used only if the previous call failed with
+        a retryable error (timeout, connection, 429 or 5xx).
+        """
+        last_error: Optional[Exception] = None
+        for index, model in enumerate(route.models):
+            started = time.monotonic()
+            try:
+                response = await self.client.chat.completions.create(
+                    model=model,
+                    max_tokens=route.max_tokens,
+                    temperature=route.temperature,
+                    timeout=phase_timeout(timeout),
+                    messages=[{
+                        "role": "user",
+                        "content": prompt
+                    }],
+                    **kwargs
+                )
+            except openai.APIError as e:
+                model_router.record_failure(route, model, e)
+                if not _is_retryable(e):
+                    raise  # another model won't fix a bad request or bad key
+                last_error = e
+                continue
+
+            model_router.record(
+                route, model, time.monotonic() - started,
+                usage=response.usage, fallback=index > 0
+            )
+            return response
+
+        raise last_error or ValueError(f"Route {route.key} has no models")
 
     async def generate_outline(
         self,
@@ -49,82 +181,135 @@ Generate a JSON response with this exact structure:
   ]
 }}
 
-Make it practical, engaging, and tailored for {audience}. Return ONLY the JSON, no other text."""
+Make it practical, engaging, and tailored for {audience}."""
 
         logger.info(f"Generating outline for '{topic}' with {chapter_count} chapters...")
 
         try:
-            # Call OpenAI API
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                max_tokens=4000,
-                temperature=0.7,
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }]
-            )
+            route = model_router.route(PHASE_OUTLINE, length)
+            outline = await self._request_outline(prompt, route)
+            if outline is None:
+                # Nothing usable (not even the title): one more full attempt
+                logger.warning("⚠️ Outline response unusable, requesting it again")
+                outline = await self._request_outline(prompt, route)
+                if outline is None:
+                    raise ValueError("Model returned no usable outline")
 
-            # Extract JSON from response
-            response_text = response.choices[0].message.content
+            # Short for any reason (truncation, dropped or too few chapters)
+            if len(outline["chapters"]) < chapter_count:
+                outline["chapters"] += await self._request_missing_chapters(
+                    outline, topic, audience, style, chapter_count, route
+                )
 
-            # Try to parse JSON (Claude might wrap it in ```json blocks)
-            if "```json" in response_text:
-                response_text = response_text.split("```json")[1].split("```")[0]
-            elif "```" in response_text:
-                response_text = response_text.split("```")[1].split("```")[0]
+            if not outline["chapters"]:
+                raise ValueError("Outline has no chapters")
 
-            outline = json.loads(response_text.strip())
-            logger.info(f"✅ Outline generated: {outline['title']}")
+            for number, chapter in enumerate(outline["chapters"], start=1):
+                chapter["number"] = number
 
+            logger.info(f"✅ Outline generated: {outline['title']} ({len(outline['chapters'])} chapters)")
             return outline
 
         except Exception as e:
             logger.error(f"❌ Outline generation failed: {e}")
             raise
 
-    async def generate_chapter(
+    async def _request_outline(self, prompt: str, route: Route) -> Optional[Dict[str, Any]]:
+        """
+        One structured-output outline call. Near-valid or truncated JSON is
+        repaired locally; returns None only if the title can't be recovered.
+        """
+        response = await self._complete(
+            route, prompt, settings.OPENAI_OUTLINE_READ_TIMEOUT,
+            response_format=OUTLINE_RESPONSE_FORMAT
+        )
+
+        choice = response.choices[0]
+        if getattr(choice.message, "refusal", None):
+            raise ValueError(f"Model refused the outline: {choice.message.refusal}")
+
+        data, closed = _repair_response(choice.message.content)
+        if closed and data is not None:
+            logger.warning("🩹 Outline JSON was truncated, repaired locally")
+
+        if not isinstance(data, dict) or not isinstance(data.get("title"), str):
+            return None
+
+        return {
+            "title": data["title"],
+            "subtitle": data.get("subtitle") if isinstance(data.get("subtitle"), str) else "",
+            "chapters": _valid_chapters(data.get("chapters"), closed),
+        }
+
+    async def _request_missing_chapters(
         self,
-        chapter_num: int,
-        chapter_info: Dict[str, Any],
-        book_title: str,
+        outline: Dict[str, Any],
+        topic: str,
         audience: str,
-        style: str
-    ) -> str:
-        """Generate one chapter using Claude"""
-
-        prompt = f"""Write Chapter {chapter_num} of the book "{book_title}".
+        style: str,
+        chapter_count: int,
+        route: Route
+    ) -> List[Dict[str, Any]]:
+        """Ask only for the chapters a short outline is missing"""
+        first_missing = len(outline["chapters"]) + 1
+        existing = "\n".join(
+            f"{number}. {chapter['title']}"
+            for number, chapter in enumerate(outline["chapters"], start=1)
+        ) or "(none yet)"
 
-Chapter title: "{chapter_info['title']}"
-Focus: {chapter_info['focus']}
-Key points to cover: {', '.join(chapter_info['key_points'])}
+        prompt = f"""Continue the outline of the book "{outline['title']}: {outline['subtitle']}" about "{topic}".
 
 Target audience: {audience}
 Writing style: {style}
-Length: 3,000-4,000 words
 
-Requirements:
-- Start with an engaging opening (story, scenario, or question)
-- Make it practical with real-world examples
-- Use clear, accessible language for {audience}
-- Include actionable insights
-- End with a strong conclusion
+Chapters already planned:
+{existing}
 
-Write the complete chapter in markdown format."""
+Write ONLY chapters {first_missing} to {chapter_count}, numbered from {first_missing}, each with a title, focus and 3-5 key points. Do not repeat earlier chapters."""
+
+        logger.info(f"Requesting outline chapters {first_missing}-{chapter_count} only...")
+
+        try:
+            response = await self._complete(
+                route, prompt, settings.OPENAI_OUTLINE_READ_TIMEOUT,
+                response_format=CHAPTERS_RESPONSE_FORMAT
+            )
+            choice = response.choices[0]
+            data, closed = _repair_response(choice.message.content)
+            chapters = _valid_chapters(data.get("chapters") if isinstance(data, dict) else None, closed)
+            return chapters[:chapter_count - first_missing + 1]
+
+        except Exception as e:
+            # The outline is still usable, just shorter than planned
+            logger.error(f"⚠️ Missing outline chapters request failed: {e}")
+            return []
+
+    async def generate_chapter(
+        self,
+        chapter_num: int,
+        chapter_info: Dict[str, Any],
+        book_title: str,
+        audience: str,
+        style: str,
+        research_context: str = "",
+        length: Optional[str] = None,
+        add_ons: Optional[List[str]] = None,
+        preview: bool = False
+    ) -> str:
+        """Generate one chapter (model routed by phase, length tier and add-ons)"""
+
+        prompt = self.build_chapter_prompt(
+            chapter_num, chapter_info, book_title, audience, style, research_context
+        )
 
         logger.info(f"Generating Chapter {chapter_num}: {chapter_info['title']}...")
 
         try:
             # Call OpenAI API
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                max_tokens=8000,
-                temperature=0.7,
-                messages=[{
-                    "role": "user",
-                    "content": prompt
-                }]
+            route = model_router.route(
+                PHASE_PREVIEW_CHAPTER if preview else PHASE_CHAPTER, length, add_ons or []
             )
+            response = await self._complete(route, prompt, settings.OPENAI_CHAPTER_READ_TIMEOUT)
 
             chapter_content = response.choices[0].message.content
             word_count = len(chapter_content.split())
@@ -137,6 +322,40 @@ Write the complete chapter in markdown format."""
             logger.error(f"❌ Chapter {chapter_num} generation failed: {e}")
             raise
 
+    def build_chapter_prompt(
+        self,
+        chapter_num: int,
+        chapter_info: Dict[str, Any],
+        book_title: str,
+        audience: str,
+        style: str,
+        research_context: str = ""
+    ) -> str:
+        """Prompt for one chapter (shared by live and batch generation)"""
+        research_section = (
+            f"\nBackground research (use where relevant, do not copy verbatim):\n{research_context}\n"
+            if research_context else ""
+        )
+
+        return f"""Write Chapter {chapter_num} of the book "{book_title}".
+
+Chapter title: "{chapter_info['title']}"
+Focus: {chapter_info['focus']}
+Key points to cover: {', '.join(chapter_info['key_points'])}
+
+Target audience: {audience}
+Writing style: {style}
+Length: 3,000-4,000 words
+
+Requirements:
+- Start with an engaging opening (story, scenario, or question)
+- Make it practical with real-world examples
+- Use clear, accessible language for {audience}
+- Include actionable insights
+- End with a strong conclusion
+{research_section}
+Write the complete chapter in markdown format."""
+
     def _get_chapter_count(self, length: str) -> int:
         """Get chapter count based on book length"""
         length_map = {
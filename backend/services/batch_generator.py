@@ -0,0 +1,436 @@
+"""
+Batch API chapter generation
+Chapter requests from many non-rush books are collected into one Batch API
+input file, submitted and polled; results resolve the waiting chapters.
+A chapter switches to a live call if its batch fails or the SLA is at risk.
+Requests are recorded in batch_requests, so when a worker stops mid-batch
+another one resumes the book and picks up polling where it left off.
+"""
+import asyncio
+import dataclasses
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from types import SimpleNamespace
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+import orjson
+
+from app.config import settings
+from app.database import get_db
+from services.ai_generator import ai_generator
+from services.model_router import model_router, Route, PHASE_CHAPTER
+from services.work_budget import work_budget
+
+logger = logging.getLogger(__name__)
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_BATCH_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+
+class BatchRequestFailed(Exception):
+    """The batch did not produce a result for this request"""
+
+
+@dataclass
+class PendingRequest:
+    custom_id: str
+    book_id: str
+    chapter_num: int
+    route: Route
+    prompt: str
+    future: asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+def use_batch(add_ons: Optional[List[str]]) -> bool:
+    """Batch mode applies to paid books without the rush add-on"""
+    return settings.BATCH_ENABLED and "rush" not in (add_ons or [])
+
+
+class BatchGenerator:
+    """Collects chapter requests in this worker and runs them through the Batch API"""
+
+    def __init__(self):
+        self._pending: List[PendingRequest] = []
+        # custom_id -> request, for every request submitted and not yet resolved
+        self._submitted: Dict[str, PendingRequest] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._poll_tasks: Dict[str, asyncio.Task] = {}
+        # batch_id -> custom_ids this worker waits on in that batch
+        self._batches: Dict[str, Set[str]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._recovery_task: Optional[asyncio.Task] = None
+        self._resumed: Set[asyncio.Task] = set()
+        self._stopping = False
+
+    async def generate_chapter(
+        self,
+        book_id: str,
+        chapter_num: int,
+        chapter_info: Dict[str, Any],
+        book_title: str,
+        audience: str,
+        style: str,
+        research_context: str = "",
+        length: Optional[str] = None,
+        add_ons: Optional[List[str]] = None
+    ) -> str:
+        """
+        Same contract as AIGenerator.generate_chapter, via the Batch API.
+        Falls back to a live call when the batch fails or the chapter has
+        waited longer than BATCH_SLA_SECONDS. A request a stopped worker
+        already submitted for this chapter is resumed instead of resent.
+        """
+        route = model_router.route(PHASE_CHAPTER, length, add_ons or [])
+        request = await self._resume(book_id, chapter_num, route)
+        if request is None:
+            request = PendingRequest(
+                custom_id=f"chapter-{chapter_num}-{uuid.uuid4().hex}",
+                book_id=book_id,
+                chapter_num=chapter_num,
+                route=route,
+                prompt=ai_generator.build_chapter_prompt(
+                    chapter_num, chapter_info, book_title, audience, style, research_context
+                ),
+                future=asyncio.get_running_loop().create_future()
+            )
+            await self._record(request)
+            self._enqueue(request)
+            logger.info(f"🗂️ Chapter {chapter_num} queued for batch generation")
+
+        try:
+            sla_left = settings.BATCH_SLA_SECONDS - (time.monotonic() - request.queued_at)
+            content = await asyncio.wait_for(asyncio.shield(request.future), max(sla_left, 0))
+            logger.info(f"✅ Chapter {chapter_num} generated in batch: {len(content.split())} words")
+            return content
+        except asyncio.TimeoutError:
+            logger.warning(f"⏱️ Chapter {chapter_num} batch SLA at risk, switching to a live call")
+        except BatchRequestFailed as e:
+            logger.warning(f"⚠️ Chapter {chapter_num} batch request failed ({e}), switching to a live call")
+        finally:
+            self._forget(request)
+            # A stopping worker leaves the record for another worker to resume
+            if not self._stopping:
+                await self._unrecord(request)
+
+        # Live fallback competes with live books for this worker's budget
+        async with work_budget.chapter():
+            return await ai_generator.generate_chapter(
+                chapter_num=chapter_num,
+                chapter_info=chapter_info,
+                book_title=book_title,
+                audience=audience,
+                style=style,
+                research_context=research_context,
+                length=length,
+                add_ons=add_ons
+            )
+
+    # -- Persistence ---------------------------------------------------------
+
+    async def _record(self, request: PendingRequest):
+        try:
+            pool = await get_db()
+            async with pool.acquire() as conn:
+                await conn.execute("""
+                    INSERT INTO batch_requests (custom_id, book_id, chapter_num)
+                    VALUES ($1, $2, $3)
+                """, request.custom_id, request.book_id, request.chapter_num)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not record batch request (not resumable): {e}")
+
+    async def _unrecord(self, request: PendingRequest):
+        try:
+            pool = await get_db()
+            async with pool.acquire() as conn:
+                await conn.execute("DELETE FROM batch_requests WHERE custom_id = $1", request.custom_id)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not delete batch request record: {e}")
+
+    async def _resume(self, book_id: str, chapter_num: int, route: Route) -> Optional[PendingRequest]:
+        """Re-attach to a request a stopped worker submitted for this chapter"""
+        pool = await get_db()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow("""
+                SELECT custom_id, batch_id, created_at,
+                       EXTRACT(EPOCH FROM NOW() - created_at) AS waited
+                FROM batch_requests
+                WHERE book_id = $1 AND chapter_num = $2
+                ORDER BY created_at DESC
+                LIMIT 1
+            """, book_id, chapter_num)
+            if row is not None and row["batch_id"] is None:
+                # Never submitted: nothing to resume, queue it again
+                await conn.execute("DELETE FROM batch_requests WHERE custom_id = $1", row["custom_id"])
+                return None
+
+        if row is None:
+            return None
+
+        # Waited time comes from the database clock, which wrote created_at
+        waited = float(row["waited"])
+        request = PendingRequest(
+            custom_id=row["custom_id"],
+            book_id=book_id,
+            chapter_num=chapter_num,
+            route=route,
+            prompt="",
+            future=asyncio.get_running_loop().create_future(),
+            queued_at=time.monotonic() - waited
+        )
+        self._watch(row["batch_id"], [request])
+        logger.info(f"♻️ Chapter {chapter_num} resumed on batch {row['batch_id']}")
+        return request
+
+    async def _claim_orphans(self) -> List[str]:
+        """
+        Books still generating whose batch requests nobody has polled for
+        BATCH_ORPHAN_SECONDS (their worker stopped). Claiming refreshes
+        polled_at, so only one worker resumes each book.
+        """
+        pool = await get_db()
+        async with pool.acquire() as conn:
+            await conn.execute("""
+                DELETE FROM batch_requests r
+                USING book_progress p
+                WHERE p.book_id = r.book_id AND p.status <> 'generating'
+            """)
+            rows = await conn.fetch("""
+                UPDATE batch_requests r
+                SET polled_at = NOW()
+                FROM book_progress p
+                WHERE p.book_id = r.book_id
+                  AND p.status = 'generating'
+                  AND r.polled_at < NOW() - make_interval(secs => $1)
+                RETURNING r.book_id
+            """, float(settings.BATCH_ORPHAN_SECONDS))
+        return list(dict.fromkeys(str(row["book_id"]) for row in rows))
+
+    async def _recover(self, resume: Callable[[str], Awaitable[Any]]):
+        while True:
+            try:
+                for book_id in await self._claim_orphans():
+                    logger.info(f"♻️ Resuming batch book {book_id} after a worker stopped")
+                    task = asyncio.create_task(resume(book_id))
+                    self._resumed.add(task)
+                    task.add_done_callback(self._resumed.discard)
+            except Exception as e:
+                logger.error(f"❌ Batch recovery check failed: {e}")
+            await asyncio.sleep(settings.BATCH_POLL_INTERVAL)
+
+    # -- Collecting ----------------------------------------------------------
+
+    def _enqueue(self, request: PendingRequest):
+        self._pending.append(request)
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_loop())
+        if len(self._pending) >= settings.BATCH_MAX_REQUESTS:
+            self._wakeup.set()
+
+    def _forget(self, request: PendingRequest):
+        """Drop a request whose caller is no longer waiting for the batch"""
+        if request in self._pending:
+            self._pending.remove(request)
+        self._submitted.pop(request.custom_id, None)
+
+    async def _flush_loop(self):
+        """Submit a batch every BATCH_COLLECT_SECONDS (sooner when full)"""
+        while self._pending:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), settings.BATCH_COLLECT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            requests = self._pending[:settings.BATCH_MAX_REQUESTS]
+            del self._pending[:len(requests)]
+            if requests:
+                await self._submit(requests)
+
+    # -- Submitting ----------------------------------------------------------
+
+    async def _submit(self, requests: List[PendingRequest]):
+        lines = [
+            orjson.dumps({
+                "custom_id": request.custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {
+                    "model": request.route.models[0],
+                    "max_tokens": request.route.max_tokens,
+                    "temperature": request.route.temperature,
+                    "messages": [{"role": "user", "content": request.prompt}],
+                },
+            })
+            for request in requests
+        ]
+
+        try:
+            client = ai_generator.client
+            input_file = await client.files.create(
+                file=(f"chapters-{uuid.uuid4().hex}.jsonl", b"\n".join(lines)),
+                purpose="batch"
+            )
+            batch = await client.batches.create(
+                input_file_id=input_file.id,
+                endpoint=BATCH_ENDPOINT,
+                completion_window=settings.BATCH_COMPLETION_WINDOW
+            )
+        except Exception as e:
+            logger.error(f"❌ Batch submission failed: {e}")
+            self._fail(requests, f"submission failed: {e}")
+            return
+
+        self._watch(batch.id, requests)
+        logger.info(f"📤 Submitted batch {batch.id} with {len(requests)} chapter requests")
+
+        try:
+            pool = await get_db()
+            async with pool.acquire() as conn:
+                await conn.execute("""
+                    UPDATE batch_requests SET batch_id = $1, polled_at = NOW()
+                    WHERE custom_id = ANY($2::text[])
+                """, batch.id, [request.custom_id for request in requests])
+        except Exception as e:
+            logger.warning(f"⚠️ Could not record batch {batch.id} (not resumable): {e}")
+
+    def _watch(self, batch_id: str, requests: List[PendingRequest]):
+        """Wait on `requests` in this batch, polling it if not already"""
+        for request in requests:
+            self._submitted[request.custom_id] = request
+        self._batches.setdefault(batch_id, set()).update(request.custom_id for request in requests)
+        if batch_id not in self._poll_tasks:
+            self._poll_tasks[batch_id] = asyncio.create_task(self._poll(batch_id))
+
+    # -- Polling -------------------------------------------------------------
+
+    async def _heartbeat(self, batch_id: str):
+        """Tell other workers this batch is still being polled"""
+        try:
+            pool = await get_db()
+            async with pool.acquire() as conn:
+                await conn.execute(
+                    "UPDATE batch_requests SET polled_at = NOW() WHERE batch_id = $1", batch_id
+                )
+        except Exception as e:
+            logger.warning(f"⚠️ Batch {batch_id} heartbeat failed: {e}")
+
+    async def _poll(self, batch_id: str):
+        client = ai_generator.client
+        custom_ids = self._batches[batch_id]
+        try:
+            while True:
+                await asyncio.sleep(settings.BATCH_POLL_INTERVAL)
+
+                # Every caller moved to a live call: nothing left to wait for
+                if not any(custom_id in self._submitted for custom_id in custom_ids):
+                    await client.batches.cancel(batch_id)
+                    logger.info(f"🛑 Cancelled batch {batch_id}, all requests went live")
+                    return
+
+                await self._heartbeat(batch_id)
+
+                batch = await client.batches.retrieve(batch_id)
+                if batch.status not in TERMINAL_BATCH_STATUSES:
+                    continue
+
+                if batch.output_file_id:
+                    await self._resolve(batch.output_file_id)
+                if batch.error_file_id:
+                    await self._resolve(batch.error_file_id)
+
+                # Anything still unresolved has no result in this batch
+                self._fail(
+                    [self._submitted[c] for c in custom_ids if c in self._submitted],
+                    f"batch {batch.status}"
+                )
+                logger.info(f"📥 Batch {batch_id} finished: {batch.status}")
+                return
+
+        except Exception as e:
+            logger.error(f"❌ Polling batch {batch_id} failed: {e}")
+            self._fail([self._submitted[c] for c in custom_ids if c in self._submitted], str(e))
+        finally:
+            self._poll_tasks.pop(batch_id, None)
+            self._batches.pop(batch_id, None)
+
+    async def _resolve(self, file_id: str):
+        """
+        Resolve waiting chapters from a batch output or error file, streamed
+        line by line (a file can hold BATCH_MAX_REQUESTS chapters)
+        """
+        async with ai_generator.client.files.with_streaming_response.content(file_id) as response:
+            async for line in response.iter_lines():
+                if line.strip():
+                    self._resolve_line(line)
+
+    def _resolve_line(self, line: str):
+        result = orjson.loads(line)
+        request = self._submitted.pop(result.get("custom_id"), None)
+        if request is None or request.future.done():
+            return  # already switched to a live call
+
+        response = result.get("response") or {}
+        body = response.get("body") or {}
+        if result.get("error") or response.get("status_code") != 200 or not body.get("choices"):
+            request.future.set_exception(BatchRequestFailed(
+                str(result.get("error") or body.get("error") or response.get("status_code"))
+            ))
+            return
+
+        model_router.record(
+            dataclasses.replace(request.route, key=f"{request.route.key}:batch"),
+            body.get("model", request.route.models[0]),
+            time.monotonic() - request.queued_at,
+            usage=SimpleNamespace(**body["usage"]) if body.get("usage") else None,
+            discount=settings.BATCH_PRICE_DISCOUNT
+        )
+        request.future.set_result(body["choices"][0]["message"]["content"])
+
+    def _fail(self, requests: List[PendingRequest], reason: str):
+        for request in requests:
+            self._submitted.pop(request.custom_id, None)
+            if not request.future.done():
+                request.future.set_exception(BatchRequestFailed(reason))
+
+    # -- Lifecycle -----------------------------------------------------------
+
+    def start(self, resume: Callable[[str], Awaitable[Any]]):
+        """Resume books whose batch requests a stopped worker left behind"""
+        if settings.BATCH_ENABLED and self._recovery_task is None:
+            self._recovery_task = asyncio.create_task(self._recover(resume))
+
+    async def stop(self):
+        """
+        Cancel background tasks and the chapters waiting here, without a
+        live fallback (that would pay for the chapter twice once another
+        worker resumes the batch). Recorded requests stay for resumption.
+        """
+        self._stopping = True
+        tasks = [
+            task for task in (self._recovery_task, self._flush_task, *self._poll_tasks.values())
+            if task is not None
+        ]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for request in [*self._pending, *self._submitted.values()]:
+            request.future.cancel()
+        self._pending.clear()
+        self._submitted.clear()
+
+        resumed = list(self._resumed)
+        for task in resumed:
+            task.cancel()
+        await asyncio.gather(*resumed, return_exceptions=True)
+        self._flush_task = None
+        self._recovery_task = None
+
+
+# Singleton instance
+batch_generator = BatchGenerator()
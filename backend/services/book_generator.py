@@ -4,19 +4,16 @@ import json
 import logging
 from typing import Dict, List, Any
 from datetime import datetime
-import os
 
 from services.ai_generator import ai_generator
+from services.research_service import research_service
+from services.admission import admission_controller
 
 logger = logging.getLogger(__name__)
 
 class BookGeneratorService:
     """Service for generating books using AI"""
 
-    def __init__(self):
-        self.working_dir = "/home/ubuntu/aiphdwriter-backend/storage"
-        os.makedirs(self.working_dir, exist_ok=True)
-
     async def generate_preview(
         self,
         topic: str,
@@ -31,6 +28,9 @@ class BookGeneratorService:
         """
         logger.info(f"Generating preview for: {topic}")
 
+        # Research runs in parallel with the outline (no-op when disabled)
+        research_task = asyncio.create_task(research_service.get_context(topic))
+
         # Step 1: Generate outline using AI
         outline = await ai_generator.generate_outline(
             topic=topic,
@@ -41,13 +41,17 @@ class BookGeneratorService:
         )
 
         # Step 2: Generate Chapter 1 using AI
+        research_context = await research_service.wait_for_context(research_task)
         first_chapter = outline["chapters"][0]
         chapter_1_content = await ai_generator.generate_chapter(
             chapter_num=1,
             chapter_info=first_chapter,
             book_title=outline["title"],
             audience=audience,
-            style=style
+            style=style,
+            research_context=research_context,
+            length=length,
+            preview=True
         )
 
         # Calculate price based on length
@@ -59,12 +63,15 @@ class BookGeneratorService:
         outline["estimatedPages"] = estimated_pages
         outline["estimatedWords"] = estimated_pages * 250  # ~250 words per page
 
+        # Live ETA for the remaining chapters behind the current queue
+        estimated_seconds = admission_controller.estimate_book_seconds(len(outline["chapters"]) - 1)
+
         return {
             "outline": outline,
             "chapter_1": chapter_1_content,
             "estimated_pages": estimated_pages,
             "price": price,
-            "estimated_time": "4-24 hours"
+            "estimated_time": admission_controller.format_duration(estimated_seconds)
         }
 
     def _get_chapter_count(self, length: str) -> int:
@@ -0,0 +1,351 @@
+"""
+Incremental DOCX/EPUB export
+Each chapter is converted into its format fragments as soon as it is saved;
+the final export only packages the fragments
+"""
+import json
+import logging
+import re
+import zipfile
+from copy import deepcopy
+from datetime import datetime, timezone
+from html import escape
+from pathlib import Path
+from typing import Dict, List, Any
+
+import markdown2
+from docx import Document
+from docx.shared import Inches, Pt
+
+from services.illustration_generator import illustration_path, IMAGES_DIR
+from services.storage_io import atomic_open, atomic_write_text
+
+logger = logging.getLogger(__name__)
+
+# Per-chapter fragments: <book_folder>/fragments/chapter_NN.{xhtml,docx}
+FRAGMENTS_DIR = "fragments"
+
+FRAGMENT_SUFFIXES = {"epub": ".xhtml", "docx": ".docx"}
+
+MARKDOWN_EXTRAS = ["fenced-code-blocks", "tables", "strike", "cuddled-lists"]
+
+XHTML_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="en" lang="en">
+<head>
+<meta charset="utf-8" />
+<title>{title}</title>
+<link rel="stylesheet" type="text/css" href="style.css" />
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+EPUB_CSS = """body { font-family: serif; line-height: 1.5; margin: 0 5%; }
+h1, h2, h3 { font-family: sans-serif; line-height: 1.2; }
+img { max-width: 100%; }
+pre, code { font-family: monospace; font-size: 0.9em; }
+blockquote { font-style: italic; margin-left: 1.5em; }
+table { border-collapse: collapse; }
+td, th { border: 1px solid #999; padding: 0.2em 0.5em; }
+"""
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+
+def fragment_path(book_folder: Path, chapter_num: int, fmt: str) -> Path:
+    """Path of one chapter fragment ("epub" or "docx")"""
+    return book_folder / FRAGMENTS_DIR / f"chapter_{chapter_num:02d}{FRAGMENT_SUFFIXES[fmt]}"
+
+
+def load_outline(book_folder: Path) -> Dict[str, Any]:
+    """Outline saved next to the chapters by the full book generator"""
+    return json.loads((book_folder / "outline.json").read_text(encoding="utf-8"))
+
+
+def fragments_ready(book_folder: Path, fmt: str) -> bool:
+    """True if every chapter of the book has a fragment for this format"""
+    outline_file = book_folder / "outline.json"
+    if not outline_file.exists():
+        return False
+
+    chapter_count = len(load_outline(book_folder)["chapters"])
+    return all(
+        fragment_path(book_folder, chapter_num, fmt).exists()
+        for chapter_num in range(1, chapter_count + 1)
+    )
+
+
+def build_chapter_fragments(book_folder: Path, chapter_num: int, markdown_text: str):
+    """
+    Convert one chapter into its EPUB XHTML document and DOCX body.
+    CPU-bound; call through storage_io.run from coroutines.
+    """
+    fragments_folder = book_folder / FRAGMENTS_DIR
+    fragments_folder.mkdir(parents=True, exist_ok=True)
+
+    xhtml = XHTML_TEMPLATE.format(
+        title=f"Chapter {chapter_num}",
+        body=markdown2.markdown(markdown_text, extras=MARKDOWN_EXTRAS)
+    )
+    atomic_write_text(fragment_path(book_folder, chapter_num, "epub"), xhtml)
+
+    document = Document()
+    add_markdown_to_docx(document, markdown_text)
+    with atomic_open(fragment_path(book_folder, chapter_num, "docx"), "wb") as f:
+        document.save(f)
+
+    logger.info(f"🧩 Built export fragments for Chapter {chapter_num}")
+
+
+# ---------------------------------------------------------------------------
+# Markdown -> python-docx
+# ---------------------------------------------------------------------------
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+BULLET_RE = re.compile(r"^\s*[-*+]\s+(.*)$")
+NUMBERED_RE = re.compile(r"^\s*\d+[.)]\s+(.*)$")
+QUOTE_RE = re.compile(r"^>\s?(.*)$")
+RULE_RE = re.compile(r"^\s*([-*_])(\s*\1){2,}\s*$")
+TABLE_SEPARATOR_RE = re.compile(r"^\s*\|?\s*:?-{3,}:?\s*(\|\s*:?-{3,}:?\s*)*\|?\s*$")
+LINK_RE = re.compile(r"\[([^\]]+)\]\([^)]+\)")
+INLINE_RE = re.compile(r"(\*\*[^*]+\*\*|__[^_]+__|\*[^*]+\*|_[^_]+_|`[^`]+`)")
+
+
+def _add_inline(paragraph, text: str):
+    """Add text with **bold**, *italic* and `code` runs"""
+    text = LINK_RE.sub(r"\1", text)
+    for part in INLINE_RE.split(text):
+        if not part:
+            continue
+        if len(part) > 4 and part[:2] in ("**", "__") and part[-2:] == part[:2]:
+            paragraph.add_run(part[2:-2]).bold = True
+        elif len(part) > 2 and part[0] in "*_" and part[-1] == part[0]:
+            paragraph.add_run(part[1:-1]).italic = True
+        elif len(part) > 2 and part[0] == "`" and part[-1] == "`":
+            run = paragraph.add_run(part[1:-1])
+            run.font.name = "Courier New"
+        else:
+            paragraph.add_run(part)
+
+
+def _add_table(document, rows: List[str]):
+    cells = [
+        [cell.strip() for cell in row.strip().strip("|").split("|")]
+        for row in rows if not TABLE_SEPARATOR_RE.match(row)
+    ]
+    if not cells:
+        return
+
+    columns = max(len(row) for row in cells)
+    table = document.add_table(rows=len(cells), cols=columns)
+    table.style = "Table Grid"
+    for row_index, row in enumerate(cells):
+        for column_index, value in enumerate(row):
+            paragraph = table.cell(row_index, column_index).paragraphs[0]
+            _add_inline(paragraph, value)
+            if row_index == 0:
+                for run in paragraph.runs:
+                    run.bold = True
+
+
+def add_markdown_to_docx(document, markdown_text: str):
+    """Append the block structure of a markdown chapter to a document"""
+    lines = markdown_text.splitlines()
+    paragraph_lines: List[str] = []
+
+    def flush_paragraph():
+        if paragraph_lines:
+            _add_inline(document.add_paragraph(), " ".join(line.strip() for line in paragraph_lines))
+            paragraph_lines.clear()
+
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+
+        if line.strip().startswith("```"):
+            flush_paragraph()
+            code_lines = []
+            i += 1
+            while i < len(lines) and not lines[i].strip().startswith("```"):
+                code_lines.append(lines[i])
+                i += 1
+            run = document.add_paragraph().add_run("\n".join(code_lines))
+            run.font.name = "Courier New"
+            run.font.size = Pt(9)
+            i += 1
+            continue
+
+        if line.strip().startswith("|"):
+            flush_paragraph()
+            table_rows = []
+            while i < len(lines) and lines[i].strip().startswith("|"):
+                table_rows.append(lines[i])
+                i += 1
+            _add_table(document, table_rows)
+            continue
+
+        if not line.strip():
+            flush_paragraph()
+        elif RULE_RE.match(line):
+            flush_paragraph()
+        elif HEADING_RE.match(line):
+            flush_paragraph()
+            match = HEADING_RE.match(line)
+            document.add_heading(LINK_RE.sub(r"\1", match.group(2)), level=len(match.group(1)))
+        elif BULLET_RE.match(line):
+            flush_paragraph()
+            _add_inline(document.add_paragraph(style="List Bullet"), BULLET_RE.match(line).group(1))
+        elif NUMBERED_RE.match(line):
+            flush_paragraph()
+            _add_inline(document.add_paragraph(style="List Number"), NUMBERED_RE.match(line).group(1))
+        elif QUOTE_RE.match(line):
+            flush_paragraph()
+            _add_inline(document.add_paragraph(style="Quote"), QUOTE_RE.match(line).group(1))
+        else:
+            paragraph_lines.append(line)
+
+        i += 1
+
+    flush_paragraph()
+
+
+# ---------------------------------------------------------------------------
+# Final assembly
+# ---------------------------------------------------------------------------
+
+def assemble_docx(book_folder: Path) -> Path:
+    """Stitch the per-chapter DOCX fragments into book.docx"""
+    outline = load_outline(book_folder)
+    output_file = book_folder / "book.docx"
+
+    document = Document()
+    document.add_heading(outline["title"], level=0)
+    _add_inline(document.add_paragraph(), f"*{outline['subtitle']}*")
+
+    cover = illustration_path(book_folder, "cover")
+    if cover.exists():
+        document.add_picture(str(cover), width=Inches(5))
+
+    body = document.element.body
+    section_properties = body.sectPr
+
+    for chapter_num in range(1, len(outline["chapters"]) + 1):
+        document.add_page_break()
+
+        fragment = Document(str(fragment_path(book_folder, chapter_num, "docx")))
+        for element in fragment.element.body:
+            if element.tag.endswith("}sectPr"):
+                continue
+            if section_properties is not None:
+                section_properties.addprevious(deepcopy(element))
+            else:
+                body.append(deepcopy(element))
+
+        image = illustration_path(book_folder, f"chapter_{chapter_num:02d}")
+        if image.exists():
+            document.add_picture(str(image), width=Inches(5))
+
+    with atomic_open(output_file, "wb") as f:
+        document.save(f)
+    return output_file
+
+
+def assemble_epub(book_folder: Path) -> Path:
+    """Package the per-chapter XHTML fragments into book.epub"""
+    outline = load_outline(book_folder)
+    output_file = book_folder / "book.epub"
+    chapters = outline["chapters"]
+    title = escape(outline["title"])
+    modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    manifest = [
+        '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>',
+        '<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>',
+        '<item id="css" href="style.css" media-type="text/css"/>',
+        '<item id="title" href="title.xhtml" media-type="application/xhtml+xml"/>',
+    ]
+    spine = ['<itemref idref="title"/>']
+    nav_items = []
+    nav_points = []
+
+    cover = illustration_path(book_folder, "cover")
+    title_body = f"<h1>{title}</h1>\n<p><em>{escape(outline['subtitle'])}</em></p>"
+    if cover.exists():
+        manifest.append(
+            f'<item id="cover-image" href="{IMAGES_DIR}/cover.png" media-type="image/png" properties="cover-image"/>'
+        )
+        title_body = f'<p><img src="{IMAGES_DIR}/cover.png" alt="{title}" /></p>\n' + title_body
+
+    with atomic_open(output_file, "wb") as f, zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as epub:
+        # mimetype must be the first entry and stored uncompressed
+        epub.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        epub.writestr("META-INF/container.xml", CONTAINER_XML)
+        epub.writestr("OEBPS/style.css", EPUB_CSS)
+        epub.writestr("OEBPS/title.xhtml", XHTML_TEMPLATE.format(title=title, body=title_body))
+        if cover.exists():
+            epub.write(cover, f"OEBPS/{IMAGES_DIR}/cover.png")
+
+        for chapter_num, chapter in enumerate(chapters, start=1):
+            name = f"chapter_{chapter_num:02d}"
+            xhtml = fragment_path(book_folder, chapter_num, "epub").read_text(encoding="utf-8")
+
+            image = illustration_path(book_folder, name)
+            if image.exists():
+                epub.write(image, f"OEBPS/{IMAGES_DIR}/{name}.png")
+                manifest.append(f'<item id="{name}-image" href="{IMAGES_DIR}/{name}.png" media-type="image/png"/>')
+                xhtml = xhtml.replace(
+                    "</body>",
+                    f'<p><img src="{IMAGES_DIR}/{name}.png" alt="Chapter {chapter_num} illustration" /></p>\n</body>'
+                )
+
+            epub.writestr(f"OEBPS/{name}.xhtml", xhtml)
+            manifest.append(f'<item id="{name}" href="{name}.xhtml" media-type="application/xhtml+xml"/>')
+            spine.append(f'<itemref idref="{name}"/>')
+
+            chapter_title = escape(f"Chapter {chapter_num}: {chapter['title']}")
+            nav_items.append(f'<li><a href="{name}.xhtml">{chapter_title}</a></li>')
+            nav_points.append(
+                f'<navPoint id="{name}" playOrder="{len(nav_points) + 1}">'
+                f"<navLabel><text>{chapter_title}</text></navLabel>"
+                f'<content src="{name}.xhtml"/></navPoint>'
+            )
+
+        epub.writestr("OEBPS/nav.xhtml", XHTML_TEMPLATE.format(
+            title="Contents",
+            body='<nav epub:type="toc" id="toc"><h1>Contents</h1><ol>\n'
+                 + "\n".join(nav_items) + "\n</ol></nav>"
+        ))
+        epub.writestr("OEBPS/toc.ncx", f"""<?xml version="1.0" encoding="UTF-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+<head><meta name="dtb:uid" content="urn:uuid:{book_folder.name}"/></head>
+<docTitle><text>{title}</text></docTitle>
+<navMap>{"".join(nav_points)}</navMap>
+</ncx>
+""")
+        epub.writestr("OEBPS/content.opf", f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="book-id">urn:uuid:{book_folder.name}</dc:identifier>
+    <dc:title>{title}</dc:title>
+    <dc:language>en</dc:language>
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+    {chr(10).join("    " + item for item in manifest).strip()}
+  </manifest>
+  <spine toc="ncx">
+    {chr(10).join("    " + item for item in spine).strip()}
+  </spine>
+</package>
+""")
+
+    return output_file
@@ -2,134 +2,327 @@
 import asyncio
 import logging
 import os
+import time
+from contextlib import nullcontext
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from datetime import datetime
 import json
 
+from services import storage_io
 from services.ai_generator import ai_generator
-from app.database import get_db
+from services.batch_generator import batch_generator, use_batch
+from services.research_service import research_service
+from services import export_builder
+from services.export_builder import build_chapter_fragments
+from services.pdf_renderer import render_book_pdf
+from services.admission import admission_controller
+from services.work_budget import work_budget
+from services.storage_manager import storage_manager
+from services.illustration_generator import (
+    illustration_generator, build_illustration_prompts, illustration_path, IMAGES_DIR
+)
+from app.config import settings
+from app.logging_config import book_id_var, chapter_var
+from app.database import get_db, mark_written
 
 logger = logging.getLogger(__name__)
 
 # Base storage directory (inside Docker container)
-STORAGE_DIR = Path("/app/storage/books")
+STORAGE_DIR = Path(settings.STORAGE_DIR)
 
 async def generate_full_book(book_id: str):
     """
     Generate complete book (all chapters) in parallel
     Called after successful payment
     """
+    illustrations_task = None
+    book_id_var.set(book_id)
     try:
         logger.info(f"🚀 Starting full book generation for: {book_id}")
 
         # Create book folder
         book_folder = STORAGE_DIR / book_id
-        book_folder.mkdir(parents=True, exist_ok=True)
+        await storage_io.mkdir(book_folder)
         logger.info(f"📁 Created book folder: {book_folder}")
 
         # Get book data from database
         pool = await get_db()
         async with pool.acquire() as conn:
             book = await conn.fetchrow("""
-                SELECT outline, topic, audience, style, chapter_1 FROM books
-                WHERE book_id = $1
+                SELECT b.topic, b.audience, b.length, b.style, b.add_ons, c.outline, c.chapter_1
+                FROM books b
+                JOIN book_content c ON c.book_id = b.book_id
+                WHERE b.book_id = $1
             """, book_id)
 
             if not book:
                 logger.error(f"Book {book_id} not found")
                 return
 
-            outline = json.loads(book["outline"]) if isinstance(book["outline"], str) else book["outline"]
+            outline = book["outline"]
             audience = book["audience"]
             style = book["style"]
             chapter_1 = book["chapter_1"]
+            add_ons = book["add_ons"] or []
+            topic = book["topic"]
+            length = book["length"]
 
         # Save Chapter 1 (already generated during preview)
         chapter_1_file = book_folder / "chapter_01.md"
-        chapter_1_file.write_text(chapter_1, encoding='utf-8')
+        await storage_io.write_text(chapter_1_file, chapter_1)
         logger.info(f"💾 Saved Chapter 1")
+        await build_fragments(book_folder, 1, chapter_1)
 
         # Save outline
         outline_file = book_folder / "outline.json"
-        outline_file.write_text(json.dumps(outline, indent=2), encoding='utf-8')
+        await storage_io.write_text(outline_file, json.dumps(outline, indent=2))
 
         # Update progress
         await update_progress(book_id, 5, "Preparing to generate chapters...")
 
-        # Generate remaining chapters (skip chapter 1, already done)
-        chapters_to_generate = outline["chapters"][1:]  # Skip first chapter
-        total_chapters = len(chapters_to_generate)
+        # Generate remaining chapters (skip chapter 1, already done). Chapters
+        # saved by an earlier run (resumed batch book, retry) are kept.
+        total_chapters = len(outline["chapters"]) - 1
+        chapters_to_generate = [
+            (number, chapter_info)
+            for number, chapter_info in enumerate(outline["chapters"][1:], start=2)
+            if not await storage_io.exists(book_folder / f"chapter_{number:02d}.md")
+        ]
+
+        # Non-rush books go through the Batch API when enabled. They wait on
+        # the batch, not in memory, so only live chapters take budget slots.
+        batch = use_batch(add_ons)
+        if batch:
+            await update_progress(book_id, 5, "Queued for generation...")
+        elif work_budget.would_wait():
+            await update_progress(book_id, 5, "Waiting for a generation slot...")
+
+        # Illustrations run alongside chapter generation, not after it
+        illustrations_task = asyncio.create_task(
+            illustration_generator.generate_book_illustrations(
+                book_folder,
+                build_illustration_prompts(outline, style, add_ons)
+            )
+        )
+
+        # Usually a cache hit: the preview already researched this topic.
+        # On a miss, chapters start without research rather than wait for it.
+        research_context = await research_service.wait_for_context(
+            asyncio.create_task(research_service.get_context(topic))
+        )
 
-        logger.info(f"Generating {total_chapters} chapters in parallel...")
+        logger.info(f"Generating {len(chapters_to_generate)} chapters in parallel...")
 
-        # Generate all chapters in parallel
+        # Chapters are written to disk as they finish; only failures come back
+        admission_controller.chapters_queued(len(chapters_to_generate), batch=batch)
         tasks = []
-        for i, chapter_info in enumerate(chapters_to_generate, start=2):
+        for number, chapter_info in chapters_to_generate:
             task = generate_chapter_with_progress(
                 book_id=book_id,
-                chapter_num=i,
+                chapter_num=number,
                 chapter_info=chapter_info,
                 book_title=outline["title"],
                 audience=audience,
                 style=style,
-                total_chapters=total_chapters + 1  # +1 for chapter 1
+                total_chapters=total_chapters + 1,  # +1 for chapter 1
+                research_context=research_context,
+                length=length,
+                add_ons=add_ons,
+                batch=batch
             )
             tasks.append(task)
 
         # Wait for all chapters to complete
-        chapters = await asyncio.gather(*tasks, return_exceptions=True)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        # A stopping worker cancelled batch chapters: the book stays
+        # generating and another worker resumes it from its batch records
+        if any(isinstance(result, asyncio.CancelledError) for result in results):
+            logger.info(f"⏸️ Book generation interrupted by shutdown, left for resumption")
+            illustrations_task.cancel()
+            return
 
         # Check for errors
-        failed_chapters = [i for i, ch in enumerate(chapters, start=2) if isinstance(ch, Exception)]
+        failed_chapters = [
+            number for (number, _), result in zip(chapters_to_generate, results)
+            if isinstance(result, Exception)
+        ]
         if failed_chapters:
             logger.error(f"Chapters {failed_chapters} failed to generate")
+            illustrations_task.cancel()
             await update_progress(book_id, 100, f"Failed to generate some chapters", status="failed")
             return
 
         logger.info(f"✅ All {total_chapters} chapters generated successfully!")
 
         # Update to 95%
-        await update_progress(book_id, 95, "Assembling final book...")
-
-        # Assemble all chapters into one markdown file
-        full_book_path = book_folder / "full_book.md"
-        with open(full_book_path, 'w', encoding='utf-8') as f:
-            f.write(f"# {outline['title']}\n\n")
-            f.write(f"*{outline['subtitle']}*\n\n")
-            f.write("---\n\n")
+        await update_progress(book_id, 95, "Finishing illustrations...")
+        await illustrations_task
 
-            # Add Chapter 1
-            f.write(chapter_1 + "\n\n")
+        await update_progress(book_id, 97, "Assembling final book...")
 
-            # Add remaining chapters
-            for i, content in enumerate(chapters, start=2):
-                if not isinstance(content, Exception):
-                    f.write(content + "\n\n")
+        # Assemble all chapters into one markdown file
+        full_book_path = await storage_io.run(assemble_full_book, book_folder, outline)
 
         logger.info(f"📄 Full book assembled: {full_book_path}")
 
         # Mark as complete
         async with pool.acquire() as conn:
             await conn.execute("""
-                UPDATE books
+                UPDATE book_progress
                 SET status = 'complete',
                     progress = 100,
                     current_step = 'Complete!',
                     completed_at = $1,
-                    download_url = $2
+                    download_url = $2,
+                    updated_at = NOW()
                 WHERE book_id = $3
             """, datetime.utcnow(), f"/books/{book_id}/full_book.md", book_id)
-
-        await update_progress(book_id, 100, "Complete!", status="complete")
+        mark_written(book_id)
 
         logger.info(f"🎉 Book generation complete: {book_id}")
 
+    except asyncio.CancelledError:
+        # Shutdown: no failed status, so the book can be resumed
+        if illustrations_task is not None:
+            illustrations_task.cancel()
+        raise
     except Exception as e:
         logger.error(f"❌ Book generation failed: {e}")
+        if illustrations_task is not None:
+            illustrations_task.cancel()
         await update_progress(book_id, 0, f"Generation failed: {str(e)}", status="failed")
 
 
+async def regenerate_chapter(book_id: str, chapter_num: int):
+    """
+    Regenerate one chapter of a complete book with its existing outline and
+    research context. The chapter file is replaced atomically, its fragments
+    and full_book.md are rebuilt, then the formats the book already had are
+    exported again (the PDF re-renders only this chapter).
+    Called after the caller won the regenerating_chapter transition.
+    """
+    book_id_var.set(book_id)
+    chapter_var.set(chapter_num)
+    try:
+        logger.info(f"🔁 Regenerating Chapter {chapter_num} of {book_id}")
+
+        pool = await get_db()
+        async with pool.acquire() as conn:
+            book = await conn.fetchrow("""
+                SELECT b.topic, b.audience, b.length, b.style, b.add_ons, c.outline
+                FROM books b
+                JOIN book_content c ON c.book_id = b.book_id
+                WHERE b.book_id = $1
+            """, book_id)
+
+        outline = book["outline"]
+        book_folder = await storage_manager.open_book(book_id)
+        research_context = await research_service.wait_for_context(
+            asyncio.create_task(research_service.get_context(book["topic"]))
+        )
+
+        async with work_budget.chapter():
+            content = await ai_generator.generate_chapter(
+                chapter_num=chapter_num,
+                chapter_info=outline["chapters"][chapter_num - 1],
+                book_title=outline["title"],
+                audience=book["audience"],
+                style=book["style"],
+                research_context=research_context,
+                length=book["length"],
+                add_ons=book["add_ons"] or []
+            )
+
+            await storage_io.write_text(book_folder / f"chapter_{chapter_num:02d}.md", content)
+            await build_fragments(book_folder, chapter_num, content)
+        await storage_io.run(assemble_full_book, book_folder, outline)
+
+        async with pool.acquire() as conn:
+            async with conn.transaction():
+                if chapter_num == 1:
+                    await conn.execute("""
+                        UPDATE book_content SET chapter_1 = $1 WHERE book_id = $2
+                    """, content, book_id)
+                await conn.execute("""
+                    UPDATE book_progress
+                    SET regenerating_chapter = NULL,
+                        current_step = 'Complete!',
+                        updated_at = NOW()
+                    WHERE book_id = $1
+                """, book_id)
+        mark_written(book_id)
+
+        logger.info(f"✅ Chapter {chapter_num} regenerated")
+
+        # The chapter is readable already; downloads get fresh exports next
+        await rebuild_exports(book_folder)
+
+    except Exception as e:
+        logger.error(f"❌ Chapter {chapter_num} regeneration failed: {e}")
+        try:
+            pool = await get_db()
+            async with pool.acquire() as conn:
+                await conn.execute("""
+                    UPDATE book_progress
+                    SET regenerating_chapter = NULL,
+                        current_step = $1,
+                        updated_at = NOW()
+                    WHERE book_id = $2
+                """, f"Chapter {chapter_num} regeneration failed", book_id)
+            mark_written(book_id)
+        except Exception as db_error:
+            logger.error(f"Failed to clear regeneration marker: {db_error}")
+
+
+async def rebuild_exports(book_folder: Path):
+    """
+    Re-run the download export step for each format this book already has,
+    after full_book.md changed. DOCX/EPUB re-package the cached fragments;
+    the PDF reuses every unchanged chapter's cached render.
+    """
+    for name, export in (
+        ("book.docx", lambda: storage_io.run(export_builder.assemble_docx, book_folder)),
+        ("book.epub", lambda: storage_io.run(export_builder.assemble_epub, book_folder)),
+        ("book.pdf", lambda: render_book_pdf(book_folder)),
+    ):
+        if not await storage_io.exists(book_folder / name):
+            continue
+        try:
+            await export()
+            logger.info(f"📦 Rebuilt {name}")
+        except Exception as e:
+            logger.error(f"❌ Rebuilding {name} failed: {e}")
+
+
+def assemble_full_book(book_folder: Path, outline: Dict[str, Any]) -> Path:
+    """
+    Assemble the saved chapter files (and any illustrations) into full_book.md
+    Image links are relative to the book folder. Blocking; the file is
+    replaced atomically so downloads never read a half-written book.
+    """
+    full_book_path = book_folder / "full_book.md"
+    with storage_io.atomic_open(full_book_path, 'w') as f:
+        f.write(f"# {outline['title']}\n\n")
+        f.write(f"*{outline['subtitle']}*\n\n")
+
+        if illustration_path(book_folder, "cover").exists():
+            f.write(f"![{outline['title']}]({IMAGES_DIR}/cover.png)\n\n")
+
+        f.write("---\n\n")
+
+        for chapter_num in range(1, len(outline["chapters"]) + 1):
+            name = f"chapter_{chapter_num:02d}"
+            chapter_file = book_folder / f"{name}.md"
+            f.write(chapter_file.read_text(encoding='utf-8') + "\n\n")
+
+            if illustration_path(book_folder, name).exists():
+                f.write(f"![Chapter {chapter_num} illustration]({IMAGES_DIR}/{name}.png)\n\n")
+
+    return full_book_path
+
+
 async def generate_chapter_with_progress(
     book_id: str,
     chapter_num: int,
@@ -137,26 +330,50 @@ async def generate_chapter_with_progress(
     book_title: str,
     audience: str,
     style: str,
-    total_chapters: int
-) -> str:
-    """Generate one chapter and update progress"""
+    total_chapters: int,
+    research_context: str = "",
+    length: Optional[str] = None,
+    add_ons: Optional[List[str]] = None,
+    batch: bool = False
+) -> None:
+    """
+    Generate one chapter (live or via the Batch API), save it and update
+    progress. Live chapters hold a work budget slot until they are saved;
+    the content is not returned, so finished chapters are not held until
+    the whole book is.
+    """
+    duration = None
+    chapter_var.set(chapter_num)
     try:
-        logger.info(f"Generating Chapter {chapter_num}/{total_chapters}")
-
-        # Generate the chapter
-        content = await ai_generator.generate_chapter(
-            chapter_num=chapter_num,
-            chapter_info=chapter_info,
-            book_title=book_title,
-            audience=audience,
-            style=style
-        )
+        # Batch chapters take a slot only if they fall back to a live call
+        async with nullcontext() if batch else work_budget.chapter():
+            logger.info(f"Generating Chapter {chapter_num}/{total_chapters}")
+            started = time.monotonic()
+
+            # Generate the chapter (batch requests are recorded per book)
+            chapter_args = dict(
+                chapter_num=chapter_num,
+                chapter_info=chapter_info,
+                book_title=book_title,
+                audience=audience,
+                style=style,
+                research_context=research_context,
+                length=length,
+                add_ons=add_ons
+            )
+            if batch:
+                content = await batch_generator.generate_chapter(book_id=book_id, **chapter_args)
+            else:
+                content = await ai_generator.generate_chapter(**chapter_args)
+            # Batch turnaround says nothing about live chapter latency
+            duration = None if batch else time.monotonic() - started
 
-        # Save chapter to file
-        book_folder = STORAGE_DIR / book_id
-        chapter_file = book_folder / f"chapter_{chapter_num:02d}.md"
-        chapter_file.write_text(content, encoding='utf-8')
-        logger.info(f"💾 Saved Chapter {chapter_num}")
+            # Save chapter to file
+            book_folder = STORAGE_DIR / book_id
+            chapter_file = book_folder / f"chapter_{chapter_num:02d}.md"
+            await storage_io.write_text(chapter_file, content)
+            logger.info(f"💾 Saved Chapter {chapter_num}")
+            await build_fragments(book_folder, chapter_num, content)
 
         # Update progress
         progress = int(5 + ((chapter_num - 1) / total_chapters) * 90)
@@ -164,11 +381,22 @@ async def generate_chapter_with_progress(
 
         logger.info(f"✅ Chapter {chapter_num} complete")
 
-        return content
-
     except Exception as e:
         logger.error(f"❌ Chapter {chapter_num} failed: {e}")
         raise
+    finally:
+        admission_controller.chapter_finished(duration, batch=batch)
+
+
+async def build_fragments(book_folder: Path, chapter_num: int, content: str):
+    """
+    Convert a saved chapter into its DOCX/EPUB fragments off the event loop.
+    Failures are logged only: download falls back to a full pandoc run.
+    """
+    try:
+        await storage_io.run(build_chapter_fragments, book_folder, chapter_num, content)
+    except Exception as e:
+        logger.error(f"⚠️ Export fragments for Chapter {chapter_num} failed: {e}")
 
 
 async def update_progress(book_id: str, progress: int, step: str, status: str = None):
@@ -178,16 +406,17 @@ async def update_progress(book_id: str, progress: int, step: str, status: str =
         async with pool.acquire() as conn:
             if status:
                 await conn.execute("""
-                    UPDATE books
-                    SET progress = $1, current_step = $2, status = $3
+                    UPDATE book_progress
+                    SET progress = $1, current_step = $2, status = $3, updated_at = NOW()
                     WHERE book_id = $4
                 """, progress, step, status, book_id)
             else:
                 await conn.execute("""
-                    UPDATE books
-                    SET progress = $1, current_step = $2
+                    UPDATE book_progress
+                    SET progress = $1, current_step = $2, updated_at = NOW()
                     WHERE book_id = $3
                 """, progress, step, book_id)
+        mark_written(book_id)
 
         logger.info(f"Progress updated: {progress}% - {step}")
 
@@ -0,0 +1,161 @@
+"""
+Illustration generation for the cover and extra_illustration add-ons
+Runs alongside chapter generation; images are deduplicated and cached by prompt hash
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+from app.config import settings
+from services import storage_io
+from services.mcp_client import mcp_client
+from services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Illustrations live next to the chapters: <book_folder>/images/<name>.png
+IMAGES_DIR = "images"
+
+# Legacy "illustrations" add-on promised 10+ illustrations
+LEGACY_ILLUSTRATION_COUNT = 10
+
+
+def illustration_path(book_folder: Path, name: str) -> Path:
+    """Path of a book illustration ("cover" or "chapter_NN")"""
+    return book_folder / IMAGES_DIR / f"{name}.png"
+
+
+def count_illustrations(add_ons: List[str]) -> int:
+    """Number of paid chapter illustrations (the cover is always free)"""
+    count = add_ons.count("extra_illustration")
+    if "illustrations" in add_ons:
+        count += LEGACY_ILLUSTRATION_COUNT
+    return count
+
+
+def build_illustration_prompts(
+    outline: Dict[str, Any],
+    style: str,
+    add_ons: List[str]
+) -> Dict[str, str]:
+    """
+    Derive image prompts from the outline.
+    Always includes the cover; paid illustrations are spread evenly
+    across chapters (at most one per chapter).
+    """
+    prompts = {
+        "cover": (
+            f'Book cover illustration for "{outline["title"]}" - {outline["subtitle"]}. '
+            f"Style: {style}. No text, no lettering."
+        )
+    }
+
+    chapters = outline["chapters"]
+    count = min(count_illustrations(add_ons), len(chapters))
+    if count == 0:
+        return prompts
+
+    for i in range(count):
+        index = i * len(chapters) // count
+        chapter = chapters[index]
+        key_points = ", ".join(chapter.get("key_points", [])[:3])
+        prompts[f"chapter_{index + 1:02d}"] = (
+            f'Illustration for the chapter "{chapter["title"]}" of the book "{outline["title"]}". '
+            f"Depict: {chapter['focus']}. Themes: {key_points}. "
+            f"Style: {style}. No text, no lettering."
+        )
+
+    return prompts
+
+
+def _place_image(cached_file: Path, target: Path):
+    """Hard-link a cached image into a book folder (copy across filesystems)"""
+    target.unlink(missing_ok=True)
+    try:
+        os.link(cached_file, target)
+    except OSError:
+        shutil.copyfile(cached_file, target)
+
+
+class IllustrationGenerator:
+    """Generate images through a bounded pool, cached by prompt hash"""
+
+    def __init__(self):
+        self.cache_dir = Path(settings.IMAGE_CACHE_DIR)
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight = SingleFlight()
+
+    @staticmethod
+    def prompt_hash(prompt: str) -> str:
+        """Stable hash of a whitespace/case-normalized prompt"""
+        normalized = " ".join(prompt.lower().split())
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    async def generate(self, prompt: str) -> Path:
+        """
+        Return the cached image for a prompt, generating it if needed.
+        Concurrent requests for the same prompt share one generation.
+        """
+        digest = self.prompt_hash(prompt)
+        cached_file = self.cache_dir / f"{digest}.png"
+        if await storage_io.exists(cached_file):
+            logger.info(f"🖼️ Image cache hit: {digest[:12]}")
+            return cached_file
+
+        return await self._in_flight.do(digest, lambda: self._generate_uncached(prompt, cached_file))
+
+    async def _generate_uncached(self, prompt: str, cached_file: Path) -> Path:
+        """Generate one image under the concurrency limit"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.ILLUSTRATION_CONCURRENCY)
+
+        async with self._semaphore:
+            await storage_io.mkdir(self.cache_dir)
+            tmp_file = cached_file.with_suffix(f".{os.getpid()}.tmp")
+            try:
+                await mcp_client.generate_image(prompt, str(tmp_file))
+                await storage_io.run(os.replace, tmp_file, cached_file)
+            finally:
+                await storage_io.run(tmp_file.unlink, missing_ok=True)
+
+        return cached_file
+
+    async def generate_book_illustrations(
+        self,
+        book_folder: Path,
+        prompts: Dict[str, str]
+    ) -> List[str]:
+        """
+        Generate all illustrations for a book concurrently and place them in
+        the book's images folder. Failures are logged and skipped so a broken
+        image never fails the book. Returns the names that were produced.
+        """
+        logger.info(f"🎨 Generating {len(prompts)} illustrations for {book_folder.name}")
+
+        names = list(prompts)
+        results = await asyncio.gather(
+            *(self.generate(prompts[name]) for name in names),
+            return_exceptions=True
+        )
+
+        await storage_io.mkdir(book_folder / IMAGES_DIR)
+
+        produced = []
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.error(f"❌ Illustration {name} failed: {result}")
+                continue
+
+            await storage_io.run(_place_image, result, illustration_path(book_folder, name))
+            produced.append(name)
+
+        logger.info(f"✅ {len(produced)}/{len(prompts)} illustrations ready")
+        return produced
+
+
+# Singleton instance
+illustration_generator = IllustrationGenerator()
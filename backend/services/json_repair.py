@@ -0,0 +1,88 @@
+"""
+Local repair of near-valid JSON from LLM responses
+Handles code fences, leading/trailing prose and output truncated mid-value
+(e.g. at max_tokens) without another model round trip
+"""
+import json
+from typing import Any, List, Tuple
+
+CLOSERS = {"{": "}", "[": "]"}
+
+# Bounds the work on pathological input; each attempt is one json.loads
+MAX_CUT_ATTEMPTS = 200
+
+
+class JSONRepairError(ValueError):
+    """No usable JSON could be recovered"""
+
+
+def _json_start(text: str) -> int:
+    starts = [i for i in (text.find("{"), text.find("[")) if i != -1]
+    if not starts:
+        raise JSONRepairError("No JSON object in response")
+    return min(starts)
+
+
+def _cut_points(text: str, start: int) -> List[Tuple[int, str]]:
+    """
+    Prefixes that end on a value boundary, with the closers needed to
+    balance them: before each top-level-of-container comma and after each
+    closing bracket.
+    """
+    cuts = []
+    stack: List[str] = []
+    in_string = False
+    escaped = False
+
+    for i in range(start, len(text)):
+        char = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+            continue
+
+        if char == '"':
+            in_string = True
+        elif char in CLOSERS:
+            stack.append(CLOSERS[char])
+        elif char in "}]":
+            if not stack:
+                break
+            stack.pop()
+            cuts.append((i + 1, "".join(reversed(stack))))
+            if not stack:
+                break
+        elif char == "," and stack:
+            cuts.append((i, "".join(reversed(stack))))
+
+    return cuts
+
+
+def repair_json_depth(text: str) -> Tuple[Any, int]:
+    """
+    Parse the first JSON value in `text`, closing it off at the last complete
+    element if it was truncated. Returns (value, closed): how many containers
+    the repair had to close, 0 if the JSON was complete. Callers use it to
+    tell whether the innermost element they kept was cut short.
+    """
+    start = _json_start(text)
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text, start)
+        return value, 0
+    except json.JSONDecodeError:
+        pass
+
+    for end, closers in reversed(_cut_points(text, start)[-MAX_CUT_ATTEMPTS:]):
+        if not closers:
+            continue  # a complete value would have parsed above
+        try:
+            return json.loads(text[start:end] + closers), len(closers)
+        except json.JSONDecodeError:
+            continue
+
+    raise JSONRepairError("Response JSON could not be repaired")
+
@@ -1,18 +1,76 @@
-"""\nMCP Client for interacting with MVAE and Gemini MCP servers\nUses existing MCP tools available on the system\n"""
+"""
+MCP Client for interacting with MVAE and Gemini MCP servers
+One shared keep-alive aiohttp session per process, per-call timeouts and
+long-poll / jittered exponential backoff for agent status
+"""
 import asyncio
 import aiohttp
+import base64
 import logging
+import random
+import orjson
+from pathlib import Path
 from typing import Dict, List, Any, Optional
 
+from app.config import settings
+from services import storage_io
+
 logger = logging.getLogger(__name__)
 
+# Agent states after which polling stops
+TERMINAL_AGENT_STATUSES = {"succeeded", "failed", "cancelled"}
+
+
+class MCPError(Exception):
+    """Raised when an MCP agent fails or does not finish in time"""
+
+
 class MCPClient:
     """Client for spawning agents via MCP tools"""
 
     def __init__(self):
-        # These MCP tools are already available in the Claude Code environment
-        # We'll use them directly via the Claude Code session
-        pass
+        # Created lazily on first use so it binds to the running event loop
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Shared keep-alive session with bounded connection pool"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=settings.MCP_MAX_CONNECTIONS,
+                limit_per_host=settings.MCP_MAX_CONNECTIONS_PER_HOST,
+                keepalive_timeout=settings.MCP_KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                json_serialize=lambda obj: orjson.dumps(obj).decode("utf-8"),
+                raise_for_status=True
+            )
+        return self._session
+
+    async def close(self):
+        """Close the shared session (called on application shutdown)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _call_tool(
+        self,
+        base_url: str,
+        tool: str,
+        arguments: Dict[str, Any],
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """POST a tool call to an MCP server and return its JSON result"""
+        session = self._get_session()
+        client_timeout = aiohttp.ClientTimeout(total=timeout or settings.MCP_REQUEST_TIMEOUT)
+
+        async with session.post(
+            f"{base_url}/tools/{tool}",
+            json=arguments,
+            timeout=client_timeout
+        ) as response:
+            return await response.json(loads=orjson.loads)
 
     async def spawn_perplexity_agent(self, goal: str) -> Dict[str, Any]:
         """
@@ -20,20 +78,7 @@ class MCPClient:
         Uses mcp__mvae__spawn_agent with vendor='perplexity'
         """
         logger.info(f"Spawning Perplexity agent: {goal[:100]}...")
-
-        # In production, this would call the MCP tool
-        # For now, we'll simulate the response structure
-        # TODO: Integrate with actual MVAE MCP when deployed
-
-        return {
-            "agent_id": "perplexity-123",
-            "status": "succeeded",
-            "result": {
-                "research": "Detailed research on the topic...",
-                "key_points": ["Point 1", "Point 2", "Point 3"],
-                "suggested_chapters": 15
-            }
-        }
+        return await self._spawn_and_wait(goal, vendor="perplexity")
 
     async def spawn_claude_agent(self, goal: str, vendor: str = "anthropic") -> Dict[str, Any]:
         """
@@ -41,31 +86,113 @@ class MCPClient:
         Uses mcp__mvae__spawn_agent with vendor='anthropic'
         """
         logger.info(f"Spawning Claude agent ({vendor}): {goal[:100]}...")
+        return await self._spawn_and_wait(goal, vendor=vendor)
+
+    async def _spawn_and_wait(self, goal: str, vendor: str) -> Dict[str, Any]:
+        """Spawn an agent and wait for its final status"""
+        agent = await self._call_tool(
+            settings.MVAE_MCP_URL,
+            "spawn_agent",
+            {"goal": goal, "vendor": vendor}
+        )
+        if agent.get("status") in TERMINAL_AGENT_STATUSES:
+            return self._check_agent_result(agent)
+        return await self.wait_for_agent(agent["agent_id"])
+
+    async def get_agent_status(self, agent_id: str, wait: float = 0) -> Dict[str, Any]:
+        """
+        Check status of a running agent
+        Uses mcp__mvae__get_agent_status. With wait > 0 the server may hold
+        the request open (long-poll) until the status changes or wait expires.
+        """
+        arguments: Dict[str, Any] = {"agent_id": agent_id}
+        if wait > 0:
+            arguments["wait"] = wait
+
+        return await self._call_tool(
+            settings.MVAE_MCP_URL,
+            "get_agent_status",
+            arguments,
+            timeout=wait + settings.MCP_REQUEST_TIMEOUT
+        )
+
+    async def wait_for_agent(self, agent_id: str, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Wait until an agent reaches a terminal status.
+
+        Each poll asks the server to long-poll. If the server answers early
+        (no long-poll support, or still running), the next poll is delayed
+        with full-jitter exponential backoff so many concurrent agents do
+        not poll in lockstep.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or settings.MCP_AGENT_TIMEOUT)
+        delay = settings.MCP_POLL_INITIAL_DELAY
+
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise MCPError(f"Agent {agent_id} did not finish in time")
 
-        # TODO: Integrate with actual MVAE MCP
-        return {
-            "agent_id": "claude-456",
-            "status": "succeeded",
-            "result": "Generated content..."
-        }
-
-    async def get_agent_status(self, agent_id: str) -> Dict[str, Any]:
-        """Check status of a running agent"""
-        # TODO: Use mcp__mvae__get_agent_status
-        return {
-            "agent_id": agent_id,
-            "status": "running",
-            "progress": 50
-        }
+            wait = min(settings.MCP_LONG_POLL_SECONDS, remaining)
+            started = loop.time()
+            try:
+                status = await self.get_agent_status(agent_id, wait=wait)
+            except aiohttp.ClientResponseError as e:
+                # A 4xx (bad request, auth) will not fix itself by polling
+                if e.status < 500:
+                    raise MCPError(f"Agent status request for {agent_id} rejected: {e.status} {e.message}") from e
+                logger.warning(f"⚠️ Agent status poll failed for {agent_id}: {e}")
+                status = None
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                logger.warning(f"⚠️ Agent status poll failed for {agent_id}: {e}")
+                status = None
+
+            if status is not None and status.get("status") in TERMINAL_AGENT_STATUSES:
+                return self._check_agent_result(status)
+
+            if status is not None and loop.time() - started >= wait / 2:
+                # Server held the request: poll again right away
+                delay = settings.MCP_POLL_INITIAL_DELAY
+                continue
+
+            await asyncio.sleep(min(random.uniform(0, delay), max(deadline - loop.time(), 0)))
+            delay = min(delay * 2, settings.MCP_POLL_MAX_DELAY)
+
+    @staticmethod
+    def _check_agent_result(agent: Dict[str, Any]) -> Dict[str, Any]:
+        if agent.get("status") != "succeeded":
+            raise MCPError(
+                f"Agent {agent.get('agent_id')} {agent.get('status')}: {agent.get('error', 'no details')}"
+            )
+        return agent
 
     async def generate_image(self, prompt: str, output_path: str) -> str:
         """
         Generate image using Gemini MCP (Imagen 4)
         Uses mcp__gemini-mcp__gemini_generate_image
+
+        The server may answer with raw image bytes or with JSON carrying a
+        base64 `image_base64` field; either way the image is written to
+        output_path.
         """
         logger.info(f"Generating image: {prompt[:100]}...")
 
-        # TODO: Use mcp__gemini-mcp__gemini_generate_image
+        session = self._get_session()
+        timeout = aiohttp.ClientTimeout(total=settings.IMAGE_GENERATION_TIMEOUT)
+
+        async with session.post(
+            f"{settings.GEMINI_MCP_URL}/tools/gemini_generate_image",
+            json={"prompt": prompt},
+            timeout=timeout
+        ) as response:
+            if response.content_type.startswith("image/"):
+                image_data = await response.read()
+            else:
+                payload = await response.json(loads=orjson.loads)
+                image_data = base64.b64decode(payload["image_base64"])
+
+        await storage_io.write_bytes(Path(output_path), image_data)
         return output_path
 
 # Singleton instance
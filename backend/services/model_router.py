@@ -0,0 +1,175 @@
+"""
+Model routing
+Maps (phase, length tier, add-ons) to a model chain, max_tokens and
+temperature from settings, and records latency, token usage and cost per
+route and model in this worker
+"""
+import contextvars
+import logging
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Phases the generators route on
+PHASE_OUTLINE = "outline"
+PHASE_PREVIEW_CHAPTER = "preview_chapter"
+PHASE_CHAPTER = "chapter"
+
+WILDCARD = "*"
+
+# Weight of the newest sample in the latency moving average
+EWMA_ALPHA = 0.2
+
+# Token counter for the calls made inside ModelRouter.metered()
+_meter: contextvars.ContextVar[Optional["TokenMeter"]] = contextvars.ContextVar("token_meter", default=None)
+
+
+@dataclass(frozen=True)
+class Route:
+    key: str
+    models: List[str]
+    max_tokens: int
+    temperature: float
+
+
+@dataclass
+class RouteStats:
+    calls: int = 0
+    failures: int = 0
+    fallbacks: int = 0
+    latency_ewma: Optional[float] = None
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost_usd: float = 0.0
+    models: Dict[str, int] = field(default_factory=dict)
+
+
+@dataclass
+class TokenMeter:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class ModelRouter:
+    """Resolve routes from MODEL_ROUTES and keep per-route statistics"""
+
+    def __init__(self):
+        self._stats: Dict[str, RouteStats] = {}
+
+    def route(self, phase: str, length: Optional[str] = None, add_ons: Iterable[str] = ()) -> Route:
+        """
+        Most specific match wins: phase:length:add_on, phase:length:*,
+        phase:*:add_on, then phase:*:*. Entries are merged over the phase
+        default so a specific route only needs the fields it changes.
+        """
+        routes = settings.MODEL_ROUTES
+        lengths = [length, WILDCARD] if length else [WILDCARD]
+        add_ons = [*sorted(add_ons), WILDCARD]
+
+        config: Dict[str, Any] = {
+            "models": [settings.OPENAI_DEFAULT_MODEL],
+            "max_tokens": 8000,
+            "temperature": 0.7,
+        }
+        key = f"{phase}:{WILDCARD}:{WILDCARD}"
+        config.update(routes.get(key, {}))
+
+        for tier in lengths:
+            match = next((f"{phase}:{tier}:{add_on}" for add_on in add_ons
+                          if f"{phase}:{tier}:{add_on}" in routes), None)
+            if match is not None:
+                key = match
+                config.update(routes[match])
+                break
+
+        return Route(
+            key=key,
+            models=list(config["models"]),
+            max_tokens=int(config["max_tokens"]),
+            temperature=float(config["temperature"])
+        )
+
+    # -- Statistics ----------------------------------------------------------
+
+    def record(
+        self,
+        route: Route,
+        model: str,
+        latency: float,
+        usage: Any = None,
+        fallback: bool = False,
+        discount: float = 1.0
+    ):
+        """
+        One successful call on `model` (fallback: not the route's first
+        choice; discount: price multiplier, e.g. for the Batch API)
+        """
+        stats = self._stats.setdefault(route.key, RouteStats())
+        stats.calls += 1
+        stats.fallbacks += int(fallback)
+        stats.models[model] = stats.models.get(model, 0) + 1
+        stats.latency_ewma = latency if stats.latency_ewma is None else (
+            (1 - EWMA_ALPHA) * stats.latency_ewma + EWMA_ALPHA * latency
+        )
+
+        if usage is not None:
+            prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+            completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+            stats.cost_usd += self.cost(model, prompt_tokens, completion_tokens, discount)
+
+            meter = _meter.get()
+            if meter is not None:
+                meter.prompt_tokens += prompt_tokens
+                meter.completion_tokens += completion_tokens
+
+    @contextmanager
+    def metered(self):
+        """Count the tokens of every call made in this context (and tasks it starts)"""
+        meter = TokenMeter()
+        token = _meter.set(meter)
+        try:
+            yield meter
+        finally:
+            _meter.reset(token)
+
+    def record_failure(self, route: Route, model: str, error: Exception):
+        stats = self._stats.setdefault(route.key, RouteStats())
+        stats.failures += 1
+        logger.warning(f"⚠️ Model {model} failed on route {route.key}: {error}")
+
+    @staticmethod
+    def cost(model: str, prompt_tokens: int, completion_tokens: int, discount: float = 1.0) -> float:
+        """USD for one call from MODEL_PRICES (per million input/output tokens)"""
+        prices = settings.MODEL_PRICES.get(model)
+        if not prices:
+            return 0.0
+        return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000 * discount
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            key: {
+                "calls": stats.calls,
+                "failures": stats.failures,
+                "fallbacks": stats.fallbacks,
+                "latency_ms": round(stats.latency_ewma * 1000) if stats.latency_ewma is not None else None,
+                "prompt_tokens": stats.prompt_tokens,
+                "completion_tokens": stats.completion_tokens,
+                "cost_usd": round(stats.cost_usd, 4),
+                "models": stats.models,
+            }
+            for key, stats in self._stats.items()
+        }
+
+
+# Singleton instance
+model_router = ModelRouter()
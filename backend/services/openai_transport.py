@@ -0,0 +1,84 @@
+"""
+Shared HTTP transport for the OpenAI client
+One tuned httpx connection pool per worker (HTTP/2 when available), with
+connection reuse counters taken from httpcore's trace events
+"""
+import logging
+from collections import Counter
+from typing import Any, Dict
+
+import httpx
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class TransportStats:
+    """Requests, new connections and negotiated HTTP versions in this worker"""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.errors = 0
+        self.http_versions: Counter = Counter()
+
+    async def on_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def on_response(self, response: httpx.Response):
+        self.http_versions[response.http_version] += 1
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]):
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+        elif event_name.endswith(".failed"):
+            self.errors += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        reused = max(self.requests - self.connections_opened, 0)
+        return {
+            "http2": settings.OPENAI_HTTP2 and HTTP2_AVAILABLE,
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "connections_reused": reused,
+            "reuse_ratio": round(reused / self.requests, 3) if self.requests else None,
+            "transport_errors": self.errors,
+            "http_versions": dict(self.http_versions),
+        }
+
+
+def phase_timeout(read_timeout: float) -> httpx.Timeout:
+    """Timeouts for one call phase (outline and chapter reads differ)"""
+    return httpx.Timeout(
+        connect=settings.OPENAI_CONNECT_TIMEOUT,
+        read=read_timeout,
+        write=settings.OPENAI_WRITE_TIMEOUT,
+        pool=settings.OPENAI_POOL_TIMEOUT
+    )
+
+
+def build_http_client(stats: TransportStats) -> httpx.AsyncClient:
+    """Pooled client shared by every OpenAI call in this worker"""
+    http2 = settings.OPENAI_HTTP2
+    if http2 and not HTTP2_AVAILABLE:
+        logger.warning("⚠️ OPENAI_HTTP2 is set but h2 is not installed, using HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.OPENAI_KEEPALIVE_EXPIRY
+        ),
+        timeout=phase_timeout(settings.OPENAI_CHAPTER_READ_TIMEOUT),
+        event_hooks={"request": [stats.on_request], "response": [stats.on_response]}
+    )
@@ -0,0 +1,272 @@
+"""
+Parallel PDF rendering
+Front matter and each chapter are rendered by separate pandoc/xelatex
+processes, cached by content hash and stitched with continuous page numbers
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import subprocess
+import uuid
+import weakref
+from pathlib import Path
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+from pypdf import PdfReader, PdfWriter
+
+from app.config import settings
+from services.export_builder import load_outline
+from services.illustration_generator import illustration_path, IMAGES_DIR
+from services import storage_io
+
+logger = logging.getLogger(__name__)
+
+# Cached renders: <book_folder>/pdf_cache/<sha256>.pdf
+PDF_CACHE_DIR = "pdf_cache"
+
+# Bump when the pandoc arguments or page layout change to invalidate caches
+PDF_TEMPLATE_VERSION = "1"
+
+PANDOC_PDF_ARGS = [
+    "--pdf-engine=xelatex",
+    "-V", "geometry:margin=1in",
+]
+
+# Pandoc markdown allows backslash-escaping any ASCII punctuation
+MARKDOWN_PUNCTUATION = set("\\`*_{}[]()#+-.!$%&~^|<>\"'")
+
+# One render semaphore per event loop: asyncio primitives bind to the loop
+# that first waits on them, and manage.py runs a new loop per book
+_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def render_slot_count(processes: Optional[int] = None) -> int:
+    """
+    Concurrent pandoc/xelatex processes for this process. Unless
+    PDF_RENDER_WORKERS is set, the CPU cores are divided among the
+    `processes` rendering on this host (default: the API workers).
+    """
+    if settings.PDF_RENDER_WORKERS:
+        return settings.PDF_RENDER_WORKERS
+    processes = processes or settings.WEB_CONCURRENCY
+    return max(1, (os.cpu_count() or 1) // max(processes, 1))
+
+
+def _render_slots(slots: Optional[int] = None) -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(slots or render_slot_count())
+    return semaphore
+
+
+def _markdown_escape(text: str) -> str:
+    return "".join(f"\\{char}" if char in MARKDOWN_PUNCTUATION else char for char in text)
+
+
+def _content_hash(*parts: str) -> str:
+    digest = hashlib.sha256(PDF_TEMPLATE_VERSION.encode("utf-8"))
+    for part in parts:
+        digest.update(b"\0")
+        digest.update(part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _image_fingerprint(image: Path) -> str:
+    """Cheap identity of an illustration (changes when it is replaced)"""
+    if not image.exists():
+        return ""
+    stat = image.stat()
+    return f"{image.name}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+async def _render_markdown(
+    book_folder: Path,
+    markdown_text: str,
+    digest: str,
+    pagestyle: str = "empty"
+) -> Path:
+    """Render markdown to a cached PDF named after its content hash"""
+    cache_folder = book_folder / PDF_CACHE_DIR
+    output_file = cache_folder / f"{digest}.pdf"
+    if await storage_io.exists(output_file):
+        return output_file
+
+    # Unique scratch names: concurrent downloads may render the same digest
+    scratch = f"{digest}.{uuid.uuid4().hex}"
+    source_file = cache_folder / f"{scratch}.md"
+    tmp_file = cache_folder / f"{scratch}.tmp.pdf"
+    await storage_io.run(source_file.write_text, markdown_text, encoding="utf-8")
+
+    command = [
+        "pandoc", str(source_file), "-o", str(tmp_file),
+        *PANDOC_PDF_ARGS,
+        "-V", f"pagestyle={pagestyle}",
+        "--resource-path", str(book_folder),
+    ]
+
+    async with _render_slots():
+        process = await asyncio.create_subprocess_exec(
+            *command,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        _, stderr = await process.communicate()
+
+    await storage_io.run(source_file.unlink, missing_ok=True)
+    if process.returncode != 0:
+        await storage_io.run(tmp_file.unlink, missing_ok=True)
+        raise subprocess.CalledProcessError(process.returncode, command, stderr=stderr)
+
+    await storage_io.run(os.replace, tmp_file, output_file)
+    return output_file
+
+
+def _chapter_markdown(book_folder: Path, chapter_num: int) -> str:
+    name = f"chapter_{chapter_num:02d}"
+    markdown_text = (book_folder / f"{name}.md").read_text(encoding="utf-8")
+    if illustration_path(book_folder, name).exists():
+        markdown_text += f"\n\n![Chapter {chapter_num} illustration]({IMAGES_DIR}/{name}.png)\n"
+    return markdown_text
+
+
+def _front_matter_markdown(
+    book_folder: Path,
+    outline: Dict[str, Any],
+    start_pages: List[int]
+) -> str:
+    """Title page plus a table of contents with final page numbers"""
+    lines = [
+        f"# {outline['title']}",
+        "",
+        f"*{outline['subtitle']}*",
+        "",
+    ]
+    if illustration_path(book_folder, "cover").exists():
+        lines += [f"![]({IMAGES_DIR}/cover.png)", ""]
+
+    lines += ["\\newpage", "", "# Contents", ""]
+    for chapter_num, (chapter, page) in enumerate(zip(outline["chapters"], start_pages), start=1):
+        title = _markdown_escape(f"Chapter {chapter_num}: {chapter['title']}")
+        lines += [f"\\noindent {title} \\dotfill {page}", ""]
+    return "\n".join(lines) + "\n"
+
+
+def _page_count(pdf_file: Path) -> int:
+    return len(PdfReader(str(pdf_file)).pages)
+
+
+def _stitch(
+    output_file: Path,
+    front_matter: Path,
+    chapter_pdfs: List[Path],
+    numbers_pdf: Path,
+    outline: Dict[str, Any],
+    start_pages: List[int]
+):
+    """Merge front matter and chapters, stamping continuous page numbers"""
+    writer = PdfWriter()
+    for page in PdfReader(str(front_matter)).pages:
+        writer.add_page(page)
+    front_pages = len(writer.pages)
+
+    numbers = PdfReader(str(numbers_pdf)).pages
+    body_index = 0
+    for chapter_pdf in chapter_pdfs:
+        for page in PdfReader(str(chapter_pdf)).pages:
+            added = writer.add_page(page)
+            added.merge_page(numbers[body_index])
+            body_index += 1
+
+    for chapter_num, (chapter, page) in enumerate(zip(outline["chapters"], start_pages), start=1):
+        writer.add_outline_item(f"Chapter {chapter_num}: {chapter['title']}", front_pages + page - 1)
+
+    with storage_io.atomic_open(output_file, "wb") as f:
+        writer.write(f)
+
+
+def _load_sources(book_folder: Path) -> Tuple[Dict[str, Any], List[str], List[str], str]:
+    """Outline, chapter sources and their content hashes (blocking)"""
+    outline = load_outline(book_folder)
+    (book_folder / PDF_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+
+    chapter_sources = [
+        _chapter_markdown(book_folder, chapter_num)
+        for chapter_num in range(1, len(outline["chapters"]) + 1)
+    ]
+    chapter_hashes = [
+        _content_hash("chapter", source, _image_fingerprint(illustration_path(book_folder, f"chapter_{n:02d}")))
+        for n, source in enumerate(chapter_sources, start=1)
+    ]
+    book_hash = _content_hash(
+        "book", repr(outline), _image_fingerprint(illustration_path(book_folder, "cover")), *chapter_hashes
+    )
+    return outline, chapter_sources, chapter_hashes, book_hash
+
+
+def _is_current(output_file: Path, marker_file: Path, book_hash: str) -> bool:
+    return output_file.exists() and marker_file.exists() and marker_file.read_text() == book_hash
+
+
+def _prune_cache(cache_folder: Path, keep: Set[str]):
+    for cached in cache_folder.glob("*.pdf"):
+        if cached.name not in keep and ".tmp." not in cached.name:
+            cached.unlink(missing_ok=True)
+
+
+async def render_book_pdf(book_folder: Path, slots: Optional[int] = None) -> Path:
+    """
+    Render book.pdf from the chapter files.
+    Only chapters whose content changed since the last render are re-rendered.
+    `slots` overrides the render concurrency of a new event loop.
+    """
+    _render_slots(slots)
+    output_file = book_folder / "book.pdf"
+    cache_folder = book_folder / PDF_CACHE_DIR
+    marker_file = cache_folder / "book.sha256"
+    outline, chapter_sources, chapter_hashes, book_hash = await storage_io.run(_load_sources, book_folder)
+    chapter_count = len(outline["chapters"])
+
+    # The whole book is unchanged: reuse the previous stitch
+    if await storage_io.run(_is_current, output_file, marker_file, book_hash):
+        logger.info(f"📄 PDF up to date: {book_folder.name}")
+        return output_file
+
+    logger.info(f"Rendering {chapter_count} chapters to PDF in parallel...")
+    chapter_pdfs = await asyncio.gather(*(
+        _render_markdown(book_folder, source, digest)
+        for source, digest in zip(chapter_sources, chapter_hashes)
+    ))
+
+    page_counts = await storage_io.run(lambda: [_page_count(pdf) for pdf in chapter_pdfs])
+    start_pages = []
+    next_page = 1
+    for count in page_counts:
+        start_pages.append(next_page)
+        next_page += count
+    body_pages = next_page - 1
+
+    front_source = _front_matter_markdown(book_folder, outline, start_pages)
+    numbers_source = "\\null\n\\newpage\n" * body_pages
+    front_matter, numbers_pdf = await asyncio.gather(
+        _render_markdown(
+            book_folder, front_source,
+            _content_hash("front", front_source, _image_fingerprint(illustration_path(book_folder, "cover")))
+        ),
+        _render_markdown(book_folder, numbers_source, _content_hash("numbers", str(body_pages)), pagestyle="plain")
+    )
+
+    await storage_io.run(
+        _stitch, output_file, front_matter, list(chapter_pdfs), numbers_pdf, outline, start_pages
+    )
+    await storage_io.write_text(marker_file, book_hash)
+
+    # Drop renders of chapter versions that are no longer part of the book
+    keep = {pdf.name for pdf in (*chapter_pdfs, front_matter, numbers_pdf)}
+    await storage_io.run(_prune_cache, cache_folder, keep)
+
+    logger.info(f"✅ PDF stitched: {body_pages} pages + front matter")
+    return output_file
@@ -0,0 +1,251 @@
+"""
+Preview pre-generation
+Mines recent preview requests for hot topic/option combinations and, while
+the service is idle and within a daily token budget, generates previews for
+them ahead of time. A matching /preview request claims one instantly.
+"""
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+import asyncpg
+
+from app.config import settings
+from app.database import get_db
+from services.admission import admission_controller
+from services.book_generator import book_generator
+from services.model_router import model_router
+
+logger = logging.getLogger(__name__)
+
+# Session lock held by the one worker that runs the scheduler
+PREGEN_LOCK_ID = 727002
+
+BUDGET_WINDOW_SECONDS = 86400
+
+
+def normalize_topic(topic: str) -> str:
+    return " ".join(topic.lower().split())
+
+
+def pool_key(topic: str, audience: str, length: str, style: str) -> str:
+    """Identity of a pre-generated preview (no user, no extra instructions)"""
+    fields = [normalize_topic(topic), audience, length, style]
+    return hashlib.sha256("\0".join(fields).encode("utf-8")).hexdigest()
+
+
+class PreviewPool:
+    """Claims ready previews and, on the leader worker, keeps the pool stocked"""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._lock_conn: Optional[asyncpg.Connection] = None
+
+    # -- Claiming ------------------------------------------------------------
+
+    async def claim(
+        self,
+        topic: str,
+        audience: str,
+        length: str,
+        style: str
+    ) -> Optional[Dict[str, Any]]:
+        """Take one ready preview for this combination, if any (never blocks on others)"""
+        if not settings.PREGEN_ENABLED:
+            return None
+
+        pool = await get_db()
+        async with pool.acquire() as conn:
+            row = await conn.fetchrow("""
+                DELETE FROM preview_pool
+                WHERE pool_id = (
+                    SELECT pool_id FROM preview_pool
+                    WHERE pool_key = $1 AND created_at > $2
+                    ORDER BY created_at
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING outline, chapter_1, estimated_pages, price
+            """,
+                pool_key(topic, audience, length, style),
+                datetime.utcnow() - timedelta(hours=settings.PREGEN_MAX_AGE_HOURS)
+            )
+
+        if row is None:
+            return None
+
+        outline = row["outline"]
+        estimated_seconds = admission_controller.estimate_book_seconds(len(outline["chapters"]) - 1)
+        return {
+            "outline": outline,
+            "chapter_1": row["chapter_1"],
+            "estimated_pages": row["estimated_pages"],
+            "price": int(row["price"]),
+            "estimated_time": admission_controller.format_duration(estimated_seconds)
+        }
+
+    # -- Scheduler -----------------------------------------------------------
+
+    async def budget_left(self, conn: asyncpg.Connection) -> int:
+        """
+        Tokens left in the rolling daily budget. Spend is persisted, so
+        restarts and leader changes do not reset it
+        """
+        spent = await conn.fetchval(
+            "SELECT COALESCE(SUM(tokens), 0) FROM pregen_spend WHERE spent_at > $1",
+            datetime.utcnow() - timedelta(seconds=BUDGET_WINDOW_SECONDS)
+        )
+        return settings.PREGEN_DAILY_TOKEN_BUDGET - spent
+
+    async def _is_leader(self) -> bool:
+        """Only one worker pre-generates, so the budget is counted in one place"""
+        if self._lock_conn is not None and not self._lock_conn.is_closed():
+            return True
+
+        self._lock_conn = await asyncpg.connect(settings.DATABASE_URL)
+        if await self._lock_conn.fetchval("SELECT pg_try_advisory_lock($1)", PREGEN_LOCK_ID):
+            logger.info("🧺 This worker runs preview pre-generation")
+            return True
+
+        await self._lock_conn.close()
+        self._lock_conn = None
+        return False
+
+    async def _is_idle(self, conn: asyncpg.Connection) -> bool:
+        """Nothing running here and little preview traffic across workers"""
+        if (admission_controller.previews_running or admission_controller.previews_waiting
+                or admission_controller.chapters_pending):
+            return False
+
+        recent = await conn.fetchval(
+            "SELECT COUNT(*) FROM books WHERE created_at > $1",
+            datetime.utcnow() - timedelta(minutes=5)
+        )
+        return recent <= settings.PREGEN_IDLE_MAX_RECENT_PREVIEWS
+
+    async def _cycle(self):
+        """One scheduler run: expire stale entries, then stock hot combinations"""
+        pool = await get_db()
+        async with pool.acquire() as conn:
+            await conn.execute(
+                "DELETE FROM preview_pool WHERE created_at < $1",
+                datetime.utcnow() - timedelta(hours=settings.PREGEN_MAX_AGE_HOURS)
+            )
+            await conn.execute(
+                "DELETE FROM pregen_spend WHERE spent_at < $1",
+                datetime.utcnow() - timedelta(seconds=BUDGET_WINDOW_SECONDS)
+            )
+
+            if await self.budget_left(conn) <= 0 or not await self._is_idle(conn):
+                return
+
+            # Hot combinations (only requests without extra instructions),
+            # grouped on the normalized topic but generated from the spelling
+            # customers use most, so titles keep their capitalization
+            candidates = await conn.fetch("""
+                SELECT lower(regexp_replace(btrim(topic), '\\s+', ' ', 'g')) AS topic,
+                       mode() WITHIN GROUP (ORDER BY regexp_replace(btrim(topic), '\\s+', ' ', 'g')) AS spelling,
+                       audience, length, style, COUNT(*) AS requests
+                FROM books
+                WHERE created_at > $1
+                  AND COALESCE(additional_instructions, '') = ''
+                GROUP BY 1, audience, length, style
+                HAVING COUNT(*) >= $2
+                ORDER BY requests DESC
+                LIMIT $3
+            """,
+                datetime.utcnow() - timedelta(days=settings.PREGEN_LOOKBACK_DAYS),
+                settings.PREGEN_MIN_REQUESTS,
+                settings.PREGEN_MAX_COMBINATIONS
+            )
+
+            stock = {
+                row["pool_key"].strip(): row["ready"]
+                for row in await conn.fetch(
+                    "SELECT pool_key, COUNT(*) AS ready FROM preview_pool GROUP BY pool_key"
+                )
+            }
+
+        for candidate in candidates:
+            key = pool_key(candidate["topic"], candidate["audience"], candidate["length"], candidate["style"])
+            if stock.get(key, 0) >= settings.PREGEN_POOL_TARGET:
+                continue
+
+            # Re-check before every generation: traffic may have picked up
+            async with pool.acquire() as conn:
+                if await self.budget_left(conn) <= 0 or not await self._is_idle(conn):
+                    return
+
+            await self._pregenerate(key, candidate)
+
+    async def _pregenerate(self, key: str, candidate: asyncpg.Record):
+        logger.info(
+            f"🧺 Pre-generating preview for '{candidate['spelling']}' "
+            f"({candidate['audience']}, {candidate['length']}, {candidate['style']}; "
+            f"{candidate['requests']} recent requests)"
+        )
+        with model_router.metered() as meter:
+            preview_data = await book_generator.generate_preview(
+                topic=candidate["spelling"],
+                audience=candidate["audience"],
+                length=candidate["length"],
+                style=candidate["style"]
+            )
+        pool = await get_db()
+        async with pool.acquire() as conn:
+            # Recorded apart from the entry: claiming it must not refund the budget
+            await conn.execute(
+                "INSERT INTO pregen_spend (tokens, spent_at) VALUES ($1, $2)",
+                meter.total, datetime.utcnow()
+            )
+            await conn.execute("""
+                INSERT INTO preview_pool (
+                    pool_key, topic, audience, length, style, outline,
+                    chapter_1, estimated_pages, price, tokens_used
+                ) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
+            """,
+                key,
+                candidate["spelling"],
+                candidate["audience"],
+                candidate["length"],
+                candidate["style"],
+                preview_data["outline"],
+                preview_data["chapter_1"],
+                preview_data["estimated_pages"],
+                preview_data["price"],
+                meter.total
+            )
+            budget_left = await self.budget_left(conn)
+
+        logger.info(f"✅ Pre-generated preview stored ({meter.total} tokens, {budget_left} left today)")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.PREGEN_INTERVAL)
+            try:
+                if await self._is_leader():
+                    await self._cycle()
+            except Exception as e:
+                logger.error(f"❌ Preview pre-generation failed: {e}")
+
+    def start(self):
+        if settings.PREGEN_ENABLED and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._lock_conn is not None:
+            await self._lock_conn.close()
+            self._lock_conn = None
+
+
+# Singleton instance
+preview_pool = PreviewPool()
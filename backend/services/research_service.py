@@ -0,0 +1,126 @@
+"""
+Topic research via Perplexity agents (MVAE MCP)
+Results are cached per normalized topic with TTL eviction and fed into
+chapter prompts as compact background context
+"""
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+
+from app.config import settings
+from services.mcp_client import mcp_client
+from services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+class ResearchService:
+    """Shared, TTL-bounded research cache in front of the Perplexity agent"""
+
+    def __init__(self):
+        # normalized topic -> (expires_at, context), least recently used first
+        self._cache: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._in_flight = SingleFlight()
+
+    @staticmethod
+    def normalize_topic(topic: str) -> str:
+        """Case/whitespace/punctuation-insensitive cache key"""
+        topic = re.sub(r"[^\w\s]", " ", topic.lower())
+        return " ".join(topic.split())
+
+    async def get_context(self, topic: str) -> str:
+        """
+        Return compact research context for a topic ("" if research is
+        disabled or fails). Concurrent callers for the same topic share
+        one research run.
+        """
+        if not settings.RESEARCH_ENABLED:
+            return ""
+
+        key = self.normalize_topic(topic)
+        cached = self._get_cached(key)
+        if cached is not None:
+            return cached
+
+        try:
+            return await self._in_flight.do(key, lambda: self._research(topic, key))
+        except Exception as e:
+            logger.warning(f"⚠️ Research failed for '{topic[:60]}': {e}")
+            return ""
+
+    async def wait_for_context(self, task: "asyncio.Task[str]") -> str:
+        """
+        Wait briefly for a research task started in parallel with other work.
+        If it is not ready within RESEARCH_WAIT_TIMEOUT, proceed without it;
+        the research keeps running and lands in the cache for later chapters.
+        """
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), settings.RESEARCH_WAIT_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.info("Research not ready yet, continuing without it")
+            return ""
+
+    def _get_cached(self, key: str) -> Optional[str]:
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+
+        expires_at, context = entry
+        if expires_at <= time.monotonic():
+            del self._cache[key]
+            return None
+
+        self._cache.move_to_end(key)
+        return context
+
+    def _store(self, key: str, context: str):
+        now = time.monotonic()
+        self._cache[key] = (now + settings.RESEARCH_CACHE_TTL, context)
+        self._cache.move_to_end(key)
+
+        # Drop expired entries, then least recently used ones over the limit
+        for stale_key in [k for k, (expires_at, _) in self._cache.items() if expires_at <= now]:
+            del self._cache[stale_key]
+        while len(self._cache) > settings.RESEARCH_CACHE_MAX_ENTRIES:
+            self._cache.popitem(last=False)
+
+    async def _research(self, topic: str, key: str) -> str:
+        logger.info(f"🔎 Researching topic: {topic[:100]}")
+
+        response = await mcp_client.spawn_perplexity_agent(
+            f"Research the topic '{topic}' for a non-fiction book. "
+            f"Summarize the most important facts, current developments, "
+            f"common misconceptions and reputable examples."
+        )
+        context = self._compact(response.get("result"))
+        self._store(key, context)
+
+        logger.info(f"✅ Research cached for '{key[:60]}' ({len(context)} chars)")
+        return context
+
+    @staticmethod
+    def _compact(result: Any) -> str:
+        """Reduce an agent result to a short context block for prompts"""
+        if isinstance(result, dict):
+            parts = []
+            key_points = result.get("key_points") or []
+            if key_points:
+                parts.append("Key facts:\n" + "\n".join(f"- {point}" for point in key_points))
+            if result.get("research"):
+                parts.append(str(result["research"]))
+            text = "\n\n".join(parts)
+        else:
+            text = str(result or "")
+
+        text = text.strip()
+        limit = settings.RESEARCH_MAX_CONTEXT_CHARS
+        if len(text) > limit:
+            text = text[:limit].rsplit(" ", 1)[0] + "..."
+        return text
+
+
+# Singleton instance
+research_service = ResearchService()
@@ -0,0 +1,102 @@
+"""
+Async storage I/O
+Blocking filesystem work runs on a small dedicated thread pool instead of the
+event loop; writes go to a temp file that is renamed into place, so readers
+(downloads, early-access chapters) never see a partially written file
+"""
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.STORAGE_IO_WORKERS,
+            thread_name_prefix="storage-io"
+        )
+    return _executor
+
+
+async def run(fn: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking storage function on the I/O pool (keeps log context)"""
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    call = functools.partial(fn, *args, **kwargs)
+    return await loop.run_in_executor(_get_executor(), context.run, call)
+
+
+def shutdown():
+    """Wait for pending writes and stop the pool threads"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+
+
+# -- Atomic writes (blocking) -------------------------------------------------
+
+def _tmp_path(path: Path) -> Path:
+    # Unique per writer; same directory so the rename stays atomic
+    return path.with_name(f".{path.name}.{uuid.uuid4().hex}.tmp")
+
+
+@contextmanager
+def atomic_open(path: Path, mode: str = "w", encoding: Optional[str] = "utf-8"):
+    """Open a temp file that replaces `path` only if the block succeeds"""
+    path = Path(path)
+    tmp = _tmp_path(path)
+    if "b" in mode:
+        encoding = None
+    try:
+        with open(tmp, mode, encoding=encoding) as f:
+            yield f
+        os.replace(tmp, path)
+    finally:
+        tmp.unlink(missing_ok=True)
+
+
+def atomic_write_text(path: Path, text: str, encoding: str = "utf-8"):
+    with atomic_open(path, "w", encoding=encoding) as f:
+        f.write(text)
+
+
+def atomic_write_bytes(path: Path, data: bytes):
+    with atomic_open(path, "wb") as f:
+        f.write(data)
+
+
+# -- Async wrappers -----------------------------------------------------------
+
+async def write_text(path: Path, text: str, encoding: str = "utf-8"):
+    await run(atomic_write_text, path, text, encoding)
+
+
+async def write_bytes(path: Path, data: bytes):
+    await run(atomic_write_bytes, path, data)
+
+
+async def read_text(path: Path, encoding: str = "utf-8") -> str:
+    return await run(Path(path).read_text, encoding=encoding)
+
+
+async def exists(path: Path) -> bool:
+    return await run(Path(path).exists)
+
+
+async def mkdir(path: Path):
+    await run(Path(path).mkdir, parents=True, exist_ok=True)
@@ -0,0 +1,230 @@
+"""
+Book storage manager
+Tracks per-book disk usage and access time, evicts regenerable artifacts
+(PDF/DOCX/EPUB, render caches) in LRU order under a disk budget and packs
+cold books' markdown into one archive that is re-expanded on access
+"""
+import asyncio
+import fcntl
+import logging
+import os
+import shutil
+import tarfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional
+
+from app.config import settings
+from services import storage_io
+from services.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Regenerable from the chapter files. Per-chapter DOCX/EPUB fragments are
+# kept: only generation builds them, and without them downloads fall back to
+# whole-book pandoc for good
+DERIVED_FILES = ("book.pdf", "book.docx", "book.epub")
+DERIVED_DIRS = ("pdf_cache",)
+
+# Cold books keep their text here; images stay as they are
+ARCHIVE_NAME = "archive.tar.gz"
+ARCHIVED_GLOBS = ("*.md", "outline.json")
+
+# mtime of this file is the book's last access time
+ACCESS_MARKER = ".last_access"
+
+# Only one worker process sweeps at a time
+SWEEP_LOCK_NAME = ".storage_sweep.lock"
+
+
+@dataclass
+class BookUsage:
+    folder: Path
+    size: int
+    derived_size: int
+    last_access: float
+    archived: bool
+    complete: bool
+
+
+def _tree_size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+class StorageManager:
+    """Keep /app/storage/books within its disk budget without losing downloads"""
+
+    def __init__(self):
+        self.root = Path(settings.STORAGE_DIR)
+        self._expanding = SingleFlight()
+        self._task: Optional[asyncio.Task] = None
+
+    def book_folder(self, book_id: str) -> Path:
+        return self.root / book_id
+
+    def touch(self, book_id: str):
+        """Record an access (cheap: one utime on a marker file)"""
+        marker = self.book_folder(book_id) / ACCESS_MARKER
+        try:
+            marker.touch()
+        except FileNotFoundError:
+            pass
+
+    async def open_book(self, book_id: str) -> Path:
+        """
+        Return the book folder for reading, restoring archived markdown
+        first if needed, and record the access
+        """
+        folder = self.book_folder(book_id)
+        if await storage_io.exists(folder / ARCHIVE_NAME):
+            await self._expanding.do(book_id, lambda: storage_io.run(self.restore_archive, folder))
+        await storage_io.run(self.touch, book_id)
+        return folder
+
+    # -- Archive -------------------------------------------------------------
+
+    def restore_archive(self, folder: Path):
+        """Unpack an archived book in place (blocking)"""
+        archive = folder / ARCHIVE_NAME
+        if not archive.exists():
+            return
+
+        with tarfile.open(archive, "r:gz") as tar:
+            tar.extractall(folder, filter="data")
+        archive.unlink()
+        logger.info(f"📦 Restored archived book: {folder.name}")
+
+    def _archive(self, folder: Path) -> int:
+        """Pack markdown into one archive; returns bytes freed"""
+        files = sorted({f for pattern in ARCHIVED_GLOBS for f in folder.glob(pattern)})
+        if not files:
+            return 0
+
+        before = sum(f.stat().st_size for f in files)
+        tmp_archive = folder / f"{ARCHIVE_NAME}.tmp"
+        with tarfile.open(tmp_archive, "w:gz") as tar:
+            for f in files:
+                tar.add(f, arcname=f.name)
+        os.replace(tmp_archive, folder / ARCHIVE_NAME)
+
+        for f in files:
+            f.unlink()
+
+        freed = before - (folder / ARCHIVE_NAME).stat().st_size
+        logger.info(f"📦 Archived cold book {folder.name} ({before} -> {before - freed} bytes)")
+        return freed
+
+    # -- Eviction ------------------------------------------------------------
+
+    def _evict_derived(self, folder: Path) -> int:
+        """Delete regenerable artifacts; returns bytes freed"""
+        freed = 0
+        for name in DERIVED_FILES:
+            path = folder / name
+            if path.exists():
+                freed += path.stat().st_size
+                path.unlink()
+        for name in DERIVED_DIRS:
+            path = folder / name
+            if path.exists():
+                freed += _tree_size(path)
+                shutil.rmtree(path, ignore_errors=True)
+        return freed
+
+    def _last_access(self, folder: Path) -> float:
+        marker = folder / ACCESS_MARKER
+        try:
+            return marker.stat().st_mtime
+        except FileNotFoundError:
+            return folder.stat().st_mtime
+
+    def scan(self) -> List[BookUsage]:
+        """Size and last access of every book folder"""
+        usages = []
+        if not self.root.exists():
+            return usages
+
+        for folder in self.root.iterdir():
+            if not folder.is_dir():
+                continue
+            last_access = self._last_access(folder)
+            derived_size = sum(
+                _tree_size(folder / name)
+                for name in (*DERIVED_FILES, *DERIVED_DIRS)
+                if (folder / name).exists()
+            )
+            usages.append(BookUsage(
+                folder=folder,
+                size=_tree_size(folder),
+                derived_size=derived_size,
+                last_access=last_access,
+                archived=(folder / ARCHIVE_NAME).exists(),
+                complete=(folder / "full_book.md").exists() or (folder / ARCHIVE_NAME).exists()
+            ))
+        return usages
+
+    def enforce(self):
+        """One sweep: archive cold books, then evict derived artifacts LRU-first"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / SWEEP_LOCK_NAME, "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # another worker is sweeping
+
+            usages = self.scan()
+            total = sum(usage.size for usage in usages)
+            cold_before = time.time() - settings.STORAGE_ARCHIVE_AFTER_DAYS * 86400
+
+            for usage in usages:
+                if usage.complete and not usage.archived and usage.last_access < cold_before:
+                    # Re-checked right before acting: the scan may be stale
+                    if self._last_access(usage.folder) >= cold_before:
+                        continue
+                    freed = self._evict_derived(usage.folder) + self._archive(usage.folder)
+                    usage.derived_size = 0
+                    total -= freed
+
+            if total > settings.STORAGE_BUDGET_BYTES:
+                target = settings.STORAGE_BUDGET_BYTES * settings.STORAGE_LOW_WATERMARK
+                for usage in sorted(usages, key=lambda u: u.last_access):
+                    if total <= target:
+                        break
+                    # A book opened since the scan may be mid-download
+                    if usage.derived_size and self._last_access(usage.folder) <= usage.last_access:
+                        total -= self._evict_derived(usage.folder)
+
+            logger.info(
+                f"🧹 Storage sweep: {len(usages)} books, {total / 2**30:.2f} GiB "
+                f"of {settings.STORAGE_BUDGET_BYTES / 2**30:.2f} GiB budget"
+            )
+
+    # -- Background sweeper --------------------------------------------------
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.enforce)
+            except Exception as e:
+                logger.error(f"❌ Storage sweep failed: {e}")
+            await asyncio.sleep(settings.STORAGE_SWEEP_INTERVAL)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+# Singleton instance
+storage_manager = StorageManager()
@@ -6,8 +6,10 @@ from app.config import settings
 
 logger = logging.getLogger(__name__)
 
-# Configure Stripe
-stripe.api_key = settings.STRIPE_SECRET_KEY
+def _configure_stripe():
+    """Configure Stripe on first use rather than at import"""
+    if stripe.api_key != settings.STRIPE_SECRET_KEY:
+        stripe.api_key = settings.STRIPE_SECRET_KEY
 
 # Add-on prices (in dollars)
 # NOTE: Frontend sends extra illustrations count, 1 cover image is FREE
@@ -32,6 +34,7 @@ class StripeService:
         """
         Create a Stripe PaymentIntent for the book purchase
         """
+        _configure_stripe()
         try:
             # Calculate total
             add_ons_total = sum(ADD_ON_PRICES.get(addon, 0) for addon in add_ons)
@@ -77,6 +80,7 @@ class StripeService:
         """
         Verify that a payment was successful
         """
+        _configure_stripe()
         try:
             payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
 
@@ -93,6 +97,7 @@ class StripeService:
 
     def get_payment_status(self, payment_intent_id: str) -> str:
         """Get payment intent status"""
+        _configure_stripe()
         try:
             payment_intent = stripe.PaymentIntent.retrieve(payment_intent_id)
             return payment_intent.status
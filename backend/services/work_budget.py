@@ -0,0 +1,104 @@
+"""
+Per-worker work budget
+Bounds the chapters in flight and their estimated memory in this process.
+Each chapter takes one slot while it generates and is saved; chapters that
+do not fit wait in a FIFO queue instead of piling more responses into memory.
+"""
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def read_rss_bytes() -> Optional[int]:
+    """Current resident set size of this process (Linux /proc), None elsewhere"""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+class WorkBudget:
+    """Worker-wide chapter slots, bounded by chapter count and bytes, granted in FIFO order"""
+
+    def __init__(self):
+        self.chapters_in_use = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def max_chapters(self) -> int:
+        return max(settings.WORKER_MAX_INFLIGHT_CHAPTERS, 1)
+
+    @property
+    def max_bytes(self) -> int:
+        return settings.WORKER_MAX_INFLIGHT_BYTES
+
+    @property
+    def slots(self) -> int:
+        """Chapters allowed in flight: the chapter cap or the byte budget, whichever is lower"""
+        by_bytes = self.max_bytes // max(settings.WORKER_CHAPTER_BYTES_ESTIMATE, 1)
+        return max(1, min(self.max_chapters, by_bytes))
+
+    @property
+    def bytes_in_use(self) -> int:
+        return self.chapters_in_use * settings.WORKER_CHAPTER_BYTES_ESTIMATE
+
+    def would_wait(self) -> bool:
+        """A chapter queued now would not start right away"""
+        return bool(self._waiters) or self.chapters_in_use >= self.slots
+
+    def _grant_waiters(self):
+        # Slots go to chapters in arrival order, across all books
+        while self._waiters and self.chapters_in_use < self.slots:
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.chapters_in_use += 1
+            waiter.set_result(None)
+
+    def _release(self):
+        self.chapters_in_use -= 1
+        self._grant_waiters()
+
+    @asynccontextmanager
+    async def chapter(self):
+        """Hold one chapter slot (waiting in line if needed) until the block exits"""
+        if not self._waiters and self.chapters_in_use < self.slots:
+            self.chapters_in_use += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release()  # granted just before the cancel
+                raise
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "rss_bytes": read_rss_bytes(),
+            "chapters_in_use": self.chapters_in_use,
+            "chapters_queued": sum(1 for waiter in self._waiters if not waiter.done()),
+            "chapters_max": self.slots,
+            "bytes_in_use": self.bytes_in_use,
+            "bytes_max": self.max_bytes,
+        }
+
+
+# Singleton instance
+work_budget = WorkBudget()
@@ -0,0 +1,249 @@
+"""Batch API chapters: results, SLA fallback, resume after a stopped worker, shutdown"""
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import orjson
+import pytest
+
+from app.config import settings
+from services import batch_generator as batch_module
+from services.batch_generator import BatchGenerator
+
+BOOK_ID = "7f1c1f4e-2b1a-4c53-9a57-4a2d1b0c9e11"
+
+
+class FakeConnection:
+    """The batch_requests statements BatchGenerator issues, kept in a dict"""
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def execute(self, query, *args):
+        if "INSERT INTO batch_requests" in query:
+            custom_id, book_id, chapter_num = args
+            self.rows[custom_id] = {
+                "custom_id": custom_id, "book_id": book_id, "chapter_num": chapter_num,
+                "batch_id": None, "waited": 0.0,
+            }
+        elif "DELETE FROM batch_requests WHERE custom_id" in query:
+            self.rows.pop(args[0], None)
+        elif "SET batch_id" in query:
+            for custom_id in args[1]:
+                self.rows[custom_id]["batch_id"] = args[0]
+
+    async def fetchrow(self, query, book_id, chapter_num):
+        matches = [row for row in self.rows.values()
+                   if row["book_id"] == book_id and row["chapter_num"] == chapter_num]
+        return dict(matches[-1], created_at=None) if matches else None
+
+
+class FakePool:
+    def __init__(self):
+        self.rows = {}
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield FakeConnection(self.rows)
+
+
+class FakeStream:
+    def __init__(self, lines):
+        self.lines = lines
+
+    async def iter_lines(self):
+        for line in self.lines:
+            yield line
+
+
+class FakeBatchClient:
+    """
+    Batch API that completes a batch after `polls_to_finish` retrieves,
+    answering each request with `answer(custom_id)` (a result line dict)
+    """
+
+    def __init__(self, answer=None, polls_to_finish=1):
+        self.answer = answer or (lambda custom_id: {
+            "custom_id": custom_id,
+            "response": {"status_code": 200, "body": {
+                "model": "gpt-4o",
+                "choices": [{"message": {"content": f"batch text for {custom_id}"}}],
+            }},
+        })
+        self.polls_to_finish = polls_to_finish
+        self.requests = {}  # batch_id -> custom_ids
+        self.polls = {}
+        self.cancelled = []
+        self.files = SimpleNamespace(
+            create=self._create_file,
+            with_streaming_response=SimpleNamespace(content=self._content)
+        )
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._retrieve, cancel=self._cancel)
+        self._uploads = {}
+
+    async def _create_file(self, file, purpose):
+        name, content = file
+        self._uploads[name] = [orjson.loads(line)["custom_id"] for line in content.split(b"\n")]
+        return SimpleNamespace(id=name)
+
+    async def _create_batch(self, input_file_id, endpoint, completion_window):
+        batch_id = f"batch_{len(self.requests) + 1}"
+        self.requests[batch_id] = self._uploads[input_file_id]
+        return SimpleNamespace(id=batch_id)
+
+    async def _retrieve(self, batch_id):
+        self.polls[batch_id] = self.polls.get(batch_id, 0) + 1
+        if self.polls[batch_id] < self.polls_to_finish:
+            return SimpleNamespace(status="in_progress", output_file_id=None, error_file_id=None)
+        return SimpleNamespace(status="completed", output_file_id=f"out_{batch_id}", error_file_id=None)
+
+    async def _cancel(self, batch_id):
+        self.cancelled.append(batch_id)
+
+    @asynccontextmanager
+    async def _content(self, file_id):
+        batch_id = file_id.removeprefix("out_")
+        yield FakeStream([orjson.dumps(self.answer(c)).decode() for c in self.requests[batch_id]])
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_COLLECT_SECONDS", 0.01)
+    monkeypatch.setattr(settings, "BATCH_POLL_INTERVAL", 0.01)
+    monkeypatch.setattr(settings, "BATCH_SLA_SECONDS", 5.0)
+    monkeypatch.setattr(settings, "BATCH_MAX_REQUESTS", 100)
+
+    pool = FakePool()
+
+    async def get_db():
+        return pool
+
+    live_calls = []
+
+    async def generate_chapter(chapter_num, **kwargs):
+        live_calls.append(chapter_num)
+        return f"live text for chapter {chapter_num}"
+
+    client = FakeBatchClient()
+    generator = SimpleNamespace(
+        client=client,
+        build_chapter_prompt=lambda *args: "prompt",
+        generate_chapter=generate_chapter
+    )
+    monkeypatch.setattr(batch_module, "get_db", get_db)
+    monkeypatch.setattr(batch_module, "ai_generator", generator)
+    return SimpleNamespace(pool=pool, client=client, ai=generator, live_calls=live_calls)
+
+
+def chapter_args(chapter_num):
+    return dict(
+        book_id=BOOK_ID,
+        chapter_num=chapter_num,
+        chapter_info={"title": f"Chapter {chapter_num}"},
+        book_title="Book",
+        audience="general",
+        style="casual"
+    )
+
+
+def test_chapters_from_many_calls_share_one_batch(fakes):
+    async def scenario():
+        batches = BatchGenerator()
+        return await asyncio.gather(*(batches.generate_chapter(**chapter_args(n)) for n in (2, 3, 4)))
+
+    contents = asyncio.run(scenario())
+    assert len(fakes.client.requests) == 1
+    assert all(content.startswith("batch text for chapter-") for content in contents)
+    assert fakes.live_calls == []
+    assert fakes.pool.rows == {}  # resolved requests are unrecorded
+
+
+def test_sla_at_risk_switches_to_a_live_call(fakes, monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_SLA_SECONDS", 0.05)
+    fakes.client.polls_to_finish = 10_000
+
+    async def scenario():
+        batches = BatchGenerator()
+        content = await batches.generate_chapter(**chapter_args(2))
+        await asyncio.sleep(0.05)  # poller notices nobody waits and cancels
+        return content
+
+    assert asyncio.run(scenario()) == "live text for chapter 2"
+    assert fakes.live_calls == [2]
+    assert fakes.client.cancelled == ["batch_1"]
+    assert fakes.pool.rows == {}
+
+
+def test_failed_result_switches_to_a_live_call(fakes):
+    fakes.client.answer = lambda custom_id: {
+        "custom_id": custom_id,
+        "response": {"status_code": 500, "body": {"error": {"message": "server error"}}},
+    }
+
+    async def scenario():
+        return await BatchGenerator().generate_chapter(**chapter_args(2))
+
+    assert asyncio.run(scenario()) == "live text for chapter 2"
+    assert fakes.live_calls == [2]
+
+
+def test_resumes_a_request_a_stopped_worker_submitted(fakes):
+    fakes.pool.rows["chapter-2-old"] = {
+        "custom_id": "chapter-2-old", "book_id": BOOK_ID, "chapter_num": 2,
+        "batch_id": "batch_old", "waited": 1.0,
+    }
+    fakes.client.requests["batch_old"] = ["chapter-2-old"]
+
+    async def scenario():
+        return await BatchGenerator().generate_chapter(**chapter_args(2))
+
+    assert asyncio.run(scenario()) == "batch text for chapter-2-old"
+    assert list(fakes.client.requests) == ["batch_old"]  # nothing resubmitted
+    assert fakes.live_calls == []
+    assert fakes.pool.rows == {}
+
+
+def test_resume_past_the_sla_goes_live(fakes, monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_SLA_SECONDS", 30.0)
+    fakes.client.polls_to_finish = 10_000
+    fakes.pool.rows["chapter-2-old"] = {
+        "custom_id": "chapter-2-old", "book_id": BOOK_ID, "chapter_num": 2,
+        "batch_id": "batch_old", "waited": 60.0,
+    }
+    fakes.client.requests["batch_old"] = ["chapter-2-old"]
+
+    async def scenario():
+        return await BatchGenerator().generate_chapter(**chapter_args(2))
+
+    assert asyncio.run(scenario()) == "live text for chapter 2"
+    assert fakes.live_calls == [2]
+
+
+def test_unsubmitted_record_is_queued_again(fakes):
+    fakes.pool.rows["chapter-2-old"] = {
+        "custom_id": "chapter-2-old", "book_id": BOOK_ID, "chapter_num": 2,
+        "batch_id": None, "waited": 60.0,
+    }
+
+    async def scenario():
+        return await BatchGenerator().generate_chapter(**chapter_args(2))
+
+    content = asyncio.run(scenario())
+    assert content.startswith("batch text for chapter-2-")
+    assert "chapter-2-old" not in fakes.client.requests["batch_1"]
+
+
+def test_stop_cancels_waiters_without_a_live_call_and_keeps_records(fakes):
+    fakes.client.polls_to_finish = 10_000
+
+    async def scenario():
+        batches = BatchGenerator()
+        waiter = asyncio.create_task(batches.generate_chapter(**chapter_args(2)))
+        await asyncio.sleep(0.05)  # submitted and polling
+        await batches.stop()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+    asyncio.run(scenario())
+    assert fakes.live_calls == []
+    assert [row["batch_id"] for row in fakes.pool.rows.values()] == ["batch_1"]
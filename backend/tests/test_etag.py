@@ -0,0 +1,38 @@
+"""ETag helpers"""
+from types import SimpleNamespace
+
+from app.api.etag import not_modified, text_etag
+
+
+def request_with(if_none_match=None):
+    headers = {"if-none-match": if_none_match} if if_none_match is not None else {}
+    return SimpleNamespace(headers=headers)
+
+
+def test_text_etag_is_quoted_and_stable():
+    etag = text_etag("chapter one")
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag == text_etag("chapter one")
+    assert etag != text_etag("chapter two")
+
+
+def test_no_header_is_modified():
+    assert not not_modified(request_with(), text_etag("x"))
+
+
+def test_matching_tag_in_list():
+    etag = text_etag("x")
+    assert not_modified(request_with(f'"other", {etag}'), etag)
+
+
+def test_weak_tag_matches():
+    etag = text_etag("x")
+    assert not_modified(request_with(f"W/{etag}"), etag)
+
+
+def test_wildcard_matches():
+    assert not_modified(request_with("*"), text_etag("x"))
+
+
+def test_different_tag_is_modified():
+    assert not not_modified(request_with(text_etag("y")), text_etag("x"))
@@ -0,0 +1,64 @@
+"""Repair of outline JSON truncated at max_tokens"""
+import json
+
+import pytest
+
+from services.json_repair import JSONRepairError, repair_json_depth
+
+OUTLINE = {
+    "title": "T",
+    "subtitle": "S",
+    "chapters": [
+        {"number": 1, "title": "A", "focus": "fa", "key_points": ["a1", "a2"]},
+        {"number": 2, "title": "B", "focus": "fb", "key_points": ["b1", "b2"]},
+    ],
+}
+TEXT = json.dumps(OUTLINE)
+
+
+def cut_after(marker: str) -> str:
+    return TEXT[:TEXT.index(marker) + len(marker)]
+
+
+def test_complete_json_closes_nothing():
+    assert repair_json_depth(TEXT) == (OUTLINE, 0)
+
+
+def test_code_fence_and_prose_are_ignored():
+    value, closed = repair_json_depth(f"Here you go:\n```json\n{TEXT}\n```\nEnjoy!")
+    assert value == OUTLINE
+    assert closed == 0
+
+
+def test_cut_mid_string_drops_the_partial_field():
+    value, closed = repair_json_depth(cut_after('"title": "B", "focus": "f'))
+    assert value["chapters"][1] == {"number": 2, "title": "B"}
+    assert closed == 3  # chapter object, chapters array, outline object
+
+
+def test_cut_mid_array_keeps_the_chapter_open():
+    value, closed = repair_json_depth(cut_after('"b1", "b'))
+    assert value["chapters"][1]["key_points"] == ["b1"]
+    assert closed == 4  # key_points array, chapter, chapters, outline
+
+
+def test_trailing_comma_after_last_chapter():
+    value, closed = repair_json_depth(cut_after('"b2"]}') + ", ")
+    assert value == OUTLINE
+    assert closed == 2  # only chapters array and outline: every chapter is whole
+
+
+def test_trailing_comma_inside_array():
+    value, closed = repair_json_depth(cut_after('"b1",'))
+    assert value["chapters"][1]["key_points"] == ["b1"]
+    assert closed == 4
+
+
+def test_no_json_raises():
+    with pytest.raises(JSONRepairError):
+        repair_json_depth("Sorry, I can't help with that.")
+
+
+def test_unrepairable_raises():
+    with pytest.raises(JSONRepairError):
+        repair_json_depth('{"title": "T')
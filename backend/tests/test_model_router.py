@@ -0,0 +1,130 @@
+"""Route resolution and model fallback chains"""
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import openai
+import pytest
+
+from app.config import settings
+from services.ai_generator import AIGenerator
+from services.model_router import PHASE_CHAPTER, PHASE_OUTLINE, ModelRouter
+
+ROUTES = {
+    "chapter:*:*": {"models": ["base"], "max_tokens": 4000},
+    "chapter:long:*": {"models": ["long-primary", "long-fallback"]},
+    "chapter:long:rush": {"models": ["rush"], "temperature": 0.2},
+    "chapter:*:academic": {"max_tokens": 12000},
+}
+
+
+@pytest.fixture(autouse=True)
+def routes(monkeypatch):
+    monkeypatch.setattr(settings, "MODEL_ROUTES", ROUTES)
+    monkeypatch.setattr(settings, "OPENAI_DEFAULT_MODEL", "default")
+
+
+def test_phase_default():
+    route = ModelRouter().route(PHASE_CHAPTER, "short")
+    assert route.key == "chapter:*:*"
+    assert route.models == ["base"]
+    assert route.max_tokens == 4000
+    assert route.temperature == 0.7
+
+
+def test_length_route_merges_over_the_phase_default():
+    route = ModelRouter().route(PHASE_CHAPTER, "long")
+    assert route.key == "chapter:long:*"
+    assert route.models == ["long-primary", "long-fallback"]
+    assert route.max_tokens == 4000
+
+
+def test_length_and_add_on_is_most_specific():
+    route = ModelRouter().route(PHASE_CHAPTER, "long", ["illustrations", "rush"])
+    assert route.key == "chapter:long:rush"
+    assert route.models == ["rush"]
+    assert route.temperature == 0.2
+
+
+def test_add_on_route_for_any_length():
+    route = ModelRouter().route(PHASE_CHAPTER, "medium", ["academic"])
+    assert route.key == "chapter:*:academic"
+    assert route.models == ["base"]
+    assert route.max_tokens == 12000
+
+
+def test_unrouted_phase_uses_the_default_model():
+    route = ModelRouter().route(PHASE_OUTLINE, "long")
+    assert route.models == ["default"]
+
+
+# -- Fallback along the chain ------------------------------------------------
+
+REQUEST = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+
+
+def status_error(cls, status):
+    return cls(f"HTTP {status}", response=httpx.Response(status, request=REQUEST), body=None)
+
+
+def generator_with(outcomes):
+    """AIGenerator whose client answers each model from `outcomes` (error or text)"""
+    calls = []
+
+    async def create(model, **kwargs):
+        calls.append(model)
+        outcome = outcomes[model]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return SimpleNamespace(
+            model=model,
+            usage=None,
+            choices=[SimpleNamespace(message=SimpleNamespace(content=outcome))]
+        )
+
+    generator = AIGenerator()
+    generator._client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    return generator, calls
+
+
+def complete(generator, route):
+    response = asyncio.run(generator._complete(route, "prompt", timeout=30))
+    return response.choices[0].message.content
+
+
+@pytest.mark.parametrize("error", [
+    openai.APIConnectionError(request=REQUEST),
+    openai.APITimeoutError(request=REQUEST),
+    status_error(openai.RateLimitError, 429),
+    status_error(openai.InternalServerError, 503),
+])
+def test_retryable_errors_fall_back_to_the_next_model(error):
+    route = ModelRouter().route(PHASE_CHAPTER, "long")
+    generator, calls = generator_with({"long-primary": error, "long-fallback": "text"})
+    assert complete(generator, route) == "text"
+    assert calls == ["long-primary", "long-fallback"]
+
+
+@pytest.mark.parametrize("error", [
+    status_error(openai.BadRequestError, 400),
+    status_error(openai.AuthenticationError, 401),
+])
+def test_non_retryable_errors_do_not_fall_back(error):
+    route = ModelRouter().route(PHASE_CHAPTER, "long")
+    generator, calls = generator_with({"long-primary": error, "long-fallback": "text"})
+    with pytest.raises(type(error)):
+        complete(generator, route)
+    assert calls == ["long-primary"]
+
+
+def test_last_error_is_raised_when_every_model_fails():
+    route = ModelRouter().route(PHASE_CHAPTER, "long")
+    last = status_error(openai.InternalServerError, 502)
+    generator, calls = generator_with({
+        "long-primary": openai.APIConnectionError(request=REQUEST),
+        "long-fallback": last,
+    })
+    with pytest.raises(openai.InternalServerError) as raised:
+        complete(generator, route)
+    assert raised.value is last
+    assert calls == ["long-primary", "long-fallback"]
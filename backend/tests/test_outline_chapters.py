@@ -0,0 +1,51 @@
+"""Which chapters of a repaired outline are kept"""
+import json
+
+from services.ai_generator import CHAPTER_DEPTH, _repair_response, _valid_chapters
+
+CHAPTERS = [
+    {"number": 1, "title": "A", "focus": "fa", "key_points": ["a1", "a2"]},
+    {"number": 2, "title": "B", "focus": "fb", "key_points": ["b1", "b2"]},
+]
+TEXT = json.dumps({"title": "T", "subtitle": "S", "chapters": CHAPTERS})
+
+
+def kept(text: str):
+    data, closed = _repair_response(text)
+    return _valid_chapters(data["chapters"], closed)
+
+
+def cut_after(marker: str) -> str:
+    return TEXT[:TEXT.index(marker) + len(marker)]
+
+
+def test_complete_outline_keeps_every_chapter():
+    assert kept(TEXT) == CHAPTERS
+
+
+def test_cut_mid_string_drops_the_partial_chapter():
+    assert kept(cut_after('"title": "B", "focus": "f')) == CHAPTERS[:1]
+
+
+def test_cut_mid_array_drops_the_chapter_even_though_it_validates():
+    # key_points ["b1"] is a valid chapter, but it was cut short
+    assert kept(cut_after('"b1", "b')) == CHAPTERS[:1]
+
+
+def test_trailing_comma_keeps_whole_chapters():
+    assert kept(cut_after('"b2"]}') + ", ") == CHAPTERS
+
+
+def test_stops_at_the_first_invalid_chapter():
+    items = [CHAPTERS[0], {"number": 2}, CHAPTERS[1]]
+    assert _valid_chapters(items) == CHAPTERS[:1]
+
+
+def test_closed_below_chapter_depth_keeps_the_last_chapter():
+    assert _valid_chapters(CHAPTERS, CHAPTER_DEPTH - 1) == CHAPTERS
+    assert _valid_chapters(CHAPTERS, CHAPTER_DEPTH) == CHAPTERS[:1]
+
+
+def test_unrepairable_response():
+    assert _repair_response("no json here") == (None, 0)
+    assert _valid_chapters(None) == []
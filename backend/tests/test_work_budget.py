@@ -0,0 +1,97 @@
+"""Worker-wide chapter slots"""
+import asyncio
+
+import pytest
+
+from app.config import settings
+from services.work_budget import WorkBudget
+
+
+@pytest.fixture
+def two_slots(monkeypatch):
+    monkeypatch.setattr(settings, "WORKER_MAX_INFLIGHT_CHAPTERS", 2)
+    monkeypatch.setattr(settings, "WORKER_CHAPTER_BYTES_ESTIMATE", 1)
+    monkeypatch.setattr(settings, "WORKER_MAX_INFLIGHT_BYTES", 100)
+
+
+def test_slots_are_the_lower_of_chapter_and_byte_caps(monkeypatch, two_slots):
+    assert WorkBudget().slots == 2
+    monkeypatch.setattr(settings, "WORKER_MAX_INFLIGHT_BYTES", 1)
+    assert WorkBudget().slots == 1
+
+
+def test_waiters_are_granted_in_arrival_order(two_slots):
+    async def scenario():
+        budget = WorkBudget()
+        started = []
+        releases = {name: asyncio.Event() for name in "abcde"}
+
+        async def chapter(name):
+            async with budget.chapter():
+                started.append(name)
+                await releases[name].wait()
+
+        tasks = []
+        for name in "abcde":
+            tasks.append(asyncio.create_task(chapter(name)))
+            await asyncio.sleep(0)
+
+        assert started == ["a", "b"]
+        assert budget.would_wait()
+        assert budget.snapshot()["chapters_queued"] == 3
+
+        # Whichever chapter finishes, the next in line gets its slot
+        releases["b"].set()
+        await asyncio.sleep(0.01)
+        assert started == ["a", "b", "c"]
+        releases["a"].set()
+        await asyncio.sleep(0.01)
+        assert started == ["a", "b", "c", "d"]
+
+        for event in releases.values():
+            event.set()
+        await asyncio.gather(*tasks)
+        return budget
+
+    budget = asyncio.run(scenario())
+    assert budget.chapters_in_use == 0
+    assert not budget.would_wait()
+
+
+def test_cancelled_waiter_gives_up_its_place(two_slots):
+    async def scenario():
+        budget = WorkBudget()
+        started = []
+        release = asyncio.Event()
+
+        async def chapter(name):
+            async with budget.chapter():
+                started.append(name)
+                await release.wait()
+
+        holders = [asyncio.create_task(chapter(name)) for name in "ab"]
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(chapter("c"))
+        waiting = asyncio.create_task(chapter("d"))
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(*holders, waiting)
+        return budget, started
+
+    budget, started = asyncio.run(scenario())
+    assert started == ["a", "b", "d"]
+    assert budget.chapters_in_use == 0
+
+
+def test_slot_is_released_when_the_chapter_fails(two_slots):
+    async def scenario():
+        budget = WorkBudget()
+        with pytest.raises(RuntimeError):
+            async with budget.chapter():
+                raise RuntimeError("generation failed")
+        return budget
+
+    assert asyncio.run(scenario()).chapters_in_use == 0